@@ -1,6 +1,11 @@
 from jchord.core import Note
 from jchord.chords import Intervals, Chord, InvalidChord
-from jchord.progressions import ChordProgression, Song, MidiConversionSettings
+from jchord.progressions import (
+    ChordProgression,
+    Song,
+    MidiConversionSettings,
+    MidiTrackSettings,
+)
 
 # Workaround for pyflakes
 assert Note
@@ -10,3 +15,4 @@ assert InvalidChord
 assert ChordProgression
 assert Song
 assert MidiConversionSettings
+assert MidiTrackSettings
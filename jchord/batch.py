@@ -0,0 +1,260 @@
+"""
+Tools for converting many chord progressions at once, in parallel.
+"""
+from collections import deque, namedtuple
+import glob
+from itertools import islice
+import json
+import os
+import random
+import time
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from jchord.midi import MidiNoteCache
+from jchord.progressions import ChordProgression, MidiConversionSettings
+
+RenderResult = namedtuple("RenderResult", "index, filename, error")
+RenderResult.__doc__ = """
+The result of rendering one of the progressions in ``render_many``.
+``error`` is None if the progression was rendered, and a description of the error otherwise.
+"""
+
+
+def _describe_error(error: Exception) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+def _iter_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_in_pool(
+    func: Callable[[Any], Any], jobs: Iterable[Any], workers: int, ordered: bool = True
+) -> Iterator[Any]:
+    """
+    Yields ``func(job)`` for each job, computed in a pool of processes.
+    If ordered is True, the results come in the order of the jobs, and otherwise as they finish.
+    Only a few jobs per worker are submitted at a time, so the jobs can come from a long iterator.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(func, job))
+            if len(pending) < 4 * workers:
+                continue
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _seed_for(seed: int, index: int) -> str:
+    return f"{seed}:{index}"
+
+
+def _render_chunk(
+    job: Tuple[
+        Callable[[int, ChordProgression], MidiConversionSettings],
+        int,
+        List[Tuple[int, ChordProgression]],
+    ]
+) -> List[RenderResult]:
+    settings_factory, seed, chunk = job
+    results = []
+    for index, progression in chunk:
+        filename = None
+        try:
+            settings = settings_factory(index, progression)
+            filename = settings.filename
+            # The global random number generator is seeded for each progression, so the result
+            # doesn't depend on which worker renders it or what it rendered before
+            random.seed(_seed_for(seed, index))
+            progression.to_midi(settings)
+        except Exception as error:
+            results.append(RenderResult(index, filename, _describe_error(error)))
+        else:
+            results.append(RenderResult(index, filename, None))
+    return results
+
+
+def render_many(
+    progressions: Iterable[ChordProgression],
+    settings_factory: Callable[[int, ChordProgression], MidiConversionSettings],
+    workers: Optional[int] = None,
+    chunk_size: int = 16,
+    seed: int = 0,
+) -> List[RenderResult]:
+    """
+    Renders each progression to a MIDI file, and returns a ``RenderResult`` for each of them,
+    in the same order as the progressions.
+
+    An error in one progression doesn't stop the others from being rendered; it is reported
+    in the result for that progression instead.
+
+    The global random number generator is seeded with ``seed`` and the index of the progression
+    before each progression is rendered, so effects which use it give the same result
+    whatever the number of workers.
+
+    Parameters:
+    * progressions: the progressions
+    * settings_factory: ``settings_factory(index, progression)`` returns the settings for the
+      progression with the given index. With several workers, it must be possible to pickle it
+      (e.g. a function defined at the top level of a module)
+    * workers: the number of processes to render in (by default, 1, which renders in this process)
+    * chunk_size: the number of progressions which are sent to a worker at a time
+    * seed: the seed for the random number generator
+    """
+    jobs = (
+        (settings_factory, seed, chunk)
+        for chunk in _iter_chunks(enumerate(progressions), chunk_size)
+    )
+    if workers and workers > 1:
+        return [
+            result
+            for chunk in _iter_in_pool(_render_chunk, jobs, workers)
+            for result in chunk
+        ]
+
+    state = random.getstate()
+    try:
+        return [result for job in jobs for result in _render_chunk(job)]
+    finally:
+        random.setstate(state)
+
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+
+CorpusStats = namedtuple("CorpusStats", "n_files, n_chords, failures, seconds")
+CorpusStats.__doc__ = """
+Statistics for ``extract_corpus``: the number of files and chords read so far,
+``(filename, error)`` for each file which couldn't be read, and the time taken in seconds.
+"""
+
+
+def iter_midi_files(
+    sources: Union[str, Iterable[str]], extensions: Tuple[str, ...] = MIDI_EXTENSIONS
+) -> Iterator[str]:
+    """
+    Yields the MIDI files in the given sources, each of which is a directory (searched recursively
+    for files with the given extensions, in any case), a glob pattern (where ``**`` matches
+    any number of directories) or a filename. The files in each source are sorted by name.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+    for source in sources:
+        if os.path.isdir(source):
+            for directory, subdirectories, filenames in os.walk(source):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(extensions):
+                        yield os.path.join(directory, filename)
+        else:
+            yield from sorted(glob.glob(source, recursive=True))
+
+
+def _extract_file(
+    job: Tuple[str, Optional[MidiNoteCache]]
+) -> Tuple[str, Optional[List[str]], Optional[str]]:
+    filename, cache = job
+    try:
+        progression = ChordProgression.from_midi_file(filename, cache)
+    except Exception as error:
+        return filename, None, _describe_error(error)
+    return filename, [chord.name for chord in progression.progression], None
+
+
+def extract_corpus(
+    sources: Union[str, Iterable[str]],
+    output: TextIO,
+    output_format: str = "jsonl",
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[CorpusStats], None]] = None,
+    cache: Union[MidiNoteCache, str, None] = None,
+) -> CorpusStats:
+    """
+    Reads the chord progression in each of the MIDI files in the sources
+    (see ``iter_midi_files``), and writes one line to ``output`` for each file.
+
+    With several workers, the files are read in a pool of processes, and the lines are written
+    as soon as each file has been read, so they may not be in the same order as the files.
+
+    Parameters:
+    * sources: directories, glob patterns or filenames
+    * output: where to write the results
+    * output_format: "jsonl" for a JSON object per file, ``{"file": ..., "chords": [...]}``,
+      or ``{"file": ..., "error": ...}`` if the file couldn't be read; or "text" for the filename,
+      a tab and the names of the chords separated by spaces (files with errors are left out)
+    * workers: the number of processes to read files in (by default, 1, which reads in this process)
+    * progress: if given, ``progress(stats)`` is called with the statistics so far after each file
+    * cache: a MidiNoteCache, or the directory for one, to keep the notes in each file in,
+      so they are read faster the next time
+
+    Returns the statistics for all the files.
+    """
+    if output_format not in ("jsonl", "text"):
+        raise ValueError(
+            f"Unknown output format {output_format!r}, should be 'jsonl' or 'text'"
+        )
+    start_time = time.perf_counter()
+    n_files = 0
+    n_chords = 0
+    failures = []
+
+    if isinstance(cache, str):
+        cache = MidiNoteCache(cache)
+    jobs = ((filename, cache) for filename in iter_midi_files(sources))
+    if workers and workers > 1:
+        results = _iter_in_pool(_extract_file, jobs, workers, ordered=False)
+    else:
+        results = map(_extract_file, jobs)
+
+    for filename, chords, error in results:
+        n_files += 1
+        if error is not None:
+            failures.append((filename, error))
+            if output_format == "jsonl":
+                output.write(json.dumps({"file": filename, "error": error}) + "\n")
+        else:
+            n_chords += len(chords)
+            if output_format == "jsonl":
+                output.write(json.dumps({"file": filename, "chords": chords}) + "\n")
+            else:
+                output.write(f"{filename}\t{' '.join(chords)}\n")
+        if progress is not None:
+            progress(
+                CorpusStats(
+                    n_files, n_chords, failures, time.perf_counter() - start_time
+                )
+            )
+    return CorpusStats(n_files, n_chords, failures, time.perf_counter() - start_time)
+
+
+def format_corpus_stats(stats: CorpusStats) -> str:
+    """Returns a one-line summary of the statistics, including the throughput."""
+    files_per_second = stats.n_files / stats.seconds if stats.seconds else 0
+    return (
+        f"{stats.n_files} files ({len(stats.failures)} failed), {stats.n_chords} chords "
+        f"in {stats.seconds:.1f} s ({files_per_second:.1f} files/s)"
+    )
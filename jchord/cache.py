@@ -0,0 +1,247 @@
+"""
+Caches of files in a directory, which are kept below a given total size
+by deleting the least recently used files.
+"""
+from fractions import Fraction
+from hashlib import sha256
+import os
+import re
+import shutil
+import tempfile
+from typing import Any, Iterator, Optional, Tuple
+
+# Suffix of the files which are being written
+TEMP_SUFFIX = ".tmp"
+
+# The files in a cache are named by a key like this (a sha256 hex digest) and a suffix
+KEY_PATTERN = re.compile("[0-9a-f]{64}")
+
+
+class FileCache(object):
+    """
+    A directory of files, each named by a key, where the least recently used files are deleted
+    when the files take up more than ``max_size`` bytes.
+
+    Several processes can use the same directory, but then the size is only checked
+    against the files written by each process since it last looked at the directory.
+
+    Each file is named by a key (a sha256 hex digest) followed by one of ``SUFFIXES``.
+    Other files in the directory are left alone, and don't count towards the size.
+
+    Parameters:
+    * directory: the directory to keep the cache in. It is created if it doesn't exist
+    * max_size: the maximum total size of the cache files in bytes
+    """
+
+    SUFFIXES: Tuple[str, ...] = ("",)
+
+    def __init__(self, directory: str, max_size: int = 1 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        # The total size of the files, which is found when the first file is written
+        self._size = None
+
+    def read(self, name: str) -> Optional[bytes]:
+        """Returns the contents of the file with the given name, or None if there is no such file."""
+        path = self._path(name)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return data
+
+    def write(self, name: str, data: bytes):
+        """Stores a file with the given name and contents, and deletes old files if needed."""
+        # Write to a temporary file first, so other processes never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=TEMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, self._path(name))
+        except BaseException:
+            _remove_if_exists(temp_path)
+            raise
+        self._added(len(data))
+
+    def copy_to(self, name: str, filename: str) -> bool:
+        """
+        Copies the file with the given name to ``filename``.
+        Returns False if there is no such file.
+        """
+        path = self._path(name)
+        try:
+            shutil.copyfile(path, filename)
+        except FileNotFoundError:
+            if os.path.exists(path):
+                raise
+            return False
+        self._touch(path)
+        return True
+
+    def copy_from(self, name: str, filename: str):
+        """Stores a copy of ``filename`` with the given name, and deletes old files if needed."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=TEMP_SUFFIX)
+        try:
+            os.close(fd)
+            shutil.copyfile(filename, temp_path)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, self._path(name))
+        except BaseException:
+            _remove_if_exists(temp_path)
+            raise
+        self._added(size)
+
+    def clear(self):
+        """Deletes all the files in the cache."""
+        for path, _, _ in self._iter_entries():
+            _remove_if_exists(path)
+        self._size = 0
+
+    def is_cache_name(self, name: str) -> bool:
+        """Returns whether a file with the given name belongs to the cache."""
+        stem, suffix = os.path.splitext(name)
+        return suffix in self.SUFFIXES and KEY_PATTERN.fullmatch(stem) is not None
+
+    def _path(self, name: str) -> str:
+        if not self.is_cache_name(name):
+            raise ValueError(f"{name!r} is not the name of a file in the cache")
+        return os.path.join(self.directory, name)
+
+    def _touch(self, path: str):
+        try:
+            # The modification time of a cache file is when it was last used
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _added(self, size: int):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._iter_entries())
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self._evict()
+
+    def _iter_entries(self) -> Iterator[Tuple[str, int, int]]:
+        """Yields (path, size, last used time) for each file in the cache."""
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not self.is_cache_name(entry.name) or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+    def _evict(self):
+        """Deletes the least recently used files until the cache is small enough."""
+        entries = sorted(self._iter_entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_size:
+                break
+            _remove_if_exists(path)
+            self._size -= size
+
+
+def _remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class UncacheableError(Exception):
+    """Raised when trying to make a cache key for something which can't be cached."""
+
+
+def stable_repr(value: Any) -> str:
+    """
+    Returns a string representation of the value which is the same in every process,
+    for use in cache keys.
+
+    Objects are represented by their class and public attributes, except ``settings``
+    (which effects get from the conversion settings).
+    Raises UncacheableError for objects without attributes, like functions,
+    and for objects with an ``is_deterministic()`` method which returns False.
+    """
+    if value is None or isinstance(value, (bool, int, float, str, bytes, Fraction)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}({', '.join(map(stable_repr, value))})"
+    if isinstance(value, dict):
+        items = sorted(
+            f"{stable_repr(key)}: {stable_repr(item)}" for key, item in value.items()
+        )
+        return "{" + ", ".join(items) + "}"
+    if isinstance(value, (set, frozenset)):
+        return "{" + ", ".join(sorted(map(stable_repr, value))) + "}"
+    is_deterministic = getattr(value, "is_deterministic", None)
+    if is_deterministic is not None and not is_deterministic():
+        raise UncacheableError(f"{value!r} doesn't always give the same result")
+    if not hasattr(value, "__dict__") or callable(value):
+        raise UncacheableError(f"Can't make a cache key for {value!r}")
+    attributes = {
+        name: attribute
+        for name, attribute in vars(value).items()
+        if not name.startswith("_") and name != "settings"
+    }
+    cls = type(value)
+    return f"{cls.__module__}.{cls.__qualname__}{stable_repr(attributes)}"
+
+
+class RenderCache(FileCache):
+    """
+    A cache of the files made by ``to_midi``, ``to_pdf`` and ``to_xlsx``, keyed by a hash
+    of the chords and of everything else which affects the file.
+    When a file with the same key has been made before, it is copied instead of made again.
+
+    Use it by passing it as ``cache`` to ``MidiConversionSettings``, ``to_pdf`` or ``to_xlsx``.
+
+    Files are not cached if an effect uses the global random number generator
+    (e.g. ``Spreader`` without a seed). Effects which change when they are applied
+    (e.g. ``Arpeggiator``) are cached with their state before the conversion,
+    but the state isn't changed when the file is copied from the cache.
+
+    Parameters:
+    * directory: the directory to keep the cache in. It is created if it doesn't exist
+    * max_size: the maximum total size of the cache files in bytes
+    """
+
+    SUFFIXES = (".mid", ".pdf", ".xlsx")
+
+    def key(self, *parts: Any) -> Optional[str]:
+        """
+        Returns the key for a file made from the given parts,
+        or None if the parts can't be cached (see ``stable_repr``).
+        """
+        try:
+            description = stable_repr(parts)
+        except UncacheableError:
+            return None
+        return sha256(description.encode("utf-8")).hexdigest()
+
+    def render(self, parts: Tuple, suffix: str, filename: str, render):
+        """
+        Makes the file by calling ``render()``, unless a file made from the same parts
+        is in the cache, in which case that is copied to ``filename``.
+
+        Parameters:
+        * parts: everything which affects the file, see ``key``
+        * suffix: the file extension, e.g. ".mid"
+        * filename: the file which ``render()`` makes
+        * render: makes the file
+        """
+        key = self.key(*parts)
+        if key is None:
+            render()
+            return
+        name = key + suffix
+        if self.copy_to(name, filename):
+            return
+        render()
+        self.copy_from(name, filename)
@@ -1,45 +1,531 @@
 from argparse import ArgumentParser
+from contextlib import contextmanager
+from functools import lru_cache
+import json
+import os
+import shutil
 import sys
+import tempfile
+import time
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
 
 import jchord
+from jchord.batch import (
+    MIDI_EXTENSIONS,
+    _describe_error,
+    _iter_in_pool,
+    iter_midi_files,
+)
+from jchord.cache import RenderCache
+from jchord.midi import MidiNoteCache
+
+
+class ConversionError(Exception):
+    """Raised when a conversion can't be done. ``code`` is the exit code for the converter script."""
+
+    def __init__(self, message: str, code: int):
+        super().__init__(message)
+        self.code = code
 
 
 def is_txt(f):
-    return f.endswith(".txt")
+    return f.lower().endswith(".txt")
 
 
 def is_xlsx(f):
-    return f.endswith((".xls", ".xlsx"))
+    return f.lower().endswith((".xls", ".xlsx"))
 
 
 def is_pdf(f):
-    return f.endswith(".pdf")
+    return f.lower().endswith(".pdf")
 
 
 def is_midi(f):
-    return f.endswith((".mid", ".midi"))
+    return f.lower().endswith((".mid", ".midi"))
 
 
-def parse_arglist(arglist):
+def _parse_arglist(arglist):
     if not arglist:
         return {}
     try:
         return dict(arg.split("=") for arg in arglist.split(","))
     except:
-        print(
-            f"Couldn't parse arglist, expected key1=value,key2=value..., got {arglist}"
+        raise ConversionError(
+            f"Couldn't parse arglist, expected key1=value,key2=value..., got {arglist}",
+            -2,
         )
+
+
+def parse_arglist(arglist):
+    try:
+        return _parse_arglist(arglist)
+    except ConversionError as error:
+        print(error)
         return None
 
 
-def main():
+def is_jsonl(f):
+    return f.lower().endswith(".jsonl")
+
+
+# The formats for --from and --to. "string" means that the input argument is the progression
+FORMATS = ("string", "txt", "jsonl", "xlsx", "midi", "pdf")
+
+# The file name for standard input or output
+STDIO = "-"
+
+
+def guess_format(filename: str) -> Optional[str]:
+    """Returns the format of the file based on its extension, or None if it is not known."""
+    if is_txt(filename):
+        return "txt"
+    elif is_jsonl(filename):
+        return "jsonl"
+    elif is_xlsx(filename):
+        return "xlsx"
+    elif is_midi(filename):
+        return "midi"
+    elif is_pdf(filename):
+        return "pdf"
+    return None
+
+
+def _input_format(file_in: str, from_format: Optional[str], allow_string: bool) -> str:
+    if from_format:
+        return from_format
+    if file_in == STDIO:
+        return "txt"
+    from_format = guess_format(file_in)
+    if from_format is None:
+        if not allow_string:
+            raise ConversionError(f"Unknown format: {file_in}", -2)
+        return "string"
+    return from_format
+
+
+def _output_format(file_out: str, to_format: Optional[str], from_format: str) -> str:
+    if to_format:
+        return to_format
+    if file_out == STDIO:
+        return "jsonl" if from_format == "jsonl" else "txt"
+    to_format = guess_format(file_out)
+    if to_format is None:
+        raise ConversionError(f"Unknown format: {file_out}", -2)
+    return to_format
+
+
+@contextmanager
+def _open_text_input(file_in: str) -> Iterator[TextIO]:
+    if file_in == STDIO:
+        yield sys.stdin
+    else:
+        with open(file_in) as file:
+            yield file
+
+
+@contextmanager
+def _open_text_output(file_out: str) -> Iterator[TextIO]:
+    if file_out == STDIO:
+        yield sys.stdout
+        sys.stdout.flush()
+    else:
+        with open(file_out, "w") as file:
+            yield file
+
+
+@contextmanager
+def _binary_input_file(file_in: str, suffix: str) -> Iterator[str]:
+    """Yields a file name for the input, which is copied to a temporary file if it is standard input."""
+    if file_in != STDIO:
+        yield file_in
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "input" + suffix)
+        with open(filename, "wb") as file:
+            shutil.copyfileobj(sys.stdin.buffer, file)
+        yield filename
+
+
+@contextmanager
+def _binary_output_file(file_out: str, suffix: str) -> Iterator[str]:
+    """Yields a file name for the output, which is copied to standard output if that is the output."""
+    if file_out != STDIO:
+        yield file_out
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "output" + suffix)
+        yield filename
+        with open(filename, "rb") as file:
+            sys.stdout.flush()
+            shutil.copyfileobj(file, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+
+
+def iter_jsonl(file: TextIO) -> Iterator[Tuple[Optional[str], jchord.ChordProgression]]:
+    """
+    Yields ``(name, progression)`` for each line in a JSON Lines file, where each line is an object
+    with the chords as a list of names (or a string) in ``"chords"``, and optionally a name in
+    ``"file"``, as written by ``jchord.batch.extract_corpus``.
+    Lines with an ``"error"`` and no chords are skipped. The lines are read one at a time.
+    """
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            chords = record.get("chords")
+        except (ValueError, AttributeError):
+            raise ConversionError(f"Line {line_number} is not a JSON object", -2)
+        if chords is None:
+            if "error" in record:
+                continue
+            raise ConversionError(f"Line {line_number} has no chords", -2)
+        if not isinstance(chords, str):
+            chords = " ".join(chords)
+        yield record.get("file"), jchord.ChordProgression.from_string(chords)
+
+
+def write_jsonl(
+    file: TextIO, chords: Iterable[jchord.Chord], name: Optional[str] = None
+):
+    """
+    Writes a line for a progression to a JSON Lines file (see iter_jsonl()).
+    The chords are written one at a time, so they can come from a long iterator.
+    """
+    file.write("{")
+    if name is not None:
+        file.write(f'"file": {json.dumps(name)}, ')
+    file.write('"chords": [')
+    for index, chord in enumerate(chords):
+        if index:
+            file.write(", ")
+        file.write(json.dumps(chord.name))
+    file.write("]}\n")
+
+
+@lru_cache(maxsize=None)
+def get_caches(directory: str) -> Tuple[MidiNoteCache, RenderCache]:
+    """
+    Returns the caches of MIDI notes and rendered files in the given directory.
+    The same objects are returned each time, so they only look at the directory once.
+    """
+    return (
+        MidiNoteCache(os.path.join(directory, "notes")),
+        RenderCache(os.path.join(directory, "render")),
+    )
+
+
+def read_progression(
+    file_in: str,
+    allow_string: bool = True,
+    from_format: Optional[str] = None,
+    cache: Optional[str] = None,
+) -> jchord.ChordProgression:
+    """
+    Reads the progression from a .txt, .xlsx or MIDI file, or from standard input if the file is "-"
+    (as text, unless another format is given).
+    Anything else is read as a progression written as a string if allow_string is True.
+    If from_format is given (see FORMATS), the file is read in that format.
+    If a cache directory is given, the notes in MIDI files are cached there (see get_caches()).
+    """
+    from_format = _input_format(file_in, from_format, allow_string)
+    if from_format == "string":
+        return jchord.ChordProgression.from_string(file_in)
+    elif from_format == "txt":
+        with _open_text_input(file_in) as file:
+            return jchord.ChordProgression(jchord.ChordProgression.iter_file(file))
+    elif from_format == "jsonl":
+        with _open_text_input(file_in) as file:
+            progressions = iter_jsonl(file)
+            _, progression = next(progressions, (None, None))
+            if progression is None:
+                raise ConversionError(f"There is no progression in {file_in}", -2)
+            if next(progressions, None) is not None:
+                raise ConversionError(
+                    f"There is more than one progression in {file_in}; use --to jsonl",
+                    -2,
+                )
+            return progression
+    elif from_format == "xlsx":
+        with _binary_input_file(file_in, ".xlsx") as filename:
+            return jchord.ChordProgression.from_xlsx(filename)
+    elif from_format == "midi":
+        with _binary_input_file(file_in, ".mid") as filename:
+            return jchord.ChordProgression.from_midi(
+                filename, get_caches(cache)[0] if cache else None
+            )
+    elif from_format == "pdf":
+        raise ConversionError("Sorry, converting from PDF is not supported", -1)
+    else:
+        raise ConversionError(f"Unknown format: {from_format}", -2)
+
+
+def write_progression(
+    progression: jchord.ChordProgression,
+    file_out: str,
+    midi: Optional[str] = None,
+    pdf: Optional[str] = None,
+    to_format: Optional[str] = None,
+    cache: Optional[str] = None,
+):
+    """
+    Writes the progression to a .txt, .jsonl, .xlsx, MIDI or PDF file,
+    or to standard output if the file is "-" (as text, unless another format is given).
+
+    Parameters:
+    * progression: the progression
+    * file_out: the file
+    * midi: comma separated list of arguments for MIDI files
+    * pdf: comma separated list of arguments for PDF files
+    * to_format: if given (see FORMATS), the file is written in that format
+    * cache: if given, .xlsx, MIDI and PDF files are cached in this directory (see get_caches())
+    """
+    to_format = _output_format(file_out, to_format, "txt")
+    render_cache = get_caches(cache)[1] if cache else None
+    if to_format == "txt":
+        with _open_text_output(file_out) as file:
+            file.write(progression.to_string())
+    elif to_format == "jsonl":
+        with _open_text_output(file_out) as file:
+            write_jsonl(file, progression.progression)
+    elif to_format == "xlsx":
+        with _binary_output_file(file_out, ".xlsx") as filename:
+            progression.to_xlsx(filename, cache=render_cache)
+    elif to_format == "midi":
+        midi_args = _parse_arglist(midi)
+        with _binary_output_file(file_out, ".mid") as filename:
+            progression.to_midi(
+                jchord.MidiConversionSettings(
+                    filename=filename, cache=render_cache, **midi_args
+                )
+            )
+    elif to_format == "pdf":
+        pdf_args = _parse_arglist(pdf)
+        if file_out == STDIO:
+            # Rather than the name of the temporary file
+            pdf_args.setdefault("title", "")
+        with _binary_output_file(file_out, ".pdf") as filename:
+            progression.to_pdf(filename, cache=render_cache, **pdf_args)
+    else:
+        raise ConversionError(f"Unknown format: {file_out}", -2)
+
+
+def convert(
+    file_in: str,
+    file_out: str,
+    midi: Optional[str] = None,
+    pdf: Optional[str] = None,
+    from_format: Optional[str] = None,
+    to_format: Optional[str] = None,
+    cache: Optional[str] = None,
+):
+    """
+    Converts the progression in ``file_in`` to ``file_out``; see read_progression() and
+    write_progression(). Raises ConversionError if either of the formats is not supported.
+
+    Converting from text or JSON Lines to JSON Lines is done in bounded memory:
+    the chords in a text file, and the lines in a JSON Lines file (which may hold any number
+    of progressions), are converted as they are read.
+
+    If a cache directory is given, the notes in MIDI files and the .xlsx, MIDI and PDF files
+    which are written are cached there, so converting the same thing again is faster.
+    """
+    from_format = _input_format(file_in, from_format, allow_string=True)
+    to_format = _output_format(file_out, to_format, from_format)
+    if to_format == "jsonl" and from_format in ("txt", "jsonl"):
+        with _open_text_input(file_in) as input_file, _open_text_output(
+            file_out
+        ) as output_file:
+            if from_format == "txt":
+                write_jsonl(output_file, jchord.ChordProgression.iter_file(input_file))
+            else:
+                for name, progression in iter_jsonl(input_file):
+                    write_jsonl(output_file, progression.progression, name)
+        return
+    write_progression(
+        read_progression(file_in, from_format=from_format, cache=cache),
+        file_out,
+        midi,
+        pdf,
+        to_format,
+        cache,
+    )
+
+
+# The files in a directory which are converted in batch mode
+BATCH_EXTENSIONS = (".txt", ".xls", ".xlsx") + MIDI_EXTENSIONS
+
+
+def iter_batch_inputs(source: str) -> Iterator[str]:
+    """
+    Yields the input files for batch mode, where the source is one of:
+
+    * a directory, which is searched recursively for .txt, .xlsx and MIDI files
+    * ``@`` followed by the name of a manifest file, which lists one input file per line
+      (blank lines and lines starting with ``#`` are skipped)
+    * a glob pattern, where ``**`` matches any number of directories
+    """
+    if source.startswith("@"):
+        with open(source[1:]) as manifest:
+            for line in manifest:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+    else:
+        yield from iter_midi_files(source, BATCH_EXTENSIONS)
+
+
+def format_output(template: str, file_in: str, index: int) -> str:
+    """
+    Returns the output file for an input file in batch mode. The template can contain
+    ``{stem}`` (the file name without the extension), ``{name}`` (the file name),
+    ``{parent}`` (the directory of the file) and ``{index}`` (the position in the batch).
+    Raises ConversionError if the template is invalid.
+    """
+    name = os.path.basename(file_in)
+    try:
+        return template.format(
+            stem=os.path.splitext(name)[0],
+            name=name,
+            parent=os.path.dirname(file_in) or ".",
+            index=index,
+        )
+    except (KeyError, ValueError, IndexError, AttributeError) as error:
+        raise ConversionError(
+            f"Invalid output template {template}: {_describe_error(error)}; "
+            "it can contain {stem}, {name}, {parent} and {index}",
+            -2,
+        )
+
+
+def is_up_to_date(file_in: str, file_out: str) -> bool:
+    """Returns whether the output file exists and is newer than the input file."""
+    try:
+        return os.path.getmtime(file_out) >= os.path.getmtime(file_in)
+    except OSError:
+        return False
+
+
+def _convert_job(
+    job: Tuple[
+        str,
+        str,
+        Optional[str],
+        Optional[str],
+        Optional[str],
+        Optional[str],
+        Optional[str],
+    ]
+) -> Tuple[str, str, Optional[str]]:
+    file_in, file_out, midi, pdf, from_format, to_format, cache = job
+    try:
+        directory = os.path.dirname(file_out)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_progression(
+            read_progression(
+                file_in, allow_string=False, from_format=from_format, cache=cache
+            ),
+            file_out,
+            midi,
+            pdf,
+            to_format,
+            cache,
+        )
+    except ConversionError as error:
+        return file_in, file_out, str(error)
+    except Exception as error:
+        return file_in, file_out, _describe_error(error)
+    return file_in, file_out, None
+
+
+def _path_key(filename: str) -> str:
+    return os.path.normcase(os.path.abspath(filename))
+
+
+def convert_batch(
+    source: str,
+    template: str,
+    midi: Optional[str] = None,
+    pdf: Optional[str] = None,
+    workers: int = 1,
+    force: bool = False,
+    from_format: Optional[str] = None,
+    to_format: Optional[str] = None,
+    cache: Optional[str] = None,
+) -> int:
+    """
+    Converts each of the files in the source (see iter_batch_inputs()) to the output file
+    given by the template (see format_output()), and prints a summary.
+    Outputs which are newer than their inputs are skipped unless ``force`` is True.
+    Files in the source which are outputs of this batch (e.g. from an earlier run with
+    ``{parent}/{stem}.mid``) are not converted themselves.
+    The formats are found from the file extensions, unless from_format or to_format is given.
+    If a cache directory is given, it is used as in convert().
+    Returns the exit code for the converter script.
+    """
+    start_time = time.perf_counter()
+    _parse_arglist(midi)
+    _parse_arglist(pdf)
+
+    pairs = [
+        (file_in, format_output(template, file_in, index))
+        for index, file_in in enumerate(iter_batch_inputs(source))
+    ]
+    output_keys = {_path_key(file_out) for _, file_out in pairs}
+
+    jobs = []
+    outputs = {}
+    n_up_to_date = 0
+    for file_in, file_out in pairs:
+        if _path_key(file_in) in output_keys:
+            continue
+        if file_out in outputs:
+            raise ConversionError(
+                f"Both {outputs[file_out]} and {file_in} would be converted to {file_out}; "
+                "use {stem} or {index} in the output file",
+                -2,
+            )
+        outputs[file_out] = file_in
+        if not force and is_up_to_date(file_in, file_out):
+            n_up_to_date += 1
+        else:
+            jobs.append((file_in, file_out, midi, pdf, from_format, to_format, cache))
+
+    if workers > 1 and len(jobs) > 1:
+        results = _iter_in_pool(_convert_job, jobs, workers, ordered=False)
+    else:
+        results = map(_convert_job, jobs)
+
+    failures: List[Tuple[str, str]] = []
+    for file_in, file_out, error in results:
+        if error is not None:
+            failures.append((file_in, error))
+            print(f"Failed to convert {file_in}: {error}")
+
+    print(
+        f"{len(jobs) - len(failures)} converted, {n_up_to_date} up to date, "
+        f"{len(failures)} failed in {time.perf_counter() - start_time:.1f} s"
+    )
+    return -1 if failures else 0
+
+
+def make_parser(add_help: bool = True) -> ArgumentParser:
+    """Returns the parser for the arguments of the converter script."""
     parser = ArgumentParser(
-        description="Converts between different representations of the same format\n"
+        description="Converts between different representations of the same format\n",
+        add_help=add_help,
     )
     parser.add_argument(
-        "file_in", help="Input progression as string, .txt, .xlsx or .midi"
+        "file_in",
+        help="Input progression as string, .txt, .jsonl, .xlsx or .midi, or - for standard input. "
+        "With --batch, a directory, a glob pattern or @ followed by a file with one input file per line",
+    )
+    parser.add_argument(
+        "file_out",
+        help="Output file as .txt, .jsonl, .xlsx, .midi or .pdf, or - for standard output. "
+        "With --batch, a template like {stem}.mid, which can contain {stem}, {name}, {parent} and {index}",
     )
-    parser.add_argument("file_out", help="Output file as .txt, .xlsx, .midi or .pdf")
     parser.add_argument(
         "--midi",
         help="comma separated list of arguments for midi, e.g. tempo=8,beats_per_chord=2",
@@ -48,41 +534,92 @@ def main():
         "--pdf",
         help="comma separated list of arguments for pdf, e.g. chords_per_row=8,fontsize=30",
     )
-    args = parser.parse_args()
-    file_in = args.file_in
-    file_out = args.file_out
-
-    if is_txt(file_in):
-        progression = jchord.ChordProgression.from_txt(file_in)
-    elif is_xlsx(file_in):
-        progression = jchord.ChordProgression.from_xlsx(file_in)
-    elif is_midi(file_in):
-        progression = jchord.ChordProgression.from_midi(file_in)
-    elif is_pdf(file_in):
-        print("Sorry, converting from PDF is not supported")
-        return -1
-    else:
-        progression = jchord.ChordProgression.from_string(file_in)
-
-    if is_txt(file_out):
-        progression.to_txt(file_out)
-    elif is_xlsx(file_out):
-        progression.to_xlsx(file_out)
-    elif is_midi(file_out):
-        midi_args = parse_arglist(args.midi)
-        if midi_args is None:
-            return -2
-        progression.to_midi(
-            jchord.MidiConversionSettings(filename=file_out, **midi_args)
+    parser.add_argument(
+        "--from",
+        dest="from_format",
+        choices=FORMATS,
+        help="format of the input (by default, based on the file extension, or txt for -)",
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_format",
+        choices=FORMATS[1:],
+        help="format of the output (by default, based on the file extension, "
+        "or for -, the same as the input if that is jsonl and txt otherwise)",
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="convert many files at once"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes to convert files in, with --batch",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="convert files even if the output is newer than the input, with --batch",
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory to cache the notes in MIDI files and the .xlsx, MIDI and PDF files in",
+    )
+    parser.add_argument(
+        "--server",
+        help="do the conversion in a server started with 'jchord serve', "
+        "at host:port or the path of a Unix socket",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["serve"]:
+        from jchord.serve import serve_main
+
+        return serve_main(argv[1:])
+
+    server_parser = ArgumentParser(add_help=False)
+    server_parser.add_argument("--server")
+    server_args, forwarded_argv = server_parser.parse_known_args(argv)
+    if server_args.server:
+        from jchord.serve import run_client
+
+        return run_client(server_args.server, forwarded_argv)
+
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    # get_caches() is keyed by the directory, which may be used from another directory in a server
+    cache = os.path.abspath(args.cache) if args.cache else None
+
+    try:
+        if args.batch:
+            return convert_batch(
+                args.file_in,
+                args.file_out,
+                midi=args.midi,
+                pdf=args.pdf,
+                workers=args.workers,
+                force=args.force,
+                from_format=args.from_format,
+                to_format=args.to_format,
+                cache=cache,
+            )
+        convert(
+            args.file_in,
+            args.file_out,
+            midi=args.midi,
+            pdf=args.pdf,
+            from_format=args.from_format,
+            to_format=args.to_format,
+            cache=cache,
         )
-    elif is_pdf(file_out):
-        pdf_args = parse_arglist(args.pdf)
-        if pdf_args is None:
-            return -2
-        progression.to_pdf(file_out, **pdf_args)
-    else:
-        print(f"Unknown format: {file_out}")
-        return -2
+    except ConversionError as error:
+        # Keep the output clean if it is written to standard output
+        print(error, file=sys.stderr if args.file_out == STDIO else sys.stdout)
+        return error.code
     return 0
 
 
@@ -0,0 +1,160 @@
+"""
+Finds repeated sections in a sequence, e.g. the verses and choruses of a chord progression.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Parameters for the rolling hash
+HASH_MODULUS = (1 << 61) - 1
+HASH_BASE = 1_000_003
+
+
+class _RollingHash(object):
+    """
+    Hashes any slice of a sequence of integers in constant time.
+    """
+
+    def __init__(self, codes: Sequence[int]):
+        self.codes = codes
+        self.prefix = [0]
+        self.powers = [1]
+        for code in codes:
+            self.prefix.append((self.prefix[-1] * HASH_BASE + code + 1) % HASH_MODULUS)
+            self.powers.append(self.powers[-1] * HASH_BASE % HASH_MODULUS)
+
+    def __call__(self, start: int, length: int) -> int:
+        return (
+            self.prefix[start + length] - self.prefix[start] * self.powers[length]
+        ) % HASH_MODULUS
+
+    def common_prefix(self, first: int, second: int, max_length: int) -> int:
+        """
+        Returns the length of the longest common prefix of the slices starting at
+        ``first`` and ``second``, but at most ``max_length``.
+        """
+        low, high = 0, max_length
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self(first, mid) == self(second, mid):
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+
+def find_sections(
+    codes: Sequence[int], min_length: int = 4, max_length: Optional[int] = None
+) -> List[Tuple[int, int, int]]:
+    """
+    Splits the sequence into sections, such that repeated material becomes repeats of the same section.
+
+    The return value is a list of ``(start, length, section)`` for each section in the sequence,
+    where ``section`` is 0 for the first distinct section, 1 for the next and so on.
+    Chords which are not part of any repeated section are grouped into sections of their own.
+
+    The sequence is parsed from left to right. At each position, the longest section found so far
+    which matches there is used. Otherwise, a new section is made from the shortest slice which is
+    immediately repeated, or from the longest slice which is repeated later on. New sections
+    end where a known section starts. Slices are compared with a rolling hash, so the whole
+    thing takes close to linear time.
+
+    Parameters:
+    * codes: the sequence, where equal items have equal integers
+    * min_length: the minimum length of a repeated section
+    * max_length: the maximum length of a repeated section (by default, half the length of the sequence)
+    """
+    if min_length < 1:
+        raise ValueError(f"min_length must be at least 1, not {min_length}")
+    n_codes = len(codes)
+    if max_length is None:
+        max_length = n_codes // 2
+
+    window = _RollingHash(codes)
+
+    # Where each slice of length min_length starts
+    occurrences = defaultdict(list)
+    for start in range(n_codes - min_length + 1):
+        occurrences[window(start, min_length)].append(start)
+
+    # Maps (length, hash) to the section number and start of each section found so far
+    known: Dict[Tuple[int, int], Tuple[int, int]] = {}
+    known_lengths: List[int] = []
+
+    def match_known(start: int) -> Optional[Tuple[int, int, int]]:
+        for length in known_lengths:
+            if start + length > n_codes:
+                continue
+            found = known.get((length, window(start, length)))
+            if found is not None:
+                section, first = found
+                if codes[start : start + length] == codes[first : first + length]:
+                    return start, length, section
+        return None
+
+    def find_new(start: int) -> int:
+        if start + 2 * min_length > n_codes:
+            return 0
+        starts = occurrences[window(start, min_length)]
+        later = bisect_left(starts, start + min_length)
+
+        # The shortest slice which is repeated right after itself
+        for index in range(later, len(starts)):
+            other = starts[index]
+            length = other - start
+            if length > max_length or other + length > n_codes:
+                break
+            if window(start, length) == window(other, length):
+                return length
+
+        # The longest slice which is repeated later on
+        if later < len(starts):
+            other = starts[later]
+            return min(
+                window.common_prefix(start, other, min(other - start, n_codes - other)),
+                max_length,
+            )
+        return 0
+
+    sections = []
+    free_start = None
+    n_sections = 0
+
+    def end_free(end: int):
+        nonlocal free_start, n_sections
+        if free_start is not None:
+            sections.append((free_start, end - free_start, n_sections))
+            n_sections += 1
+            free_start = None
+
+    position = 0
+    while position < n_codes:
+        found = match_known(position)
+        if found is not None:
+            end_free(position)
+            sections.append(found)
+            position += found[1]
+            continue
+
+        length = find_new(position)
+        if length >= min_length:
+            # Stop at the first known section, if it leaves enough for a section
+            for end in range(position + min_length, position + length):
+                if match_known(end) is not None:
+                    length = end - position
+                    break
+            end_free(position)
+            sections.append((position, length, n_sections))
+            known[length, window(position, length)] = (n_sections, position)
+            if length not in known_lengths:
+                known_lengths.append(length)
+                known_lengths.sort(reverse=True)
+            n_sections += 1
+            position += length
+            continue
+
+        if free_start is None:
+            free_start = position
+        position += 1
+    end_free(n_codes)
+    return sections
@@ -3,8 +3,13 @@ Tools for working with MIDI.
 """
 from collections import defaultdict, namedtuple
 from enum import IntEnum
-from typing import List
+from hashlib import sha256
+from heapq import heappop, heappush
+import os
+import struct
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
 
+from jchord.cache import FileCache
 from jchord.knowledge import CHROMATIC, MAJOR_FROM_C, MAJOR_SCALE_OFFSETS
 from jchord.core import Note, split_to_base_and_shift
 
@@ -87,25 +92,25 @@ def _events_to_notes(events: list) -> List[MidiNote]:
 
 
 def remove_overlap(events, margin=1):
+    return list(_iter_remove_overlap(events, margin))
+
+
+def _iter_remove_overlap(events, margin=1):
     hold_counts = defaultdict(int)
-    events_out = []
     for event in events:
         if event["type"] == "note_on":
             if hold_counts[event["note"]] > 0:
-                events_out.append(
-                    {
-                        **event,
-                        "type": "note_off",
-                        "abs_time": max(0, event["abs_time"] - margin),
-                    }
-                )
-            events_out.append(event)
+                yield {
+                    **event,
+                    "type": "note_off",
+                    "abs_time": max(0, event["abs_time"] - margin),
+                }
+            yield event
             hold_counts[event["note"]] += 1
         elif event["type"] == "note_off":
             if hold_counts[event["note"]] <= 1:
-                events_out.append(event)
+                yield event
             hold_counts[event["note"]] -= 1
-    return events_out
 
 
 def notes_to_messages(notes: List[MidiNote], velocity=100):
@@ -147,10 +152,266 @@ def notes_to_messages(notes: List[MidiNote], velocity=100):
     return messages
 
 
-def read_midi_file(filename: str) -> List[MidiNote]:
-    """Reads the MIDI file for the given filename and returns the corresponding list of `MidiNote`s."""
+def _iter_sorted_note_events(notes: Iterable[MidiNote], velocity: int):
+    """
+    Yields the note_on and note_off events for the notes, which must be sorted by time.
+
+    The events come in the same order as in notes_to_messages(), but only the note_off
+    events for notes that are still playing are held in memory.
+    """
+    pending_offs = []
+    for seq, note in enumerate(notes):
+        while pending_offs and pending_offs[0][0] <= note.time:
+            yield heappop(pending_offs)[2]
+        yield {
+            "type": "note_on",
+            "note": note.note,
+            "velocity": velocity,
+            "abs_time": note.time,
+        }
+        end_time = note.time + note.duration
+        heappush(
+            pending_offs,
+            (
+                end_time,
+                seq,
+                {
+                    "type": "note_off",
+                    "note": note.note,
+                    "velocity": velocity,
+                    "abs_time": end_time,
+                },
+            ),
+        )
+    while pending_offs:
+        yield heappop(pending_offs)[2]
+
+
+def iter_notes_to_messages(
+    notes: Iterable[MidiNote],
+    velocity=100,
+    meta_messages: Sequence[Tuple[int, Any]] = (),
+    channel: int = 0,
+):
+    """
+    Returns an iterator over the messages for the given notes, like notes_to_messages().
+
+    The notes must be sorted by time, and are consumed as the messages are generated.
+
+    Parameters:
+    * notes: the notes
+    * velocity: the velocity of the notes
+    * meta_messages: ``(time, message)`` for other messages (e.g. tempo changes) to put among
+      the notes, sorted by time. Each message comes before the note events at its time.
+    * channel: the MIDI channel for the notes
+    """
+    from mido import Message
+
+    last_event_time = None
+    # The other messages take up some of the time until the next note event,
+    # so the note events are at the same times as without them
+    meta_ticks = 0
+    meta_index = 0
+
+    def iter_meta_messages(until: float):
+        nonlocal last_event_time, meta_ticks, meta_index
+        while meta_index < len(meta_messages) and meta_messages[meta_index][0] <= until:
+            meta_time, message = meta_messages[meta_index]
+            if last_event_time is None:
+                last_event_time = 0
+            delta = max(0, int(max(0, meta_time - last_event_time)) - meta_ticks)
+            meta_ticks += delta
+            meta_index += 1
+            yield message.copy(time=delta)
+
+    for event in _iter_remove_overlap(_iter_sorted_note_events(notes, velocity)):
+        event_time = event.pop("abs_time")
+        yield from iter_meta_messages(event_time)
+        if last_event_time is None:
+            last_event_time = event_time
+        delta = max(0, int(max(0, event_time - last_event_time)) - meta_ticks)
+        yield Message(**event, channel=channel, time=delta)
+        last_event_time = event_time
+        meta_ticks = 0
+    yield from iter_meta_messages(float("inf"))
+
+
+def _encode_variable_int(value: int) -> bytearray:
+    """Encodes the value as a variable-length quantity, as used for delta times in MIDI files."""
+    encoded = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        encoded.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return encoded
+
+
+EncodedNotes = namedtuple(
+    "EncodedNotes", "first_time, last_time, first_status, data, last_status"
+)
+EncodedNotes.__doc__ = (
+    """Messages for some notes, encoded as in a MIDI track. See encode_notes()."""
+)
+
+
+def encode_notes(notes: Iterable[MidiNote], velocity=100) -> Optional[EncodedNotes]:
+    """
+    Encodes the messages for the notes (which must be sorted by time) as they are written
+    to a MIDI track. The messages are the same as from iter_notes_to_messages().
+
+    The delta time and the status byte of the first message are left out of ``data``,
+    since they depend on the message before it. Use join_encoded_notes() to put them back.
+    Returns None if there are no notes.
+    """
+    data = bytearray()
+    first_time = None
+    first_status = None
+    last_time = None
+    last_status = None
+    for event in _iter_remove_overlap(_iter_sorted_note_events(notes, velocity)):
+        event_time = event["abs_time"]
+        status = 0x90 if event["type"] == "note_on" else 0x80
+        if not (0 <= event["note"] <= 127 and 0 <= event["velocity"] <= 127):
+            raise ValueError(f"Invalid note or velocity in MIDI event: {event}")
+        if first_time is None:
+            first_time = event_time
+            first_status = status
+        else:
+            data += _encode_variable_int(int(max(0, event_time - last_time)))
+            if status != last_status:
+                data.append(status)
+        data.append(event["note"])
+        data.append(event["velocity"])
+        last_time = event_time
+        last_status = status
+    if first_time is None:
+        return None
+    return EncodedNotes(first_time, last_time, first_status, bytes(data), last_status)
+
+
+def join_encoded_notes(
+    parts: Iterable[EncodedNotes], status: Optional[int] = None
+) -> bytes:
+    """
+    Joins encoded notes into the data for a MIDI track, as if all the notes had been encoded at once.
+    This is only true if every note in a part ends before (or when) the first note in the next part starts.
+
+    Parameters:
+    * parts: the encoded notes, where None is skipped
+    * status: the status byte of the message before the notes, for running status
+    """
+    data = bytearray()
+    last_time = None
+    for part in parts:
+        if part is None:
+            continue
+        if last_time is None:
+            data.append(0)
+        else:
+            data += _encode_variable_int(int(max(0, part.first_time - last_time)))
+        if part.first_status != status:
+            data.append(part.first_status)
+        data += part.data
+        last_time = part.last_time
+        status = part.last_status
+    return bytes(data)
+
+
+def save_midi_file(
+    filename: str, tracks: Iterable[Iterable], ticks_per_beat: int = 480
+):
+    """
+    Saves a MIDI file with the given tracks, each of which is an iterable of MIDI messages.
+
+    Each track is only iterated over once while the file is written,
+    so the messages can be generated on the fly.
+    """
+    from mido import MidiFile
+
+    mid = MidiFile(ticks_per_beat=ticks_per_beat)
+    mid.tracks.extend(tracks)
+    mid.save(filename)
+
+
+class MidiNoteCache(FileCache):
+    """
+    A cache of the notes read by read_midi_file(), with a file for each MIDI file in a directory.
+
+    By default, a MIDI file is identified by its path, modification time and size,
+    so the cache is not used if the file has changed. With ``hash_contents=True``, it is
+    identified by a hash of its contents instead, which also finds copies of the file.
+
+    The notes are stored in a compact binary format (18 bytes per note).
+    When the files in the cache take up more than ``max_size`` bytes,
+    the least recently used ones are deleted (see ``jchord.cache.FileCache``).
+
+    Parameters:
+    * directory: the directory to keep the cache in. It is created if it doesn't exist
+    * max_size: the maximum total size of the cache files in bytes
+    * hash_contents: whether to identify MIDI files by their contents
+    """
+
+    MAGIC = b"JCHN\x01"
+    NOTE_FORMAT = struct.Struct("<dBdB")
+    SUFFIX = ".notes"
+    SUFFIXES = (SUFFIX,)
+
+    def __init__(
+        self, directory: str, max_size: int = 1 << 30, hash_contents: bool = False
+    ):
+        super().__init__(directory, max_size)
+        self.hash_contents = hash_contents
+
+    def key(self, filename: str) -> str:
+        """Returns the key for the given MIDI file."""
+        if self.hash_contents:
+            with open(filename, "rb") as file:
+                return sha256(file.read()).hexdigest()
+        stat = os.stat(filename)
+        identity = f"{os.path.abspath(filename)}\0{stat.st_mtime_ns}\0{stat.st_size}"
+        return sha256(identity.encode("utf-8")).hexdigest()
+
+    def get(self, filename: str) -> Optional[List[MidiNote]]:
+        """Returns the cached notes for the given MIDI file, or None if they are not cached."""
+        data = self.read(self.key(filename) + self.SUFFIX)
+        if data is None or not data.startswith(self.MAGIC):
+            return None
+        return [
+            MidiNote(*fields)
+            for fields in self.NOTE_FORMAT.iter_unpack(data[len(self.MAGIC) :])
+        ]
+
+    def put(self, filename: str, notes: List[MidiNote]):
+        """Stores the notes for the given MIDI file, and deletes old files if needed."""
+        data = bytearray(self.MAGIC)
+        for note in notes:
+            data += self.NOTE_FORMAT.pack(
+                note.time, note.note, note.duration, note.velocity
+            )
+        self.write(self.key(filename) + self.SUFFIX, bytes(data))
+
+
+def read_midi_file(
+    filename: str, cache: Union[MidiNoteCache, str, None] = None
+) -> List[MidiNote]:
+    """
+    Reads the MIDI file for the given filename and returns the corresponding list of `MidiNote`s.
+
+    Parameters:
+    * filename: the MIDI file
+    * cache: a MidiNoteCache, or the directory for one, to get the notes from
+      if the file has been read before
+    """
+    if isinstance(cache, str):
+        cache = MidiNoteCache(cache)
+    if cache is not None:
+        notes = cache.get(filename)
+        if notes is not None:
+            return notes
     events = _read_midi_file_to_events(filename)
     notes = _events_to_notes(events)
+    if cache is not None:
+        cache.put(filename, notes)
     return notes
 
 
@@ -1,14 +1,30 @@
+from bisect import bisect_right
+from fractions import Fraction
+from hashlib import blake2b
+from heapq import heappop, heappush
+from itertools import groupby
+from math import ceil
 import random
-from typing import List
+from typing import Iterable, Iterator, List
 
 from jchord.core import Note
-from jchord.midi import MidiNote, midi_to_note
+from jchord.midi import MidiNote, note_to_midi
 from jchord.progressions import MidiConversionSettings
 
+# Ticks per bar used when no MIDI conversion settings are available (4 beats of 480 ticks)
+DEFAULT_TICKS_PER_BAR = 1920
+
+# Largest number of notes in a chord which effects need to allow for (one per MIDI note)
+MAX_CHORD_SIZE = 128
+
 
 class MidiEffect(object):
     """Base class for MIDI effects"""
 
+    # Maximum number of MIDI ticks by which the effect may move a note earlier than
+    # the start of the chord it belongs to. Streams are held back by this much.
+    lookahead = 0
+
     def __init__(self, *args, **kwargs):
         """
         Nothing to configure
@@ -21,12 +37,117 @@ class MidiEffect(object):
         """
         self.settings = settings
 
+    def ticks_per_bar(self) -> int:
+        """
+        Returns the number of MIDI ticks in a bar of 4/4.
+        This is based on the MIDI conversion settings if they have been set.
+        """
+        settings = getattr(self, "settings", None)
+        if settings is None:
+            return DEFAULT_TICKS_PER_BAR
+        return 4 * settings.ticks_per_beat
+
     def apply(self, chord: List[MidiNote]):
         """
         Returns a list where the effect has been applied to the given chord
         """
         raise NotImplementedError
 
+    def get_state(self):
+        """
+        Returns the state that the effect carries over from one chord to the next, if any.
+        Effects which change when they are applied must override this and set_state(),
+        so the effect can be rewound to an earlier chord.
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        Restores a state returned by get_state()
+        """
+
+    def is_deterministic(self) -> bool:
+        """
+        Returns whether the effect always gives the same result for the same chords,
+        settings and state. Effects which use the global random number generator must
+        override this to return False, so their results are not cached.
+        """
+        return True
+
+    def iter_apply(self, chord: List[MidiNote]) -> Iterator[MidiNote]:
+        """
+        Returns an iterator over the same notes as apply(), sorted by time.
+        Effects which can generate their notes lazily should override this.
+        """
+        return iter(sorted(self.apply(chord), key=_note_time))
+
+    def stream_chords(self, chords: Iterable[List[MidiNote]]) -> Iterator[MidiNote]:
+        """
+        Applies the effect to each chord in a time-ordered sequence of chords,
+        and returns an iterator over all the resulting notes in time order.
+
+        The chords are consumed one at a time, and only the notes that may still be
+        preceded by the output from later chords are held back.
+        """
+        heap = []
+        for chord_index, chord in enumerate(chords):
+            if chord:
+                release_time = min(note.time for note in chord) - self.lookahead
+                while heap and heap[0][0] <= release_time:
+                    yield _pop_next(heap)
+            _push_first(heap, chord_index, self.iter_apply(chord))
+        while heap:
+            yield _pop_next(heap)
+
+    def stream(self, notes: Iterable[MidiNote]) -> Iterator[MidiNote]:
+        """
+        Applies the effect to a time-ordered stream of notes,
+        and returns an iterator over the resulting notes in time order.
+
+        Notes that start at the same time are treated as one chord.
+        """
+        return self.stream_chords(
+            list(chord) for _, chord in groupby(notes, key=_note_time)
+        )
+
+
+def _note_time(note: MidiNote):
+    return note.time
+
+
+def _push_first(heap, chord_index, notes):
+    note = next(notes, None)
+    if note is not None:
+        heappush(heap, (note.time, chord_index, 0, note, notes))
+
+
+def _pop_next(heap):
+    time, chord_index, note_index, note, notes = heappop(heap)
+    next_note = next(notes, None)
+    if next_note is not None:
+        heappush(heap, (next_note.time, chord_index, note_index + 1, next_note, notes))
+    return note
+
+
+class StreamingMidiEffect(MidiEffect):
+    """
+    Base class for MIDI effects which work on the whole stream of notes instead of
+    one chord at a time, e.g. to carry state across chord boundaries.
+
+    Subclasses must implement stream(), and must yield the notes in time order.
+    """
+
+    def stream(self, notes: Iterable[MidiNote]) -> Iterator[MidiNote]:
+        raise NotImplementedError
+
+    def stream_chords(self, chords: Iterable[List[MidiNote]]) -> Iterator[MidiNote]:
+        return self.stream(
+            note for chord in chords for note in sorted(chord, key=_note_time)
+        )
+
+    def apply(self, chord):
+        return list(self.stream(sorted(chord, key=_note_time)))
+
 
 class Chain(MidiEffect):
     """
@@ -45,6 +166,69 @@ class Chain(MidiEffect):
             chord = effect.apply(chord)
         return chord
 
+    def get_state(self):
+        return tuple(effect.get_state() for effect in self.effects)
+
+    def set_state(self, state):
+        for effect, effect_state in zip(self.effects, state):
+            effect.set_state(effect_state)
+
+    def is_deterministic(self) -> bool:
+        return all(effect.is_deterministic() for effect in self.effects)
+
+    @property
+    def lookahead(self):
+        return sum(effect.lookahead for effect in self.effects)
+
+    def iter_apply(self, chord):
+        if not self.effects:
+            return iter(sorted(chord, key=_note_time))
+        for effect in self.effects[:-1]:
+            chord = effect.apply(chord)
+        return self.effects[-1].iter_apply(chord)
+
+    def is_streaming(self) -> bool:
+        """
+        Returns whether any of the effects in the chain work on the whole stream of notes.
+        """
+        return any(_is_streaming(effect) for effect in self.effects)
+
+    def _stages(self):
+        """
+        Splits the effects into stages which can be streamed one after another.
+        Consecutive chord-based effects are kept together, so they see the same chords as in apply().
+        """
+        stages = []
+        chord_effects = []
+        for effect in self.effects:
+            if _is_streaming(effect):
+                if chord_effects:
+                    stages.append(Chain(*chord_effects))
+                    chord_effects = []
+                stages.append(effect)
+            else:
+                chord_effects.append(effect)
+        if chord_effects:
+            stages.append(Chain(*chord_effects))
+        return stages
+
+    def stream_chords(self, chords):
+        if not self.is_streaming():
+            return super().stream_chords(chords)
+        stages = self._stages()
+        notes = stages[0].stream_chords(chords)
+        for stage in stages[1:]:
+            notes = stage.stream(notes)
+        return notes
+
+
+def _is_streaming(effect: MidiEffect) -> bool:
+    if isinstance(effect, StreamingMidiEffect):
+        return True
+    if isinstance(effect, Chain):
+        return effect.is_streaming()
+    return False
+
 
 class Inverter(MidiEffect):
     """
@@ -75,6 +259,12 @@ class AlternatingInverter(MidiEffect):
             self.state = 0
             return list(reversed(chord))
 
+    def get_state(self):
+        return self.state
+
+    def set_state(self, state):
+        self.state = state
+
 
 class Transposer(MidiEffect):
     """
@@ -104,29 +294,60 @@ class Doubler(MidiEffect):
         return sorted(list(set(chord) | set(self.transposer.apply(chord))))
 
 
+def keyed_random(seed, *key) -> float:
+    """
+    Returns a pseudo-random number in [0, 1) which only depends on the seed and the key.
+
+    Unlike a random number generator with state, the result doesn't depend on what was
+    generated before, so effects give the same output regardless of the order in which
+    the chords are processed.
+    """
+    digest = blake2b(repr((seed,) + key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / (1 << 64)
+
+
 class Spreader(MidiEffect):
     """
     Spreads the notes in time by the specified amount
     Jitter can be used to randomize the spread by some amount
     """
 
-    def __init__(self, amount, jitter):
+    def __init__(self, amount, jitter, seed=None):
         """
         Parameters:
-        * amount: number of MIDI ticks to delay each subsequent note (each bar is 1920 ticks)
+        * amount: number of MIDI ticks to delay each subsequent note (each bar is 4 * ticks_per_beat ticks, 1920 by default)
         * jitter: maximum number of MIDI ticks by which to randomize each note's arrival time
+        * seed: if given, the jitter for each note is determined by the seed, the time of the note
+                and its position in the chord, so the output is reproducible.
+                Otherwise, the global random number generator is used.
         """
         self.amount = amount
         self.jitter = jitter
+        self.seed = seed
+        # A negative amount moves each note after the first earlier than the chord
+        self.lookahead = abs(jitter) + max(0, -amount) * (MAX_CHORD_SIZE - 1)
+
+    def is_deterministic(self) -> bool:
+        return self.seed is not None or not self.jitter
+
+    def _random(self, note, index):
+        if self.seed is None:
+            return random.random()
+        return keyed_random(self.seed, note.time, index)
 
     def apply(self, chord):
+        out = []
         displacement = 0
         for i, note in enumerate(chord):
-            chord[i] = note._replace(
-                time=note.time + displacement + self.jitter * (random.random() * 2 - 1)
+            out.append(
+                note._replace(
+                    time=note.time
+                    + displacement
+                    + self.jitter * (self._random(note, i) * 2 - 1)
+                )
             )
             displacement += self.amount
-        return chord
+        return out
 
 
 class Arpeggiator(MidiEffect):
@@ -137,8 +358,8 @@ class Arpeggiator(MidiEffect):
     def __init__(self, rate: float, pattern: list, sticky=False):
         """
         Parameters:
-        * rate (1/8 gives eight notes, 1/16 gives quarter notes etc)
-        * pattern: List of indices into each chord.
+        * rate: length of each step as a fraction of a bar (1/8 gives eighth notes, 1/16 gives sixteenth notes etc)
+        * pattern: List of indices into each chord, or tuples of indices to play several notes in one step.
                    Each index is modulo'd with the length of the chord, so out-of-bounds indices are OK.
                    Will be cycled through for as long as the chord is held.
                    Negative indices work like usual.
@@ -149,37 +370,80 @@ class Arpeggiator(MidiEffect):
         self.pattern = pattern
         self.sticky = sticky
         self.offset = 0
+        self._steps = tuple(
+            (indices,) if isinstance(indices, int) else tuple(indices)
+            for indices in pattern
+        )
+        self._rate = Fraction(rate).limit_denominator(1 << 16)
 
-    def apply(self, chord):
-        min_start = float("inf")
-        max_stop = -float("inf")
-        for note in chord:
-            min_start = min(min_start, note.time)
-            max_stop = max(max_stop, note.time + note.duration)
-        duration = max_stop - min_start
-        one_beat = 1920
-        ticks_per_note = self.rate * one_beat
-        out = []
-        total_duration = 0
-        i = 0
-        while total_duration < duration:
-            indices = self.pattern[(i + self.offset) % len(self.pattern)]
-            if isinstance(indices, int):
-                indices = [indices]
-            for index in indices:
-                note = chord[index % len(chord)]
-                out.append(
-                    MidiNote(
-                        time=note.time + int(ticks_per_note * i),
-                        duration=ticks_per_note,
-                        note=note.note,
-                        velocity=self.settings.velocity,
-                    )
+    def _step_time(self, step: int, ticks_per_bar: int) -> int:
+        """
+        Returns the start of the given step in ticks from the start of the chord.
+        Each step time is rounded from the exact value, so rounding errors don't accumulate.
+        """
+        return (
+            step * self._rate.numerator * ticks_per_bar + self._rate.denominator // 2
+        ) // self._rate.denominator
+
+    def iter_apply(self, chord):
+        """
+        Returns an iterator over the arpeggiated notes for the given chord in time order.
+        The notes are generated one step at a time as the iterator is consumed,
+        unless the notes in the chord start at different times (e.g. after Spreader).
+        """
+        steps = self._apply_steps(chord)
+        if any(note.time != chord[0].time for note in chord):
+            # The steps are only in time order when all the notes start together
+            return iter(sorted(steps, key=_note_time))
+        return steps
+
+    def _apply_steps(self, chord):
+        """Returns an iterator over the arpeggiated notes for the given chord, step by step."""
+        if not chord:
+            return iter(())
+        start = min(note.time for note in chord)
+        duration = max(note.time + note.duration for note in chord) - start
+        ticks_per_bar = self.ticks_per_bar()
+
+        # Number of steps that start before the chord ends
+        half = self._rate.denominator // 2
+        n_steps = max(
+            0,
+            ceil(
+                (Fraction(duration) * self._rate.denominator - half)
+                / (self._rate.numerator * ticks_per_bar)
+            ),
+        )
+        offset = self.offset
+        if self.sticky:
+            self.offset += n_steps
+        return self._iter_steps(chord, offset, n_steps, ticks_per_bar)
+
+    def get_state(self):
+        return self.offset
+
+    def set_state(self, state):
+        self.offset = state
+
+    def _iter_steps(self, chord, offset, n_steps, ticks_per_bar):
+        velocity = self.settings.velocity
+        n_pattern = len(self._steps)
+        n_notes = len(chord)
+        step_time = 0
+        for step in range(n_steps):
+            next_step_time = self._step_time(step + 1, ticks_per_bar)
+            for index in self._steps[(step + offset) % n_pattern]:
+                note = chord[index % n_notes]
+                yield MidiNote(
+                    time=note.time + step_time,
+                    duration=next_step_time - step_time,
+                    note=note.note,
+                    velocity=velocity,
                 )
-            i += 1
-            total_duration += ticks_per_note
-        self.offset += i * self.sticky
-        return out
+            step_time = next_step_time
+
+    def apply(self, chord):
+        return list(self._apply_steps(chord))
 
 
 class Shuffle(MidiEffect):
@@ -189,8 +453,13 @@ class Shuffle(MidiEffect):
         self.percent = percent
         self.tolerance_ticks = tolerance_ticks
 
+    @property
+    def lookahead(self):
+        # Only a swing of less than 50% moves notes earlier
+        return max(0, (50 - self.percent) * self.ticks_per_bar() * self.base_rate / 100)
+
     def apply(self, chord):
-        dt = 1920 * self.base_rate
+        dt = self.ticks_per_bar() * self.base_rate
         two_dt = 2 * dt
         out = []
         for note in chord:
@@ -203,56 +472,200 @@ class Shuffle(MidiEffect):
         return out
 
 
+class Legato(StreamingMidiEffect):
+    """
+    Holds each note until the next note starts, also across chords
+    """
+
+    def __init__(self, overlap=0):
+        """
+        Parameters:
+        * overlap: number of MIDI ticks by which each note should overlap the next one
+        """
+        self.overlap = overlap
+
+    def stream(self, notes):
+        # Look ahead by one group of notes with the same start time
+        prev_group = None
+        for time, group in groupby(notes, key=_note_time):
+            if prev_group is not None:
+                for note in prev_group:
+                    yield note._replace(duration=time - note.time + self.overlap)
+            prev_group = list(group)
+        if prev_group is not None:
+            yield from prev_group
+
+
+def _interpolate_linear(v0, v1, x):
+    return v0 + (v1 - v0) * x
+
+
+def _interpolate_exponential(v0, v1, x):
+    v0 = max(v0, 1)
+    v1 = max(v1, 1)
+    return v0 * (v1 / v0) ** x
+
+
+def _interpolate_s_curve(v0, v1, x):
+    return v0 + (v1 - v0) * x * x * (3 - 2 * x)
+
+
 class VelocityControl(MidiEffect):
-    def __init__(self, keyframes):
+    """
+    Sets the velocity of each note by following a curve through a list of keyframes
+
+    The curve starts over after the last keyframe.
+    """
+
+    SHAPES = {
+        "linear": _interpolate_linear,
+        "exponential": _interpolate_exponential,
+        "s-curve": _interpolate_s_curve,
+    }
+
+    def __init__(self, keyframes, shape="linear"):
+        """
+        Parameters:
+        * keyframes: list of (bar, velocity) tuples. There must be at least one keyframe.
+        * shape: how to get from one keyframe to the next. One of:
+                 "linear": straight line
+                 "exponential": constant ratio per tick, sounds more even for long swells
+                 "s-curve": starts and ends slowly
+        """
+        if not keyframes:
+            raise ValueError("VelocityControl needs at least one keyframe")
+        if shape not in self.SHAPES:
+            raise ValueError(
+                f"Unknown shape {shape!r}, should be one of: {list(self.SHAPES)}"
+            )
+        self.keyframes = keyframes
+        self.shape = shape
+        self._interpolate = self.SHAPES[shape]
+        self._make_curve(DEFAULT_TICKS_PER_BAR)
+
+    def set_settings(self, settings: MidiConversionSettings):
+        super().set_settings(settings)
+        self._make_curve(self.ticks_per_bar())
+
+    def _make_curve(self, ticks_per_bar):
         self.keyframes_ticks = sorted(
-            [(bar * 1920, velocity) for bar, velocity in keyframes]
-        )
-        self.duration = max(bar for bar, velocity in self.keyframes_ticks) - min(
-            bar for bar, velocity in self.keyframes_ticks
+            [(bar * ticks_per_bar, velocity) for bar, velocity in self.keyframes]
         )
+        self._times = [t for t, v in self.keyframes_ticks]
+        self._velocities = [v for t, v in self.keyframes_ticks]
+        self.duration = self._times[-1] - self._times[0]
+
+    def velocity_at(self, time):
+        """
+        Returns the velocity at the given time (in MIDI ticks)
+        """
+        start = self._times[0]
+        if self.duration == 0:
+            return int(round(self._velocities[0]))
+        t = start + (time - start) % self.duration
+        i = bisect_right(self._times, t) - 1
+        if i >= len(self._times) - 1:
+            return int(round(self._velocities[-1]))
+        t0 = self._times[i]
+        t1 = self._times[i + 1]
+        x = (t - t0) / (t1 - t0)
+        v = self._interpolate(self._velocities[i], self._velocities[i + 1], x)
+        return int(round(v))
 
     def apply(self, chord):
+        # The notes in a chord usually share a few start times, so look up each time once
+        velocities = {}
         out = []
         for note in chord:
-            t = note.time % self.duration
-            for t0, v0 in reversed(self.keyframes_ticks):
-                if t0 < t:
-                    break
-            for t1, v1 in self.keyframes_ticks:
-                if t1 > t:
-                    break
-            v = v0 + (t - t0) * (v1 - v0) / (t1 - t0)
-            out.append(note._replace(velocity=v))
+            if note.time not in velocities:
+                velocities[note.time] = self.velocity_at(note.time)
+            out.append(note._replace(velocity=velocities[note.time]))
         return out
 
 
 class Harmonizer(MidiEffect):
     """
-    Adds a transposed copy shifted by the specified interval
+    Adds copies of each note shifted to other degrees of the given scale
     """
 
-    def __init__(self, scale, degrees, root):
+    OUT_OF_SCALE_OPTIONS = {"raise", "snap"}
+
+    def __init__(self, scale, degrees, root, out_of_scale="raise"):
+        """
+        Parameters:
+        * scale: list of semitones from the root, starting with 0
+        * degrees: the scale degrees to add for each note (1 is the note itself, 3 is a third above etc.)
+        * root: name of the root note of the scale
+        * out_of_scale: what to do with notes that are not in the scale. One of:
+                        "raise": raise a ValueError
+                        "snap": harmonize as if the note was the nearest note in the scale
+        """
         self.scale = scale
         self.degrees = degrees
         self.root = Note(root, octave=4)
         assert scale[0] == 0
         assert all(degree >= 1 for degree in degrees)
+        assert (
+            out_of_scale in self.OUT_OF_SCALE_OPTIONS
+        ), f"out_of_scale argument must be one of: {self.OUT_OF_SCALE_OPTIONS}"
+        self.out_of_scale = out_of_scale
+        self._root_midi = note_to_midi(self.root)
+        self._table = self._make_table()
+
+    def _offsets_for_degree(self, degree_in):
+        offset = self.scale[degree_in]
+        offsets = []
+        for degree in self.degrees:
+            scale_out = self.scale[(degree_in + degree - 1) % len(self.scale)]
+            offsets.append((scale_out - offset) % 12)
+        return tuple(offsets)
+
+    def _make_table(self):
+        """
+        Returns a list which maps each of the 12 offsets from the root to the shifts
+        to apply for each degree, or None if the offset is not in the scale.
+        """
+        table = [None] * 12
+        for degree_in, offset in enumerate(self.scale):
+            table[offset % 12] = self._offsets_for_degree(degree_in)
+
+        if self.out_of_scale == "snap":
+            for offset in range(12):
+                if table[offset] is not None:
+                    continue
+                # Nearest scale note, preferring the one below on ties
+                snap = min(
+                    range(len(self.scale)),
+                    key=lambda degree_in: (
+                        abs(self._signed_distance(offset, self.scale[degree_in])),
+                        self._signed_distance(offset, self.scale[degree_in]) > 0,
+                    ),
+                )
+                distance = self._signed_distance(offset, self.scale[snap])
+                table[offset] = tuple(
+                    shift + distance for shift in self._offsets_for_degree(snap)
+                )
+        return table
+
+    @staticmethod
+    def _signed_distance(offset_from, offset_to):
+        distance = (offset_to - offset_from) % 12
+        if distance > 6:
+            distance -= 12
+        return distance
 
     def apply(self, chord):
         out = []
         for note in chord:
             out.append(note)
-            offset = (midi_to_note(note.note) - self.root) % 12
-            if offset not in self.scale:
+            offset = (note.note - self._root_midi) % 12
+            shifts = self._table[offset]
+            if shifts is None:
                 raise ValueError(
                     "Note with MIDI number {} is not in the scale (offset from root is {}, should be one of: {})".format(
                         note.note, offset, self.scale
                     )
                 )
-            degree_in = self.scale.index(offset)
-            for degree in self.degrees:
-                scale_out = self.scale[(degree_in + degree - 1) % len(self.scale)]
-                semitones_diff = (scale_out - offset) % 12
-                out.append(note._replace(note=note.note + semitones_diff))
+            for shift in shifts:
+                out.append(note._replace(note=note.note + shift))
         return out
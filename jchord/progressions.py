@@ -1,13 +1,43 @@
 """
 Tools for working with chord progressions.
 """
-from collections import namedtuple
-from typing import Hashable, List, Set, Union
-
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, OrderedDict
+from collections.abc import MutableSequence, Sequence
+from copy import copy
+from fractions import Fraction
+from itertools import chain, groupby, repeat
+from math import gcd
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from jchord.cache import RenderCache
 from jchord.knowledge import REPETITION_SYMBOL
 from jchord.core import CompositeObject
 from jchord.chords import Chord
-from jchord.midi import read_midi_file, notes_to_messages, MidiNote
+from jchord.midi import (
+    read_midi_file,
+    iter_notes_to_messages,
+    save_midi_file,
+    MidiNote,
+    MidiNoteCache,
+)
+from jchord.find_sections import find_sections
+from jchord import rope
+from jchord.timeline import IntervalIndex
 from jchord.group_notes_to_chords import group_notes_to_chords
 
 
@@ -15,27 +45,662 @@ class InvalidProgression(Exception):
     """Raised when encountering what seems like an invalid chord progression."""
 
 
-def _string_to_progression(string: str) -> List[Chord]:
-    string = string.strip()
-
-    if string == "":
-        return []
-
-    progression = []
+def _iter_tokens(file: TextIO, chunk_size: int) -> Iterator[str]:
+    """
+    Yields the whitespace-separated tokens in the file, reading it in chunks.
+    A token that is split across two chunks is put back together before it is yielded.
+    """
+    remainder = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        chunk = remainder + chunk
+        tokens = chunk.split()
+        if tokens and not chunk[-1].isspace():
+            remainder = tokens.pop()
+        else:
+            remainder = ""
+        yield from tokens
+    if remainder:
+        yield remainder
 
-    for name in string.split():
-        name = name.strip()
 
+def _iter_chords(names: Iterable[str]) -> Iterator[Chord]:
+    # Each distinct name is only parsed once, and gives the same Chord object every time
+    chords_by_name = {}
+    prev_chord = None
+    for name in names:
         if name == REPETITION_SYMBOL:
-            if not progression:
+            if prev_chord is None:
                 raise InvalidProgression(
                     "Can't repeat before at least one chord has been added"
                 )
+        else:
+            prev_chord = chords_by_name.get(name)
+            if prev_chord is None:
+                prev_chord = chords_by_name[name] = Chord.from_name(name)
+        yield prev_chord
+
+
+def _iter_runs(chords: Iterable[Chord]) -> Iterator[Tuple[Chord, int]]:
+    """
+    Groups consecutive occurrences of the same Chord object into (chord, count) pairs.
+    """
+    for _, group in groupby(chords, key=id):
+        chord = next(group)
+        yield chord, 1 + sum(1 for _ in group)
+
+
+def _string_to_progression(string: str) -> "ChordSequence":
+    return ChordSequence.from_runs(_iter_runs(_iter_chords(string.split())))
+
+
+def _iter_cell_runs(
+    runs: Iterable[Tuple[Chord, int]], prev_chord: Optional[Chord] = None
+) -> Iterator[Tuple[str, int]]:
+    """
+    Yields (name, count) pairs for writing the chords in the runs one cell at a time,
+    where each chord that is equal to the one before it is written as REPETITION_SYMBOL.
+    """
+    # Runs reuse the same few Chord objects, so remember the result of each comparison
+    is_repetition = {}
+    for chord, count in runs:
+        key = (id(prev_chord), id(chord))
+        try:
+            repetition = is_repetition[key]
+        except KeyError:
+            repetition = is_repetition[key] = prev_chord == chord
+        if repetition:
+            yield REPETITION_SYMBOL, count
+        else:
+            yield chord.name, 1
+            if count > 1:
+                yield REPETITION_SYMBOL, count - 1
+        prev_chord = chord
+
+
+def _chord_key(chord) -> Hashable:
+    """
+    Returns a key which is equal for two chords only if they behave the same in every respect,
+    including their names (``Chord.__eq__`` only looks at the notes).
+    """
+    try:
+        intervals = chord.intervals
+        return (
+            chord.name,
+            chord.root.name,
+            chord.root.octave,
+            intervals.name,
+            tuple(intervals.semitones),
+            intervals._inversions,
+        )
+    except AttributeError:
+        return chord
+
+
+_TRANSPOSE_CACHE_SIZE = 4096
+_transpose_cache = OrderedDict()
+
+
+def _transpose_chord(chord: Chord, shift: int) -> Chord:
+    """
+    Returns ``chord.transpose(shift)``.
+    The most recently used results are kept, keyed by the chord and the shift.
+    """
+    key = (_chord_key(chord), shift)
+    try:
+        _transpose_cache.move_to_end(key)
+        return _transpose_cache[key]
+    except KeyError:
+        transposed = _transpose_cache[key] = chord.transpose(shift)
+        if len(_transpose_cache) > _TRANSPOSE_CACHE_SIZE:
+            _transpose_cache.popitem(last=False)
+        return transposed
+
+
+class ChordSequence(MutableSequence):
+    """
+    A list of chords which stores each distinct chord only once.
+
+    The chords are kept in a table of unique chords, and the sequence itself is an
+    ``array`` of indices into that table, so a long progression with few distinct chords
+    takes up very little memory. Apart from that, it works like a list of chords.
+    """
+
+    def __init__(self, chords: Iterable[Chord] = ()):
+        self._table = []
+        self._index = {}
+        self._codes = array("H")
+        self._has_unused = False
+        self._runs = None
+        if isinstance(chords, ChordSequence):
+            self._table = list(chords._table)
+            self._codes = array(chords._codes.typecode, chords._codes)
+            self._has_unused = chords._has_unused
+            self._runs = chords._runs
+            self._index = None
+        else:
+            self.extend(chords)
+
+    @classmethod
+    def _from_table(
+        cls, table: List[Chord], codes: array, runs: Optional[tuple] = None
+    ) -> "ChordSequence":
+        sequence = cls()
+        sequence._table = table
+        sequence._codes = codes
+        sequence._runs = runs
+        sequence._index = None
+        return sequence
+
+    @classmethod
+    def from_runs(cls, runs: Iterable[Tuple[Chord, int]]) -> "ChordSequence":
+        """
+        Creates a sequence from ``(chord, count)`` pairs, where each chord is repeated ``count`` times.
+        """
+        sequence = cls()
+        run_codes = []
+        run_lengths = array("L")
+        for chord, count in runs:
+            if count <= 0:
+                continue
+            code = sequence._code(chord)
+            sequence._codes.extend(repeat(code, count))
+            if run_codes and run_codes[-1] == code:
+                run_lengths[-1] += count
+            else:
+                run_codes.append(code)
+                run_lengths.append(count)
+        sequence._runs = (array(sequence._codes.typecode, run_codes), run_lengths)
+        return sequence
+
+    def _get_index(self) -> dict:
+        if self._index is None:
+            self._index = {}
+            for code, chord in enumerate(self._table):
+                self._index.setdefault(_chord_key(chord), code)
+        return self._index
+
+    def _code(self, chord: Chord) -> int:
+        index = self._get_index()
+        key = _chord_key(chord)
+        code = index.get(key)
+        if code is None:
+            code = len(self._table)
+            if code > 0xFFFF and self._codes.typecode == "H":
+                self._codes = array("I", self._codes)
+            self._table.append(chord)
+            index[key] = code
+        return code
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __iter__(self) -> Iterator[Chord]:
+        return map(self._table.__getitem__, self._codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._from_table(list(self._table), self._codes[index])
+        return self._table[self._codes[index]]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            codes = [self._code(chord) for chord in value]
+            self._codes[index] = array(self._codes.typecode, codes)
+        else:
+            self._codes[index] = self._code(value)
+        self._has_unused = True
+        self._runs = None
+
+    def __delitem__(self, index):
+        del self._codes[index]
+        self._has_unused = True
+        self._runs = None
+
+    def insert(self, index: int, chord: Chord):
+        self._codes.insert(index, self._code(chord))
+        self._runs = None
+
+    def append(self, chord: Chord):
+        self._codes.append(self._code(chord))
+        self._runs = None
+
+    def extend(self, chords: Iterable[Chord]):
+        if isinstance(chords, ChordSequence):
+            chords = list(chords)
+        # Progressions often repeat the same Chord object, so remember the code for each object.
+        # The object is stored along with the code so its id can't be reused while we're here.
+        self._runs = None
+        codes_by_id = {}
+        for chord in chords:
+            try:
+                code, _ = codes_by_id[id(chord)]
+            except KeyError:
+                code = self._code(chord)
+                codes_by_id[id(chord)] = (code, chord)
+            self._codes.append(code)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def unique(self) -> List[Chord]:
+        """
+        Returns the distinct chords in the sequence, each of which is only listed once.
+        """
+        self._compact()
+        return list(self._table)
 
-            progression.append(progression[-1])
+    def _compact(self):
+        """
+        Removes chords that are no longer used from the table.
+        """
+        if not self._has_unused:
+            return
+        used = sorted(set(self._codes))
+        new_codes = {old_code: new_code for new_code, old_code in enumerate(used)}
+        self._table = [self._table[code] for code in used]
+        self._codes = array(
+            self._codes.typecode, [new_codes[code] for code in self._codes]
+        )
+        self._index = None
+        self._has_unused = False
+        self._runs = None
+
+    def transform(self, func: Callable[[Chord], Chord]) -> "ChordSequence":
+        """
+        Returns a new sequence where each chord has been replaced by ``func(chord)``.
+        ``func`` is only called once for each distinct chord.
+        """
+        self._compact()
+        return self._from_table(
+            [func(chord) for chord in self._table],
+            array(self._codes.typecode, self._codes),
+            self._runs,
+        )
+
+    def _get_runs(self) -> Tuple[array, array]:
+        if self._runs is None:
+            run_codes = array(self._codes.typecode)
+            run_lengths = array("L")
+            for code, group in groupby(self._codes):
+                run_codes.append(code)
+                run_lengths.append(sum(1 for _ in group))
+            self._runs = (run_codes, run_lengths)
+        return self._runs
+
+    def runs(self) -> Iterator[Tuple[Chord, int]]:
+        """
+        Yields ``(chord, count)`` for each run of the same chord repeated ``count`` times in a row.
+
+        The runs are computed once and kept until the sequence is modified.
+        """
+        run_codes, run_lengths = self._get_runs()
+        table = self._table
+        return ((table[code], length) for code, length in zip(run_codes, run_lengths))
+
+    def map_runs(self, func: Callable[[Chord], Any]) -> Iterator[Tuple[Any, int]]:
+        """
+        Like ``runs``, but yields ``(func(chord), count)``.
+        ``func`` is only called once for each distinct chord.
+        """
+        run_codes, run_lengths = self._get_runs()
+        results = {}
+        for code, length in zip(run_codes, run_lengths):
+            try:
+                result = results[code]
+            except KeyError:
+                result = results[code] = func(self._table[code])
+            yield result, length
+
+    def map_unique(self, func: Callable[[Chord], Any]) -> Iterator[Any]:
+        """
+        Yields ``func(chord)`` for each chord in the sequence,
+        but only calls ``func`` once for each distinct chord.
+        """
+        results = {}
+        for code in self._codes:
+            try:
+                yield results[code]
+            except KeyError:
+                result = results[code] = func(self._table[code])
+                yield result
+
+
+def _range_codes(sequence: ChordSequence, indices: range) -> array:
+    """Returns the codes at the given indices of the sequence."""
+    stop = indices.stop if indices.stop >= 0 else None
+    return sequence._codes[indices.start : stop : indices.step]
+
+
+def _clip_range(indices: range, low: int, high: int) -> range:
+    """Returns the part of ``indices`` which lies in ``[low, high)``, in the same order."""
+    ascending = indices if indices.step > 0 else indices[::-1]
+    clipped = ascending[bisect_left(ascending, low) : bisect_left(ascending, high)]
+    return clipped if indices.step > 0 else clipped[::-1]
+
+
+def _compose_ranges(outer: range, inner: range) -> range:
+    """Returns the range of ``outer[i] for i in inner``."""
+    start = outer.start + inner.start * outer.step
+    step = outer.step * inner.step
+    return range(start, start + len(inner) * step, step)
+
+
+class ChordSequenceView(Sequence):
+    """
+    A read-only view of one or more ``ChordSequence`` objects.
+
+    A view only keeps track of which parts of the underlying sequences it covers,
+    so slicing, concatenating and repeating views never copies the chords.
+    Changes to the underlying sequences are visible through the view,
+    so a sequence should not be resized while there are views of it.
+    """
+
+    def __init__(self, sequence: Iterable[Chord] = ()):
+        if isinstance(sequence, ChordSequenceView):
+            parts = sequence._parts
         else:
-            progression.append(Chord.from_name(name))
-    return progression
+            if not isinstance(sequence, ChordSequence):
+                sequence = ChordSequence(sequence)
+            parts = [(sequence, range(len(sequence)))]
+        self._set_parts(parts)
+
+    def _set_parts(self, parts: Iterable[Tuple[ChordSequence, range]]):
+        self._parts = []
+        self._offsets = []
+        self._length = 0
+        for sequence, indices in parts:
+            if len(indices):
+                self._parts.append((sequence, indices))
+                self._offsets.append(self._length)
+                self._length += len(indices)
+
+    @classmethod
+    def _from_parts(
+        cls, parts: Iterable[Tuple[ChordSequence, range]]
+    ) -> "ChordSequenceView":
+        view = cls.__new__(cls)
+        view._set_parts(parts)
+        return view
+
+    @classmethod
+    def concat(cls, *sequences: Iterable[Chord]) -> "ChordSequenceView":
+        """
+        Returns a view of the given sequences one after another.
+        """
+        return cls._from_parts(
+            part for sequence in sequences for part in cls(sequence)._parts
+        )
+
+    def repeat(self, times: int) -> "ChordSequenceView":
+        """
+        Returns a view of this view repeated the given number of times.
+        """
+        return self._from_parts(self._parts * times)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Chord]:
+        for sequence, indices in self._parts:
+            yield from map(sequence._table.__getitem__, _range_codes(sequence, indices))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._from_parts(self._slice_parts(range(self._length)[index]))
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("ChordSequenceView index out of range")
+        part = bisect_right(self._offsets, index) - 1
+        sequence, indices = self._parts[part]
+        return sequence[indices[index - self._offsets[part]]]
+
+    def _slice_parts(self, indices: range) -> Iterator[Tuple[ChordSequence, range]]:
+        if not indices:
+            return
+        first = bisect_right(self._offsets, min(indices)) - 1
+        last = bisect_right(self._offsets, max(indices)) - 1
+        parts = range(first, last + 1)
+        if indices.step < 0:
+            parts = reversed(parts)
+        for part in parts:
+            offset = self._offsets[part]
+            sequence, part_indices = self._parts[part]
+            clipped = _clip_range(indices, offset, offset + len(part_indices))
+            if clipped:
+                local = range(
+                    clipped.start - offset, clipped.stop - offset, clipped.step
+                )
+                yield sequence, _compose_ranges(part_indices, local)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def unique(self) -> List[Chord]:
+        """
+        Returns the distinct chords in the view, each of which is only listed once.
+        """
+        chords = {}
+        for sequence, indices in self._parts:
+            for code in dict.fromkeys(_range_codes(sequence, indices)):
+                chord = sequence._table[code]
+                chords.setdefault(_chord_key(chord), chord)
+        return list(chords.values())
+
+    def transform(self, func: Callable[[Chord], Chord]) -> ChordSequence:
+        """
+        Returns a new ``ChordSequence`` where each chord has been replaced by ``func(chord)``.
+        ``func`` is only called once for each distinct chord.
+        """
+        return ChordSequence.from_runs(self.map_runs(func))
+
+    def runs(self) -> Iterator[Tuple[Chord, int]]:
+        """
+        Yields ``(chord, count)`` for each run of the same chord repeated ``count`` times in a row.
+        """
+        prev_chord = None
+        total = 0
+        for sequence, indices in self._parts:
+            for code, group in groupby(_range_codes(sequence, indices)):
+                chord = sequence._table[code]
+                count = sum(1 for _ in group)
+                if chord is prev_chord:
+                    total += count
+                    continue
+                if total:
+                    yield prev_chord, total
+                prev_chord = chord
+                total = count
+        if total:
+            yield prev_chord, total
+
+    def map_runs(self, func: Callable[[Chord], Any]) -> Iterator[Tuple[Any, int]]:
+        """
+        Like ``runs``, but yields ``(func(chord), count)``.
+        ``func`` is only called once for each distinct chord.
+        """
+        results = {}
+        for chord, count in self.runs():
+            try:
+                result = results[id(chord)]
+            except KeyError:
+                result = results[id(chord)] = func(chord)
+            yield result, count
+
+    def map_unique(self, func: Callable[[Chord], Any]) -> Iterator[Any]:
+        """
+        Yields ``func(chord)`` for each chord in the view,
+        but only calls ``func`` once for each distinct chord.
+        """
+        for result, count in self.map_runs(func):
+            yield from repeat(result, count)
+
+
+class PersistentChordSequence(Sequence):
+    """
+    An immutable list of chords, where editing returns a new sequence instead of changing this one.
+
+    The chords are kept in a balanced tree with short tuples of chords at the leaves
+    (see ``jchord.rope``). ``replace``, ``insert`` and ``delete`` take O(log n) time, and the new
+    sequence shares all but O(log n) nodes with the old one. Old sequences stay valid, so keeping
+    them around as snapshots (e.g. for undo) costs very little memory.
+    """
+
+    def __init__(self, chords: Iterable[Chord] = ()):
+        if isinstance(chords, PersistentChordSequence):
+            self._tree = chords._tree
+        else:
+            self._tree = rope.build(chords)
+
+    @classmethod
+    def _from_tree(cls, tree: rope.Rope) -> "PersistentChordSequence":
+        sequence = cls.__new__(cls)
+        sequence._tree = tree
+        return sequence
+
+    @classmethod
+    def concat(cls, *sequences: Iterable[Chord]) -> "PersistentChordSequence":
+        """
+        Returns the given sequences one after another.
+        """
+        tree = ()
+        for sequence in sequences:
+            tree = rope.join(tree, cls(sequence)._tree)
+        return cls._from_tree(tree)
+
+    def repeat(self, times: int) -> "PersistentChordSequence":
+        """
+        Returns the sequence repeated the given number of times.
+        """
+        return self._from_tree(rope.repeat(self._tree, times))
+
+    def replace(self, index: int, chord: Chord) -> "PersistentChordSequence":
+        """
+        Returns a new sequence where the chord at the given index is replaced.
+        """
+        index = range(len(self))[index]
+        return self._from_tree(rope.replace(self._tree, index, chord))
+
+    def insert(self, index: int, chord: Chord) -> "PersistentChordSequence":
+        """
+        Returns a new sequence where the chord is inserted before the given index.
+        """
+        index = range(len(self) + 1)[index]
+        return self._from_tree(rope.insert(self._tree, index, chord))
+
+    def append(self, chord: Chord) -> "PersistentChordSequence":
+        """
+        Returns a new sequence where the chord is added at the end.
+        """
+        return self._from_tree(rope.insert(self._tree, len(self), chord))
+
+    def delete(self, index: int) -> "PersistentChordSequence":
+        """
+        Returns a new sequence where the chord at the given index is removed.
+        """
+        index = range(len(self))[index]
+        return self._from_tree(rope.delete(self._tree, index))
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def __iter__(self) -> Iterator[Chord]:
+        return chain.from_iterable(rope.iter_leaves(self._tree))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(len(self))[index]
+            if indices.step != 1:
+                return type(self)(map(self.__getitem__, indices))
+            tree, _ = rope.split(self._tree, indices.stop)
+            _, tree = rope.split(tree, indices.start)
+            return self._from_tree(tree)
+        return rope.get(self._tree, range(len(self))[index])
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def unique(self) -> List[Chord]:
+        """
+        Returns the distinct chords in the sequence, each of which is only listed once.
+        """
+        chords = {}
+        for chord, _ in self.runs():
+            chords.setdefault(_chord_key(chord), chord)
+        return list(chords.values())
+
+    def transform(self, func: Callable[[Chord], Chord]) -> "PersistentChordSequence":
+        """
+        Returns a new sequence where each chord has been replaced by ``func(chord)``.
+        ``func`` is only called once for each distinct Chord object, and parts of the tree
+        which are shared (e.g. after ``repeat``) are only transformed once.
+        """
+        results = {}
+
+        def transform_chord(chord: Chord) -> Chord:
+            try:
+                return results[id(chord)][1]
+            except KeyError:
+                result = func(chord)
+                # The chord is kept along with the result so its id can't be reused
+                results[id(chord)] = (chord, result)
+                return result
+
+        return self._from_tree(
+            rope.map_leaves(self._tree, lambda leaf: tuple(map(transform_chord, leaf)))
+        )
+
+    def runs(self) -> Iterator[Tuple[Chord, int]]:
+        """
+        Yields ``(chord, count)`` for each run of the same Chord object repeated ``count`` times in a row.
+        """
+        return _iter_runs(self)
+
+    def map_runs(self, func: Callable[[Chord], Any]) -> Iterator[Tuple[Any, int]]:
+        """
+        Like ``runs``, but yields ``(func(chord), count)``.
+        ``func`` is only called once for each distinct Chord object.
+        """
+        results = {}
+        for chord, count in self.runs():
+            try:
+                _, result = results[id(chord)]
+            except KeyError:
+                result = func(chord)
+                results[id(chord)] = (chord, result)
+            yield result, count
+
+    def map_unique(self, func: Callable[[Chord], Any]) -> Iterator[Any]:
+        """
+        Yields ``func(chord)`` for each chord in the sequence,
+        but only calls ``func`` once for each distinct Chord object.
+        """
+        for result, count in self.map_runs(func):
+            yield from repeat(result, count)
 
 
 class MidiConversionSettings(object):
@@ -48,16 +713,33 @@ class MidiConversionSettings(object):
         velocity: int = 100,
         repeat: str = "replay",
         effect=None,
+        ticks_per_beat: int = 480,
+        tempo_changes: Optional[Union[dict, list]] = None,
+        time_signatures: Optional[Union[dict, list]] = None,
+        tracks: Optional[List["MidiTrackSettings"]] = None,
+        workers: Optional[int] = None,
+        cache: Optional[RenderCache] = None,
     ):
         self.filename = filename
         self.instrument = int(instrument)
         self.tempo = int(tempo)
+        # Maps the index of a chord to the tempo from that chord on
+        self.tempo_changes = dict(tempo_changes or {})
+        # Maps the index of a chord to the time signature (numerator, denominator) from that chord on
+        self.time_signatures = dict(time_signatures or {})
+        # If there are several tracks, each has its own effect, instrument and channel
+        self.tracks = list(tracks or [])
+        # Tracks are rendered in this many processes
+        self.workers = workers
+        # If given, files which have been rendered before are copied from the cache
+        self.cache = cache
         if isinstance(beats_per_chord, str):
             beats_per_chord = float(beats_per_chord)
         self.beats_per_chord = beats_per_chord
         self.velocity = int(velocity)
         self.repeat = repeat
         self.effect = effect
+        self.ticks_per_beat = int(ticks_per_beat)
         self.progression = None
 
     def set(self, **kwargs):
@@ -65,6 +747,37 @@ class MidiConversionSettings(object):
             setattr(self, key, value)
 
 
+class MidiTrackSettings(object):
+    """
+    Settings for one of the tracks in ``MidiConversionSettings.tracks``.
+
+    All the tracks play the same chords, each with its own effect, instrument and MIDI channel.
+
+    Parameters:
+    * effect: the effect for the track (by default, none)
+    * instrument: the instrument for the track (by default, the one in the settings)
+    * channel: the MIDI channel for the track, from 0 to 15
+    * velocity: the velocity for the track (by default, the one in the settings)
+    * name: the name of the track (by default, no name)
+    """
+
+    def __init__(
+        self,
+        effect=None,
+        instrument: Optional[int] = None,
+        channel: int = 0,
+        velocity: Optional[int] = None,
+        name: Optional[str] = None,
+    ):
+        if not 0 <= channel <= 15:
+            raise ValueError(f"The MIDI channel must be from 0 to 15, not {channel}")
+        self.effect = effect
+        self.instrument = None if instrument is None else int(instrument)
+        self.channel = int(channel)
+        self.velocity = None if velocity is None else int(velocity)
+        self.name = name
+
+
 class ChordProgression(CompositeObject):
     """
     Represents a chord progression.
@@ -119,12 +832,97 @@ class ChordProgression(CompositeObject):
 
     DUMMY_CHORD = _DummyChord()
 
-    def __init__(self, progression: List[Chord]):
+    def __init__(self, progression: Iterable[Chord]):
+        if not isinstance(
+            progression, (ChordSequence, ChordSequenceView, PersistentChordSequence)
+        ):
+            progression = ChordSequence(progression)
         self.progression = progression
 
     def __len__(self):
         return len(self.progression)
 
+    def __getitem__(self, index: Union[int, slice]):
+        """
+        Returns the chord at the given index.
+        Slicing returns a ``ChordProgression`` which shares the chords with this one instead of copying them.
+
+        >>> ChordProgression.from_string("C F G7 C")[1:3].to_string()
+        'F   G7  \\n'
+        """
+        if isinstance(index, slice):
+            if isinstance(self.progression, PersistentChordSequence):
+                return type(self)(self.progression[index])
+            return type(self)(ChordSequenceView(self.progression)[index])
+        return self.progression[index]
+
+    @classmethod
+    def concat(cls, *progressions: "ChordProgression") -> "ChordProgression":
+        """
+        Returns the given progressions one after another, without copying the chords.
+        """
+        return cls(
+            ChordSequenceView.concat(
+                *(progression.progression for progression in progressions)
+            )
+        )
+
+    def repeat(self, times: int) -> "ChordProgression":
+        """
+        Returns the progression repeated the given number of times, without copying the chords.
+        """
+        if isinstance(self.progression, PersistentChordSequence):
+            return type(self)(self.progression.repeat(times))
+        return type(self)(ChordSequenceView(self.progression).repeat(times))
+
+    def persistent(self) -> "ChordProgression":
+        """
+        Returns the same progression backed by a ``PersistentChordSequence``.
+
+        Editing the result with ``replace``, ``insert`` and ``delete`` takes O(log n) time,
+        and every version can be kept as a snapshot for very little memory.
+
+        >>> before = ChordProgression.from_string("C F G7 C").persistent()
+        >>> after = before.replace(1, Chord.from_name("Dm7")).insert(2, Chord.from_name("Em"))
+        >>> [chord.name for chord in before.progression]
+        ['C', 'F', 'G7', 'C']
+        >>> [chord.name for chord in after.progression]
+        ['C', 'Dm7', 'Em', 'G7', 'C']
+        """
+        if isinstance(self.progression, PersistentChordSequence):
+            return self
+        return type(self)(PersistentChordSequence(self.progression))
+
+    def replace(self, index: int, chord: Chord) -> "ChordProgression":
+        """
+        Returns a new progression where the chord at the given index is replaced.
+        This progression is left as it is (see ``persistent``).
+        """
+        return type(self)(self.persistent().progression.replace(index, chord))
+
+    def insert(self, index: int, chord: Chord) -> "ChordProgression":
+        """
+        Returns a new progression where the chord is inserted before the given index.
+        This progression is left as it is (see ``persistent``).
+        """
+        return type(self)(self.persistent().progression.insert(index, chord))
+
+    def delete(self, index: int) -> "ChordProgression":
+        """
+        Returns a new progression where the chord at the given index is removed.
+        This progression is left as it is (see ``persistent``).
+        """
+        return type(self)(self.persistent().progression.delete(index))
+
+    def windows(self, size: int, step: int = 1) -> Iterator["ChordProgression"]:
+        """
+        Yields each slice of ``size`` chords in the progression, starting every ``step`` chords.
+        The slices share the chords with this progression, so no chords are copied.
+        """
+        view = ChordSequenceView(self.progression)
+        for start in range(0, len(view) - size + 1, step):
+            yield type(self)(view[start : start + size])
+
     def _keys(self) -> Hashable:
         return (self.progression,)
 
@@ -133,9 +931,28 @@ class ChordProgression(CompositeObject):
         return cls(_string_to_progression(string))
 
     @classmethod
-    def from_txt(cls, filename: str) -> "ChordProgression":
+    def from_txt(cls, filename: str, chunk_size: int = 1 << 16) -> "ChordProgression":
+        return cls(
+            ChordSequence.from_runs(
+                _iter_runs(cls.iter_txt(filename, chunk_size=chunk_size))
+            )
+        )
+
+    @staticmethod
+    def iter_txt(filename: str, chunk_size: int = 1 << 16) -> Iterator[Chord]:
+        """
+        Yields the chords in a text file one at a time, reading ``chunk_size`` characters at a time.
+        This can be used for files that are too big to keep in memory.
+        """
         with open(filename) as file:
-            return cls(_string_to_progression(file.read()))
+            yield from ChordProgression.iter_file(file, chunk_size=chunk_size)
+
+    @staticmethod
+    def iter_file(file: TextIO, chunk_size: int = 1 << 16) -> Iterator[Chord]:
+        """
+        Like ``iter_txt``, but reads from an open text file (e.g. ``sys.stdin``).
+        """
+        return _iter_chords(_iter_tokens(file, chunk_size))
 
     @classmethod
     def from_xlsx(cls, filename: str) -> "ChordProgression":
@@ -153,12 +970,14 @@ class ChordProgression(CompositeObject):
         return cls.from_string(" ".join(names))
 
     @classmethod
-    def from_midi_file(cls, filename: str) -> "ChordProgression":
-        notes = read_midi_file(filename)
-        progression = []
-        for chord in group_notes_to_chords(notes):
-            progression.append(Chord.from_midi([note.note for note in chord]))
-        return cls(progression)
+    def from_midi_file(
+        cls, filename: str, cache: Union[MidiNoteCache, str, None] = None
+    ) -> "ChordProgression":
+        return cls(
+            TimedChordProgression.from_midi_file(
+                filename, cache
+            ).progression.progression
+        )
 
     from_midi = from_midi_file
 
@@ -169,7 +988,7 @@ class ChordProgression(CompositeObject):
         >>> ChordProgression.from_string("Am7 D7").chords() # doctest: +SKIP
         {Chord(name='D7', root=Note('D', 4), intervals=Intervals(name='7', semitones=[0, 4, 7, 10])), Chord(name='Am7', root=Note('A', 4), intervals=Intervals(name='m7', semitones=[0, 3, 7, 10]))}
         """
-        return set(self.progression)
+        return set(self.progression.unique())
 
     def midi(self) -> List[List[int]]:
         """
@@ -178,7 +997,10 @@ class ChordProgression(CompositeObject):
         >>> ChordProgression.from_string("Am7 D7").midi()
         [[69, 72, 76, 79], [62, 66, 69, 72]]
         """
-        return [chord.midi() for chord in self.progression]
+        return [
+            list(midi)
+            for midi in self.progression.map_unique(lambda chord: chord.midi())
+        ]
 
     def transpose(self, shift: int):
         """
@@ -187,7 +1009,22 @@ class ChordProgression(CompositeObject):
         >>> ChordProgression.from_string("Am7 D7").transpose(2).to_string().strip()
         'Bm7  E7'
         """
-        return ChordProgression([chord.transpose(shift) for chord in self.progression])
+        return ChordProgression(
+            self.progression.transform(lambda chord: _transpose_chord(chord, shift))
+        )
+
+    def all_keys(
+        self, shifts: Iterable[int] = range(12)
+    ) -> Dict[int, "ChordProgression"]:
+        """
+        Returns a dictionary which maps each shift to the progression transposed by that shift.
+        By default, the progression is transposed to all 12 keys, starting with the original key.
+
+        >>> keys = ChordProgression.from_string("Am7 D7").all_keys()
+        >>> keys[3].to_string().strip()
+        'Cm7  F7'
+        """
+        return {shift: self.transpose(shift) for shift in shifts}
 
     def to_string(
         self, chords_per_row: int = 4, column_spacing: int = 2, newline: str = "\n"
@@ -195,27 +1032,23 @@ class ChordProgression(CompositeObject):
         """
         Returns the string representation of the chord progression.
         """
-        max_len = max(len(chord.name) for chord in self.progression)
+        max_len = max(len(chord.name) for chord in self.progression.unique())
         column_width = max_len + column_spacing
 
         column = 0
         output = []
-        prev_chord = None
-        for chord in self.progression:
-            if prev_chord == chord:
-                chord_name = REPETITION_SYMBOL
-            else:
-                chord_name = chord.name
-
-            output.append(chord_name)
-            output.append(" " * (column_width - len(chord_name)))
-
-            column += 1
-            if column % chords_per_row == 0:
-                column = 0
-                output.append(newline)
-
-            prev_chord = chord
+        for chord_name, count in _iter_cell_runs(self.progression.runs()):
+            cell = chord_name + " " * (column_width - len(chord_name))
+
+            # Write as much of the run as fits on the current row at once
+            while count > 0:
+                n_cells = min(count, chords_per_row - column)
+                output.append(cell * n_cells)
+                count -= n_cells
+                column += n_cells
+                if column == chords_per_row:
+                    column = 0
+                    output.append(newline)
 
         return "".join(output) + newline
 
@@ -237,13 +1070,28 @@ class ChordProgression(CompositeObject):
         with open(filename, "w") as file:
             file.write(output_str)
 
-    def to_xlsx(self, filename: str, chords_per_row: int = 4):
+    def to_xlsx(
+        self,
+        filename: str,
+        chords_per_row: int = 4,
+        cache: Optional[RenderCache] = None,
+    ):
         """
         Saves the chord progression to an Excel file.
+        If a ``RenderCache`` is given, the file is copied from it if it has been made before.
 
         .. note::
             This feature requires ``openpyxl``, which you can get with ``pip install openpyxl``.
         """
+        if cache is not None:
+            cache.render(
+                ("xlsx", _chords_cache_key(self), chords_per_row),
+                ".xlsx",
+                filename,
+                lambda: self.to_xlsx(filename, chords_per_row),
+            )
+            return
+
         from openpyxl import Workbook
 
         workbook = Workbook()
@@ -251,125 +1099,646 @@ class ChordProgression(CompositeObject):
 
         row = 1
         column = 1
-        prev_chord = None
-        for chord in self.progression:
-            if prev_chord == chord:
-                chord_name = REPETITION_SYMBOL
-            else:
-                chord_name = chord.name
+        for chord_name, count in _iter_cell_runs(self.progression.runs()):
+            for _ in range(count):
+                worksheet.cell(row=row, column=column).value = chord_name
 
-            worksheet.cell(row=row, column=column).value = chord_name
-
-            column += 1
-            if (column - 1) % chords_per_row == 0:
-                column = 1
-                row += 1
-
-            prev_chord = chord
+                column += 1
+                if (column - 1) % chords_per_row == 0:
+                    column = 1
+                    row += 1
 
         workbook.save(filename)
 
-    def to_pdf(self, filename, **kwargs):
+    def to_pdf(self, filename, title: Optional[str] = None, **kwargs):
         """
-        Creates a PDF.
+        Creates a PDF. See ``Song.to_pdf`` for the options.
+        The title at the top of the page is the file name unless another title is given.
 
         .. note::
             This feature requires ``reportlab``, which you can get with ``pip install reportlab``.
         """
-        song = Song([SongSection(filename, self)])
+        song = Song([SongSection(filename if title is None else title, self)])
         return song.to_pdf(filename, **kwargs)
 
-    def to_midi(self, settings: MidiConversionSettings, **kwargs):
+    def to_midi(
+        self, settings: MidiConversionSettings, **kwargs
+    ) -> "TimedChordProgression":
         """
         Saves the chord progression to a MIDI file.
 
+        Returns the progression with the time (in ticks) at which each chord is played.
+
         .. note::
             This feature requires ``mido``, which you can get with ``pip install mido``.
         """
-        if not isinstance(settings, MidiConversionSettings) or kwargs:
-            raise ValueError(
-                "to_midi now takes a MidiConversionSettings object, not individual arguments; see README.md"
+        _check_midi_settings(settings, kwargs)
+        ticks_per_chord = _get_ticks_per_chord(settings, len(self.progression))
+        if settings.cache is not None:
+            settings.cache.render(
+                ("midi", _chords_cache_key(self), _settings_cache_key(settings)),
+                ".mid",
+                settings.filename,
+                lambda: self.to_midi(_without_cache(settings)),
             )
+            return TimedChordProgression.from_durations(self, ticks_per_chord)
 
-        repeat_options = {"replay", "hold"}
-        assert (
-            settings.repeat in repeat_options
-        ), f"repeat argument must be one of: {repeat_options}"
-
-        import mido
-
-        mid = mido.MidiFile()
-        track = mido.MidiTrack()
-        mid.tracks.append(track)
-
-        # Ensure beats_per_chord is a list
-        if isinstance(settings.beats_per_chord, (int, float)):
-            settings.beats_per_chord = [
-                settings.beats_per_chord for _ in range(len(self.progression))
-            ]
-        assert len(settings.beats_per_chord) == len(
-            self.progression
-        ), "len(settings.beats_per_chord) is {}, which is not equal to the number of chords in the progression ({})".format(
-            len(settings.beats_per_chord), len(self.progression)
+        track = _start_midi_track(settings, self)
+        played_chords = _iter_played_chords(
+            self.progression.map_runs(lambda chord: chord.midi()),
+            ticks_per_chord,
+            settings,
         )
+        _save_played_chords(
+            settings,
+            track,
+            played_chords,
+            _get_meta_messages(
+                settings.tempo_changes, settings.time_signatures, ticks_per_chord
+            ),
+        )
+        return TimedChordProgression.from_durations(self, ticks_per_chord)
 
-        seconds_per_chord = [
-            (60 / settings.tempo) * bpc for bpc in settings.beats_per_chord
-        ]
-        ticks_per_chord = [
-            int(
-                mido.second2tick(
-                    spc, mid.ticks_per_beat, mido.bpm2tempo(settings.tempo)
-                )
+
+TimedChord = namedtuple("TimedChord", "chord, onset, duration")
+
+
+class TimedChordProgression(CompositeObject):
+    """
+    A chord progression where each chord is played at a given time (the onset)
+    for a given duration.
+
+    A ``TimedChordProgression`` is returned by ``ChordProgression.to_midi``, with times in ticks,
+    and by ``TimedChordProgression.from_midi_file``, with times in seconds.
+
+    The chords may overlap and there may be gaps between them.
+    They are indexed by time (see ``jchord.timeline.IntervalIndex``), so finding the chord
+    which is playing at a given time takes O(log n) time.
+
+    Parameters:
+    * progression: the chords, in the order of their onsets
+    * onsets: the time at which each chord starts
+    * durations: how long each chord lasts
+    """
+
+    def __init__(
+        self,
+        progression: Iterable[Chord],
+        onsets: Iterable[float],
+        durations: Iterable[float],
+    ):
+        if not isinstance(progression, ChordProgression):
+            progression = ChordProgression(progression)
+        self.progression = progression
+        self.onsets = list(onsets)
+        self.durations = list(durations)
+        if not len(self.progression) == len(self.onsets) == len(self.durations):
+            raise ValueError(
+                f"Got {len(self.progression)} chords, {len(self.onsets)} onsets "
+                f"and {len(self.durations)} durations"
             )
-            for spc in seconds_per_chord
-        ]
+        self._index = IntervalIndex(
+            self.onsets,
+            [onset + duration for onset, duration in zip(self.onsets, self.durations)],
+        )
+
+    @classmethod
+    def from_durations(
+        cls, progression: Iterable[Chord], durations: Iterable[float], start: float = 0
+    ) -> "TimedChordProgression":
+        """
+        Creates a timed progression where the chords are played one after another,
+        with the first chord starting at ``start``.
+        """
+        durations = list(durations)
+        onsets = []
+        for duration in durations:
+            onsets.append(start)
+            start += duration
+        return cls(progression, onsets, durations)
+
+    @classmethod
+    def from_midi_file(
+        cls, filename: str, cache: Union[MidiNoteCache, str, None] = None
+    ) -> "TimedChordProgression":
+        """
+        Reads the chords in a MIDI file, with their onsets and durations in seconds.
+        The duration of a chord lasts until its last note ends.
+        The notes in the file can be cached, see ``read_midi_file``.
+
+        .. note::
+            This feature requires ``mido``, which you can get with ``pip install mido``.
+        """
+        chords = []
+        onsets = []
+        durations = []
+        for notes in group_notes_to_chords(read_midi_file(filename, cache)):
+            onset = min(note.time for note in notes)
+            chords.append(Chord.from_midi([note.note for note in notes]))
+            onsets.append(onset)
+            durations.append(max(note.time + note.duration for note in notes) - onset)
+        return cls(chords, onsets, durations)
+
+    def _keys(self) -> Hashable:
+        return (self.progression, tuple(self.onsets), tuple(self.durations))
+
+    def __len__(self) -> int:
+        return len(self.onsets)
+
+    def __getitem__(self, index: int) -> TimedChord:
+        return TimedChord(
+            self.progression[index], self.onsets[index], self.durations[index]
+        )
+
+    def index_at(self, time: float) -> Optional[int]:
+        """
+        Returns the index of the chord which is playing at the given time, or None if no chord is.
+        If several chords are playing, the one that started last is used.
+        """
+        return self._index.at(time)
+
+    def chord_at(self, time: float) -> Optional[Chord]:
+        """
+        Returns the chord which is playing at the given time, or None if no chord is.
+        If several chords are playing, the one that started last is used.
+        """
+        index = self._index.at(time)
+        return None if index is None else self.progression[index]
+
+    def between(self, start: float, stop: float) -> List[TimedChord]:
+        """
+        Returns the chords which are playing at some time in ``[start, stop)``, in order.
+        """
+        return [self[index] for index in self._index.overlapping(start, stop)]
+
+
+def _chords_cache_key(progression: ChordProgression) -> List[Tuple[str, int]]:
+    """Returns the chords in the progression, in a form that can be used in a cache key."""
+    return list(progression.progression.map_runs(repr))
+
+
+# The settings which affect the contents of the MIDI file. Other attributes, like the file name
+# and what to_midi() stores on the settings while rendering, are not part of the cache key.
+_SETTINGS_CACHE_FIELDS = (
+    "instrument",
+    "tempo",
+    "beats_per_chord",
+    "velocity",
+    "repeat",
+    "effect",
+    "ticks_per_beat",
+    "tempo_changes",
+    "time_signatures",
+    "tracks",
+)
+
+
+def _settings_cache_key(settings: MidiConversionSettings) -> Dict[str, Any]:
+    """Returns the settings which affect the contents of the MIDI file."""
+    return {name: getattr(settings, name) for name in _SETTINGS_CACHE_FIELDS}
+
+
+def _without_cache(settings: MidiConversionSettings) -> MidiConversionSettings:
+    settings = copy(settings)
+    settings.set(cache=None)
+    return settings
+
+
+def _check_midi_settings(settings: MidiConversionSettings, kwargs: dict):
+    if not isinstance(settings, MidiConversionSettings) or kwargs:
+        raise ValueError(
+            "to_midi now takes a MidiConversionSettings object, not individual arguments; see README.md"
+        )
+    if settings.tracks and settings.effect is not None:
+        raise ValueError(
+            "The effect in the settings is not used when there are tracks; "
+            "give each MidiTrackSettings its own effect instead"
+        )
+
+    repeat_options = {"replay", "hold"}
+    assert (
+        settings.repeat in repeat_options
+    ), f"repeat argument must be one of: {repeat_options}"
+
+
+# Number of beats are rounded to fractions with at most this denominator, so e.g. 0.1 or 1/3
+# beat (as a float) is exactly 1/10 or 1/3 beat
+MAX_BEATS_DENOMINATOR = 1 << 16
+
+
+def _exact_beats(beats: Union[int, float, Fraction]) -> Fraction:
+    return Fraction(beats).limit_denominator(MAX_BEATS_DENOMINATOR)
+
+
+def _get_ticks_per_chord(settings: MidiConversionSettings, n_chords: int) -> List[int]:
+    """
+    Returns the number of ticks for each chord.
+    settings.beats_per_chord is left as it is.
+    """
+    beats_per_chord = settings.beats_per_chord
+    if isinstance(beats_per_chord, (int, float, Fraction)):
+        ticks = _exact_beats(beats_per_chord) * settings.ticks_per_beat
+        if ticks.denominator == 1:
+            return [int(ticks)] * n_chords
+        beats_per_chord = [beats_per_chord] * n_chords
+    assert (
+        len(beats_per_chord) == n_chords
+    ), "len(settings.beats_per_chord) is {}, which is not equal to the number of chords in the progression ({})".format(
+        len(beats_per_chord), n_chords
+    )
+    return _beats_to_ticks(beats_per_chord, settings.ticks_per_beat)
+
+
+def _beats_to_ticks(
+    beats_per_chord: List[Union[int, float, Fraction]],
+    ticks_per_beat: int,
+    start_beat: Fraction = 0,
+) -> List[int]:
+    """
+    Returns the number of ticks for each chord, given the number of beats for each chord.
+
+    The start of each chord is the exact sum of the beats before it (starting at start_beat),
+    rounded to the nearest tick, so the chords stay on the grid however long the progression is.
+    The beats are counted in whole units of a common denominator, so the sum only needs
+    integer arithmetic.
+    """
+    start_beat = Fraction(start_beat)
+    exact = {beats: _exact_beats(beats) for beats in set(beats_per_chord)}
+    denominator = start_beat.denominator
+    for beats in exact.values():
+        denominator = (
+            denominator * beats.denominator // gcd(denominator, beats.denominator)
+        )
+    units = {
+        beats: exact_beats.numerator * (denominator // exact_beats.denominator)
+        for beats, exact_beats in exact.items()
+    }
+
+    # Usually, every chord is a whole number of ticks
+    if ticks_per_beat % denominator == 0:
+        ticks_per_unit = ticks_per_beat // denominator
+        ticks = {beats: unit * ticks_per_unit for beats, unit in units.items()}
+        return [ticks[beats] for beats in beats_per_chord]
+
+    ticks_per_chord = []
+    position = start_beat.numerator * (denominator // start_beat.denominator)
+    tick = _round_ratio(position * ticks_per_beat, denominator)
+    for beats in beats_per_chord:
+        position += units[beats]
+        next_tick = _round_ratio(position * ticks_per_beat, denominator)
+        ticks_per_chord.append(next_tick - tick)
+        tick = next_tick
+    return ticks_per_chord
+
+
+def _round_ratio(numerator: int, denominator: int) -> int:
+    """Returns round(numerator / denominator) without going through floats."""
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def _start_midi_track(
+    settings: MidiConversionSettings,
+    progression: ChordProgression,
+    tempo_changes: Optional[dict] = None,
+    time_signatures: Optional[dict] = None,
+):
+    """
+    Returns a track with the messages that come before the first chord.
+    The tempo and time signature for the first chord are taken from tempo_changes and
+    time_signatures (by default, the ones in the settings) if they are there.
+    """
+    import mido
+
+    if tempo_changes is None:
+        tempo_changes = settings.tempo_changes
+    if time_signatures is None:
+        time_signatures = settings.time_signatures
+
+    track = mido.MidiTrack()
+    tempo = tempo_changes.get(0, settings.tempo)
+    track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(tempo)))
+    if 0 in time_signatures:
+        numerator, denominator = time_signatures[0]
         track.append(
-            mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(settings.tempo))
+            mido.MetaMessage(
+                "time_signature", numerator=numerator, denominator=denominator
+            )
         )
-        track.append(mido.Message("program_change", program=settings.instrument))
+    track.append(mido.Message("program_change", program=settings.instrument))
 
-        played_chords = []
-        prev_chord = None
-        time = 0
-
-        for chord, tpc in zip(self.midi(), ticks_per_chord):
-            if chord == prev_chord and settings.repeat == "hold":
-                played_chords[-1] = [
-                    pnote._replace(duration=pnote.duration + tpc)
-                    for pnote in played_chords[-1]
-                ]
-            else:
-                played_chords.append(
-                    [
-                        MidiNote(
-                            note=note,
-                            velocity=settings.velocity,
-                            time=time,
-                            duration=tpc,
-                        )
-                        for note in chord
-                    ]
+    settings.set(progression=progression)
+    settings.set(midi_track=track)
+    return track
+
+
+def _get_meta_messages(
+    tempo_changes: dict, time_signatures: dict, ticks_per_chord: List[int]
+) -> List[tuple]:
+    """
+    Returns (time, message) for the tempo changes and time signatures after the first chord,
+    sorted by time. The time at which each chord starts is computed once, so looking up the
+    time for each change takes constant time.
+    """
+    import mido
+
+    if set(tempo_changes) <= {0} and set(time_signatures) <= {0}:
+        return []
+
+    n_chords = len(ticks_per_chord)
+    chord_starts = [0] * n_chords
+    for index in range(1, n_chords):
+        chord_starts[index] = chord_starts[index - 1] + ticks_per_chord[index - 1]
+
+    def chord_start(index: int) -> int:
+        if not 0 <= index < n_chords:
+            raise ValueError(
+                f"Can't change the tempo or time signature at chord {index}, "
+                f"since there are {n_chords} chords"
+            )
+        return chord_starts[index]
+
+    messages = []
+    for index, tempo in tempo_changes.items():
+        if index != 0:
+            message = mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(tempo))
+            messages.append((chord_start(index), 0, message))
+    for index, (numerator, denominator) in time_signatures.items():
+        if index != 0:
+            message = mido.MetaMessage(
+                "time_signature", numerator=numerator, denominator=denominator
+            )
+            messages.append((chord_start(index), 1, message))
+    messages.sort(key=lambda item: item[:2])
+    return [(time, message) for time, _, message in messages]
+
+
+def _save_played_chords(
+    settings: MidiConversionSettings,
+    track,
+    played_chords: Iterable[List[MidiNote]],
+    meta_messages: List[tuple] = (),
+):
+    if settings.tracks:
+        _save_tracks(settings, track, played_chords, meta_messages)
+        return
+
+    if settings.effect:
+        settings.effect.set_settings(settings)
+        played_notes = settings.effect.stream_chords(played_chords)
+    else:
+        played_notes = (note for chord in played_chords for note in chord)
+
+    messages = iter_notes_to_messages(
+        played_notes, velocity=settings.velocity, meta_messages=meta_messages
+    )
+    save_midi_file(
+        settings.filename,
+        [chain(track, messages)],
+        ticks_per_beat=settings.ticks_per_beat,
+    )
+
+
+def _save_tracks(
+    settings: MidiConversionSettings,
+    track,
+    played_chords: Iterable[List[MidiNote]],
+    meta_messages: List[tuple] = (),
+):
+    """
+    Saves a MIDI file with a track for each of settings.tracks.
+
+    The chords are only grouped once, and all the tracks apply their effects to the same chords.
+    If settings.workers is more than 1, the tracks are rendered in a pool of processes
+    (so effects that use random numbers should have a seed). The effects are then applied
+    to copies in the processes, and each effect is given the state its copy ended in,
+    so the effects end in the same state either way.
+    The tempo and time signatures are only in the first track.
+    """
+    played_chords = list(played_chords)
+    start_messages = [message for message in track if message.is_meta]
+    jobs = [
+        (
+            settings,
+            track_settings,
+            start_messages if index == 0 else [],
+            played_chords,
+            meta_messages if index == 0 else [],
+        )
+        for index, track_settings in enumerate(settings.tracks)
+    ]
+    if settings.workers and settings.workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(min(settings.workers, len(jobs))) as executor:
+            results = list(executor.map(_render_track, *zip(*jobs)))
+    else:
+        results = [_render_track(*job) for job in jobs]
+    for track_settings, (_, state) in zip(settings.tracks, results):
+        if track_settings.effect is not None:
+            track_settings.effect.set_state(state)
+    save_midi_file(
+        settings.filename,
+        [messages for messages, _ in results],
+        ticks_per_beat=settings.ticks_per_beat,
+    )
+
+
+def _render_track(
+    settings: MidiConversionSettings,
+    track_settings: MidiTrackSettings,
+    start_messages: list,
+    played_chords: List[List[MidiNote]],
+    meta_messages: List[tuple],
+) -> Tuple[list, Any]:
+    """
+    Returns the messages for one of the tracks in settings.tracks,
+    and the state of its effect afterwards.
+    """
+    import mido
+
+    settings = copy(settings)
+    settings.set(effect=track_settings.effect, tracks=[])
+    if track_settings.instrument is not None:
+        settings.set(instrument=track_settings.instrument)
+    if track_settings.velocity is not None:
+        settings.set(velocity=track_settings.velocity)
+
+    messages = []
+    if track_settings.name is not None:
+        messages.append(mido.MetaMessage("track_name", name=track_settings.name))
+    messages.extend(start_messages)
+    messages.append(
+        mido.Message(
+            "program_change",
+            program=settings.instrument,
+            channel=track_settings.channel,
+        )
+    )
+
+    if settings.effect:
+        settings.effect.set_settings(settings)
+        played_notes = settings.effect.stream_chords(played_chords)
+    else:
+        played_notes = (note for chord in played_chords for note in chord)
+    note_messages = iter_notes_to_messages(
+        played_notes,
+        velocity=settings.velocity,
+        meta_messages=meta_messages,
+        channel=track_settings.channel,
+    )
+    messages.extend(note_messages)
+    state = settings.effect.get_state() if settings.effect else None
+    return messages, state
+
+
+def _iter_played_chords(
+    midi_runs: Iterable[Tuple[List[int], int]], ticks_per_chord: List[int], settings
+) -> Iterator[List[MidiNote]]:
+    """
+    Yields the list of notes to play for each chord, given (midi, count) for each run of chords.
+    If settings.repeat is "hold", repeated chords are played as one long chord.
+    """
+    return (
+        notes for _, notes in _iter_chord_groups(midi_runs, ticks_per_chord, settings)
+    )
+
+
+def _iter_chord_groups(
+    midi_runs: Iterable[Tuple[List[int], int]],
+    ticks_per_chord: List[int],
+    settings,
+    first_chord: int = 0,
+    start_time: int = 0,
+) -> Iterator[Tuple[int, List[MidiNote]]]:
+    """
+    Like _iter_played_chords, but yields (index, notes) where index is the index of the
+    (first) chord that the notes are played for.
+
+    The runs start at the chord with index first_chord, which is played at start_time.
+    """
+    hold = settings.repeat == "hold"
+    prev_chord = None
+    prev_position = first_chord
+    duration = 0
+    position = first_chord
+    for chord, count in midi_runs:
+        run_ticks = ticks_per_chord[position : position + count]
+        if not hold:
+            for tpc in run_ticks:
+                yield position, _chord_to_notes(
+                    chord, start_time, tpc, settings.velocity
                 )
-            prev_chord = chord
-            time += tpc
+                position += 1
+                start_time += tpc
+            continue
+        if chord == prev_chord:
+            duration += sum(run_ticks)
+            position += count
+            continue
+        if prev_chord is not None:
+            yield prev_position, _chord_to_notes(
+                prev_chord, start_time, duration, settings.velocity
+            )
+        prev_chord = chord
+        prev_position = position
+        start_time += duration
+        duration = sum(run_ticks)
+        position += count
+    if prev_chord is not None:
+        yield prev_position, _chord_to_notes(
+            prev_chord, start_time, duration, settings.velocity
+        )
 
-        settings.set(progression=self)
-        settings.set(played_chords=played_chords)
-        settings.set(midi_track=track)
 
-        if settings.effect:
-            settings.effect.set_settings(settings)
-            played_chords = [settings.effect.apply(chord) for chord in played_chords]
+def _chord_to_notes(
+    chord: List[int], time: int, duration: int, velocity: int
+) -> List[MidiNote]:
+    return [
+        MidiNote(note=note, velocity=velocity, time=time, duration=duration)
+        for note in chord
+    ]
 
-        played_notes = [note for chord in played_chords for note in chord]
-        for message in notes_to_messages(played_notes, velocity=settings.velocity):
-            track.append(message)
-        mid.save(settings.filename)
 
+def _merge_held_chords(
+    chords: Iterable[List[MidiNote]],
+) -> Iterator[List[MidiNote]]:
+    """
+    Merges each chord with the one before it if they have the same notes,
+    like ``_iter_played_chords`` does with settings.repeat == "hold".
+    """
+    pending = None
+    for chord in chords:
+        if pending is not None and [note.note for note in chord] == [
+            note.note for note in pending
+        ]:
+            if chord:
+                duration = pending[0].duration + chord[0].duration
+                pending = [note._replace(duration=duration) for note in pending]
+            continue
+        if pending is not None:
+            yield pending
+        pending = chord
+    if pending is not None:
+        yield pending
+
+
+def _iter_song_chords(
+    sections: List["SongSection"], ticks_per_chord: List[int], settings
+) -> Iterator[List[MidiNote]]:
+    """
+    Yields the list of notes to play for each chord in the sections.
 
-SongSection = namedtuple("SongSection", "name, progression")
-SongSection.__doc__ = """Represents a section in a Song."""
+    Each section is rendered once for each distinct progression object and chord durations,
+    and repeats are copies of that rendering shifted to their position in the song.
+    """
+    rendered = {}
+    position = 0
+    offset = 0
+    for section in sections:
+        progression = section.progression
+        section_ticks = ticks_per_chord[position : position + len(progression)]
+        position += len(progression)
+
+        key = (id(progression), tuple(section_ticks))
+        try:
+            chords, _ = rendered[key]
+        except KeyError:
+            chords = list(
+                _iter_played_chords(
+                    progression.progression.map_runs(lambda chord: chord.midi()),
+                    section_ticks,
+                    settings,
+                )
+            )
+            # The progression is kept along with the rendering so its id can't be reused
+            rendered[key] = (chords, progression)
+
+        for chord in chords:
+            yield [note._replace(time=note.time + offset) for note in chord]
+        offset += sum(section_ticks)
+
+
+def _section_name(index: int) -> str:
+    """Returns "A", "B", ..., "Z", "AA", "AB" and so on for index 0, 1, 2 and so on."""
+    name = ""
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        name = chr(ord("A") + letter) + name
+    return name
+
+
+SongSection = namedtuple(
+    "SongSection", "name, progression, tempo, time_signature", defaults=(None, None)
+)
+SongSection.__doc__ = """
+Represents a section in a Song.
+The tempo and time signature (numerator, denominator) are optional, and apply from the start of
+the section until they are changed.
+"""
 
 
 class Song(CompositeObject):
@@ -381,6 +1750,47 @@ class Song(CompositeObject):
     def _keys(self):
         return (self.sections,)
 
+    @classmethod
+    def from_progression(
+        cls,
+        progression: ChordProgression,
+        min_length: int = 4,
+        max_length: Optional[int] = None,
+    ) -> "Song":
+        """
+        Splits the progression into sections, such that repeated parts of the progression
+        become repeats of the same section. The sections are named "A", "B", "C" and so on,
+        and they share the chords with the progression instead of copying them.
+
+        See ``jchord.find_sections.find_sections`` for the meaning of the parameters.
+
+        >>> progression = ChordProgression.from_string("C F G7 C " * 3 + "Am Dm G7 C")
+        >>> print(Song.from_progression(progression).to_string())
+        A (x3)
+        ======
+        C   F   G7  C
+        <BLANKLINE>
+        B
+        =
+        Am  Dm  G7  C
+        <BLANKLINE>
+        """
+        sequence = progression.progression
+        if not isinstance(sequence, ChordSequence):
+            sequence = ChordSequence(sequence)
+
+        sections = []
+        section_objects = {}
+        for start, length, section in find_sections(
+            sequence._codes, min_length=min_length, max_length=max_length
+        ):
+            if section not in section_objects:
+                section_objects[section] = SongSection(
+                    _section_name(section), progression[start : start + length]
+                )
+            sections.append(section_objects[section])
+        return cls(sections)
+
     def to_string(
         self, chords_per_row: int = 4, column_spacing: int = 2, newline: str = "\n"
     ):
@@ -418,6 +1828,89 @@ class Song(CompositeObject):
         combined = newline.join(line.strip() for line in combined.split(newline))
         return combined
 
+    def to_midi(
+        self, settings: MidiConversionSettings, **kwargs
+    ) -> TimedChordProgression:
+        """
+        Saves the song to a MIDI file, with the sections played one after another.
+        The result is the same as for the progression of all the sections concatenated.
+
+        Returns the progression with the time (in ticks) at which each chord is played.
+
+        Each section is only rendered once if its progression is repeated (as the same object)
+        with the same chord durations; later repeats are copies shifted in time.
+
+        The tempo and time signature of each section are used from the start of the section.
+        Changes in settings.tempo_changes and settings.time_signatures, where the chord index
+        counts from the start of the song, take precedence over those.
+
+        .. note::
+            This feature requires ``mido``, which you can get with ``pip install mido``.
+        """
+        _check_midi_settings(settings, kwargs)
+        progression = ChordProgression.concat(
+            *(section.progression for section in self.sections)
+        )
+        tempo_changes, time_signatures = self._get_tempo_changes(settings)
+        ticks_per_chord = _get_ticks_per_chord(settings, len(progression))
+        if settings.cache is not None:
+            settings.cache.render(
+                (
+                    "song midi",
+                    [
+                        (
+                            _chords_cache_key(section.progression),
+                            section.tempo,
+                            section.time_signature,
+                        )
+                        for section in self.sections
+                    ],
+                    _settings_cache_key(settings),
+                ),
+                ".mid",
+                settings.filename,
+                lambda: self.to_midi(_without_cache(settings)),
+            )
+            return TimedChordProgression.from_durations(progression, ticks_per_chord)
+
+        track = _start_midi_track(settings, progression, tempo_changes, time_signatures)
+        played_chords = _iter_song_chords(self.sections, ticks_per_chord, settings)
+        if settings.repeat == "hold":
+            played_chords = _merge_held_chords(played_chords)
+        _save_played_chords(
+            settings,
+            track,
+            played_chords,
+            _get_meta_messages(tempo_changes, time_signatures, ticks_per_chord),
+        )
+        return TimedChordProgression.from_durations(progression, ticks_per_chord)
+
+    def _get_tempo_changes(
+        self, settings: MidiConversionSettings
+    ) -> Tuple[Dict[int, float], Dict[int, Tuple[int, int]]]:
+        """
+        Returns the tempo changes and time signatures for the song, keyed by chord index.
+        """
+        tempo_changes = {}
+        time_signatures = {}
+        tempo = None
+        time_signature = None
+        position = 0
+        for section in self.sections:
+            if not len(section.progression):
+                continue
+            if section.tempo is not None and section.tempo != tempo:
+                tempo = tempo_changes[position] = section.tempo
+            if (
+                section.time_signature is not None
+                and section.time_signature != time_signature
+            ):
+                time_signature = time_signatures[position] = section.time_signature
+            position += len(section.progression)
+        tempo_changes.update(settings.tempo_changes)
+        time_signatures.update(settings.time_signatures)
+        return tempo_changes, time_signatures
+
     def to_pdf(
         self,
         filename,
@@ -430,13 +1923,41 @@ class Song(CompositeObject):
         spacing_factor_w=1.0,
         spacing_factor_h=1.0,
         spacing_min_h=75,
+        cache: Optional[RenderCache] = None,
     ):
         """
         Creates a PDF.
+        If a ``RenderCache`` is given, the file is copied from it if it has been made before.
 
         .. note::
             This feature requires ``reportlab``, which you can get with ``pip install reportlab``.
         """
+        if cache is not None:
+            options = dict(
+                font=font,
+                fontsize=fontsize,
+                chords_per_row=chords_per_row,
+                margin_factor_w=margin_factor_w,
+                margin_factor_h=margin_factor_h,
+                spacing_factor_w=spacing_factor_w,
+                spacing_factor_h=spacing_factor_h,
+                spacing_min_h=spacing_min_h,
+            )
+            cache.render(
+                (
+                    "pdf",
+                    [
+                        (section.name, _chords_cache_key(section.progression))
+                        for section in self.sections
+                    ],
+                    options,
+                ),
+                ".pdf",
+                filename,
+                lambda: self.to_pdf(filename, **options),
+            )
+            return
+
         from reportlab.pdfgen.canvas import Canvas
 
         fontsize = float(fontsize)
@@ -465,29 +1986,30 @@ class Song(CompositeObject):
         column = 0
         row = 0
         prev_chord = None
-        for name, progression in self.sections:
+        for section in self.sections:
+            progression = section.progression
             column += 1
             canvas.drawString(
                 spacing_w * (row + margin_factor_w),
                 HEIGHT - spacing_h * (column + margin_factor_h),
-                name,
+                section.name,
             )
             column += 1
 
-            for chord in progression.progression:
-                if prev_chord == chord:
-                    chord_name = REPETITION_SYMBOL
-                else:
-                    chord_name = chord.name
-                canvas.drawString(
-                    spacing_w * (row + margin_factor_w),
-                    HEIGHT - spacing_h * (column + margin_factor_h),
-                    chord_name,
-                )
-                row += 1
-                if row % chords_per_row == 0:
-                    row = 0
-                    column += 1
-                prev_chord = chord
+            for chord_name, count in _iter_cell_runs(
+                progression.progression.runs(), prev_chord
+            ):
+                for _ in range(count):
+                    canvas.drawString(
+                        spacing_w * (row + margin_factor_w),
+                        HEIGHT - spacing_h * (column + margin_factor_h),
+                        chord_name,
+                    )
+                    row += 1
+                    if row % chords_per_row == 0:
+                        row = 0
+                        column += 1
+            if len(progression.progression):
+                prev_chord = progression.progression[-1]
 
         canvas.save()
@@ -0,0 +1,309 @@
+"""
+Rendering a chord progression to MIDI again after a few chords have been edited.
+"""
+from bisect import bisect_right
+from fractions import Fraction
+from itertools import accumulate
+import struct
+from typing import Iterator, List, Optional, Tuple
+
+from jchord.chords import Chord
+from jchord.midi import MidiNote, encode_notes, join_encoded_notes
+from jchord.midi_effects import _is_streaming
+from jchord.progressions import (
+    ChordProgression,
+    ChordSequence,
+    ChordSequenceView,
+    MidiConversionSettings,
+    _beats_to_ticks,
+    _check_midi_settings,
+    _exact_beats,
+    _get_ticks_per_chord,
+    _iter_chord_groups,
+    _start_midi_track,
+)
+
+# Delta time and message for the end of a MIDI track
+END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+
+class MidiRenderSession(object):
+    """
+    Renders a chord progression to MIDI, and keeps what is needed to update the result quickly
+    when some of the chords are edited.
+
+    For each chord (or each held chord, with ``repeat="hold"``), the session keeps the notes,
+    the output of the effect and the state of the effect before the chord.
+    After an edit, chords are rendered from the edited chord until the notes and the state
+    of the effect are the same as before, and the rest is reused.
+    The MIDI data is kept in parts which are split wherever no notes are playing,
+    and only the parts with changed notes are encoded again.
+
+    Replacing a chord with one of the same length usually only renders that chord again.
+    Inserting or deleting a chord, or changing its length, moves the following chords in time,
+    so all of them are rendered again.
+
+    The result is the same as ``to_midi`` for the edited progression, provided that effects which
+    carry state from one chord to the next implement ``get_state()`` and ``set_state()``.
+    Effects which work on the whole stream of notes (like ``Legato``) are applied to all the notes.
+    Tempo changes and time signatures are only supported for the first chord,
+    and there can only be one track.
+
+    .. note::
+        This feature requires ``mido``, which you can get with ``pip install mido``.
+    """
+
+    def __init__(self, progression: ChordProgression, settings: MidiConversionSettings):
+        _check_midi_settings(settings, {})
+        if set(settings.tempo_changes) - {0} or set(settings.time_signatures) - {0}:
+            raise ValueError(
+                "MidiRenderSession only supports tempo changes and time signatures "
+                "for the first chord"
+            )
+        if settings.tracks:
+            raise ValueError("MidiRenderSession only supports a single track")
+        self.settings = settings
+        self.chords = ChordSequence(progression.progression)
+        self._ticks = _get_ticks_per_chord(settings, len(self.chords))
+        self._beats = settings.beats_per_chord
+        if isinstance(self._beats, (int, float, Fraction)):
+            self._beats = [self._beats] * len(self.chords)
+        self._beats = list(self._beats)
+        self._starts = [0]
+        self._starts.extend(accumulate(self._ticks))
+        self._midi = {}
+
+        track = _start_midi_track(settings, ChordProgression(self.chords))
+        self._track_start = b"".join(b"\x00" + bytes(msg.bytes()) for msg in track)
+        self._status = None if track[-1].is_meta else track[-1].bytes()[0]
+
+        self._effect = settings.effect
+        if self._effect:
+            self._effect.set_settings(settings)
+        self._initial_state = self._get_state()
+
+        # For each group of chords which are played as one
+        self._group_chords: List[int] = []
+        self._played: List[List[MidiNote]] = []
+        self._outputs: List[List[MidiNote]] = []
+        self._bounds: List[Tuple[float, float]] = []
+        # The state of the effect before each group, and after the last one
+        self._states = [self._initial_state]
+
+        self._encoded = {}
+        self._render(0, 0, 0)
+
+    def __len__(self) -> int:
+        return len(self.chords)
+
+    def __getitem__(self, index: int) -> Chord:
+        return self.chords[index]
+
+    def __setitem__(self, index: int, chord: Chord):
+        """Replaces the chord at the given index."""
+        index = range(len(self.chords))[index]
+        self.chords[index] = chord
+        self._render(index, 1, 0)
+
+    def __delitem__(self, index: int):
+        """Deletes the chord at the given index."""
+        index = range(len(self.chords))[index]
+        del self.chords[index]
+        del self._beats[index]
+        self._update_ticks(index)
+        self._render(index, 0, -1)
+
+    def insert(self, index: int, chord: Chord, beats: Optional[float] = None):
+        """
+        Inserts a chord before the given index.
+        By default, it lasts as many beats as the chord before it (or after it, at the start).
+        """
+        index = range(len(self.chords) + 1)[index]
+        if beats is None:
+            beats = self._beats[max(index - 1, 0)] if self._beats else 1
+        self.chords.insert(index, chord)
+        self._beats.insert(index, beats)
+        self._update_ticks(index)
+        self._render(index, 1, 1)
+
+    def append(self, chord: Chord, beats: Optional[float] = None):
+        """Adds a chord at the end."""
+        self.insert(len(self.chords), chord, beats)
+
+    @property
+    def beats_per_chord(self) -> List[float]:
+        """The number of beats for each chord."""
+        return list(self._beats)
+
+    def set_beats(self, index: int, beats: float):
+        """Sets the number of beats for the chord at the given index."""
+        index = range(len(self.chords))[index]
+        self._beats[index] = beats
+        self._update_ticks(index)
+        self._render(index, 1, 0)
+
+    def to_bytes(self) -> bytes:
+        """Returns the contents of the MIDI file."""
+        velocity = self.settings.velocity
+        if self._effect and _is_streaming(self._effect):
+            self._effect.set_state(self._initial_state)
+            notes = self._effect.stream_chords(self._played)
+            parts = [encode_notes(notes, velocity)]
+        else:
+            encoded = {}
+            parts = []
+            for first, last in self._iter_parts():
+                key = tuple(id(self._outputs[group]) for group in range(first, last))
+                try:
+                    part, outputs = self._encoded[key]
+                except KeyError:
+                    outputs = self._outputs[first:last]
+                    part = encode_notes(_merge_outputs(outputs), velocity)
+                # The outputs are kept along with the part so their ids can't be reused
+                encoded[key] = (part, outputs)
+                parts.append(part)
+            self._encoded = encoded
+
+        data = b"".join(
+            [self._track_start, join_encoded_notes(parts, self._status), END_OF_TRACK]
+        )
+        return b"".join(
+            [
+                b"MThd",
+                struct.pack(">Lhhh", 6, 1, 1, self.settings.ticks_per_beat),
+                b"MTrk",
+                struct.pack(">L", len(data)),
+                data,
+            ]
+        )
+
+    def save(self, filename: Optional[str] = None):
+        """Saves the MIDI file, by default to settings.filename."""
+        with open(filename or self.settings.filename, "wb") as file:
+            file.write(self.to_bytes())
+
+    def _get_state(self):
+        return self._effect.get_state() if self._effect else None
+
+    def _chord_midi(self, chord: Chord) -> List[int]:
+        try:
+            _, midi = self._midi[id(chord)]
+        except KeyError:
+            midi = chord.midi()
+            # The chord is kept along with the result so its id can't be reused
+            self._midi[id(chord)] = (chord, midi)
+        return midi
+
+    def _update_ticks(self, index: int):
+        """Updates the ticks for the chords from the given index, after the beats have changed."""
+        start_beat = sum(map(_exact_beats, self._beats[:index]), Fraction(0))
+        self._ticks[index:] = _beats_to_ticks(
+            self._beats[index:], self.settings.ticks_per_beat, start_beat
+        )
+        start = self._starts[index]
+        self._starts[index + 1 :] = [
+            start + ticks for ticks in accumulate(self._ticks[index:])
+        ]
+
+    def _render(self, index: int, n_edited: int, shift: int):
+        """
+        Renders the groups again after an edit.
+
+        Parameters:
+        * index: the index of the first edited chord
+        * n_edited: the number of chords starting at index which are new or changed
+        * shift: the number of chords which have been inserted (or deleted, if negative) at index
+        """
+        # Held chords may be merged with the chord before the edit, so start from there
+        first_edited = index - 1 if self.settings.repeat == "hold" else index
+        group = max(bisect_right(self._group_chords, first_edited) - 1, 0)
+        first_chord = self._group_chords[group] if self._group_chords else 0
+        if self._effect:
+            self._effect.set_state(self._states[group])
+
+        group_chords = []
+        played = []
+        outputs = []
+        bounds = []
+        states = []
+        tail = None
+        runs = ChordSequenceView(self.chords)[first_chord:].map_runs(self._chord_midi)
+        for chord_index, notes in _iter_chord_groups(
+            runs, self._ticks, self.settings, first_chord, self._starts[first_chord]
+        ):
+            state = self._get_state()
+            if chord_index >= index + n_edited:
+                tail = self._find_group(chord_index - shift)
+                if (
+                    tail is not None
+                    and self._played[tail] == notes
+                    and self._states[tail] == state
+                ):
+                    break
+                tail = None
+            output = self._apply_effect(notes)
+            group_chords.append(chord_index)
+            played.append(notes)
+            outputs.append(output)
+            bounds.append(_note_bounds(output))
+            states.append(state)
+
+        if tail is None:
+            tail = len(self._group_chords)
+            states.append(self._get_state())
+        tail_chords = self._group_chords[tail:]
+        if shift:
+            tail_chords = [chord_index + shift for chord_index in tail_chords]
+        self._group_chords[group:] = group_chords + tail_chords
+        self._played[group:] = played + self._played[tail:]
+        self._outputs[group:] = outputs + self._outputs[tail:]
+        self._bounds[group:] = bounds + self._bounds[tail:]
+        self._states[group:] = states + self._states[tail:]
+
+    def _find_group(self, chord_index: int) -> Optional[int]:
+        group = bisect_right(self._group_chords, chord_index) - 1
+        if group >= 0 and self._group_chords[group] == chord_index:
+            return group
+        return None
+
+    def _apply_effect(self, notes: List[MidiNote]) -> List[MidiNote]:
+        if not self._effect or _is_streaming(self._effect):
+            return notes
+        return list(self._effect.iter_apply(notes))
+
+    def _iter_parts(self) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (first, last) for each range of groups which can be encoded separately,
+        i.e. where all notes in earlier groups end before any note in later groups starts.
+        """
+        n_groups = len(self._outputs)
+        if not n_groups:
+            return
+        ends = list(accumulate((end for _, end in self._bounds), max))
+        starts = list(accumulate((start for start, _ in reversed(self._bounds)), min))
+        starts.reverse()
+        first = 0
+        for group in range(1, n_groups):
+            if ends[group - 1] <= starts[group]:
+                yield first, group
+                first = group
+        yield first, n_groups
+
+
+def _note_bounds(notes: List[MidiNote]) -> Tuple[float, float]:
+    if not notes:
+        return float("inf"), float("-inf")
+    return (
+        min(note.time for note in notes),
+        max(note.time + note.duration for note in notes),
+    )
+
+
+def _merge_outputs(outputs: List[List[MidiNote]]) -> List[MidiNote]:
+    """Merges the outputs from the effect in the same order as MidiEffect.stream_chords()."""
+    keyed = sorted(
+        (note.time, group, index, note)
+        for group, notes in enumerate(outputs)
+        for index, note in enumerate(notes)
+    )
+    return [note for _, _, _, note in keyed]
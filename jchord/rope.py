@@ -0,0 +1,216 @@
+"""
+A persistent sequence stored as a balanced tree, where editing makes a new tree which shares
+most of its nodes with the old one.
+
+A tree is either a leaf, which is a tuple of items, or a ``RopeNode`` with two subtrees.
+The trees are kept balanced like AVL trees, so the height of a tree of n items is O(log n).
+None of the functions modify a tree; they return new trees instead.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple, Union
+
+# The number of items in each leaf when building a tree
+LEAF_SIZE = 32
+
+# Leaves which get longer than this are split in two
+MAX_LEAF_SIZE = 2 * LEAF_SIZE
+
+
+class RopeNode(object):
+    """
+    A node with two subtrees, neither of which is empty.
+    """
+
+    __slots__ = ("left", "right", "length", "height")
+
+    def __init__(self, left: "Rope", right: "Rope"):
+        self.left = left
+        self.right = right
+        self.length = len(left) + len(right)
+        self.height = 1 + max(height(left), height(right))
+
+    def __len__(self) -> int:
+        return self.length
+
+
+Rope = Union[RopeNode, tuple]
+
+
+def height(tree: Rope) -> int:
+    """Returns the height of the tree, which is 0 for a leaf."""
+    return tree.height if isinstance(tree, RopeNode) else 0
+
+
+def build(items: Iterable[Any]) -> Rope:
+    """Returns a balanced tree with the given items."""
+    items = tuple(items)
+    leaves = [items[i : i + LEAF_SIZE] for i in range(0, len(items), LEAF_SIZE)]
+    if not leaves:
+        return ()
+
+    def build_range(first: int, last: int) -> Rope:
+        if last - first == 1:
+            return leaves[first]
+        middle = (first + last) // 2
+        return RopeNode(build_range(first, middle), build_range(middle, last))
+
+    return build_range(0, len(leaves))
+
+
+def iter_leaves(tree: Rope) -> Iterator[tuple]:
+    """Yields the leaves of the tree from left to right."""
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if isinstance(tree, RopeNode):
+            stack.append(tree.right)
+            stack.append(tree.left)
+        elif tree:
+            yield tree
+
+
+def get(tree: Rope, index: int) -> Any:
+    """Returns the item at the given index, which must be in range."""
+    while isinstance(tree, RopeNode):
+        n_left = len(tree.left)
+        if index < n_left:
+            tree = tree.left
+        else:
+            tree = tree.right
+            index -= n_left
+    return tree[index]
+
+
+def _make(left: Rope, right: Rope) -> Rope:
+    """Returns a node with the given subtrees, whose heights must differ by at most 1."""
+    if not left:
+        return right
+    if not right:
+        return left
+    if (
+        not isinstance(left, RopeNode)
+        and not isinstance(right, RopeNode)
+        and len(left) + len(right) <= LEAF_SIZE
+    ):
+        return left + right
+    return RopeNode(left, right)
+
+
+def _balance(left: Rope, right: Rope) -> Rope:
+    """Returns a node with the given subtrees, whose heights must differ by at most 2."""
+    left_height = height(left)
+    right_height = height(right)
+    if left_height > right_height + 1:
+        if height(left.left) >= height(left.right):
+            return _make(left.left, _make(left.right, right))
+        inner = left.right
+        return _make(_make(left.left, inner.left), _make(inner.right, right))
+    if right_height > left_height + 1:
+        if height(right.right) >= height(right.left):
+            return _make(_make(left, right.left), right.right)
+        inner = right.left
+        return _make(_make(left, inner.left), _make(inner.right, right.right))
+    return _make(left, right)
+
+
+def join(left: Rope, right: Rope) -> Rope:
+    """
+    Returns a tree with the items in ``left`` followed by the items in ``right``.
+    This takes time proportional to the difference in height between the trees.
+    """
+    if not left:
+        return right
+    if not right:
+        return left
+    left_height = height(left)
+    right_height = height(right)
+    if left_height > right_height + 1:
+        return _balance(left.left, join(left.right, right))
+    if right_height > left_height + 1:
+        return _balance(join(left, right.left), right.right)
+    return _make(left, right)
+
+
+def split(tree: Rope, index: int) -> Tuple[Rope, Rope]:
+    """Returns a tree with the items before the given index and one with the rest."""
+    if not isinstance(tree, RopeNode):
+        return tree[:index], tree[index:]
+    n_left = len(tree.left)
+    if index == n_left:
+        return tree.left, tree.right
+    if index < n_left:
+        left, right = split(tree.left, index)
+        return left, join(right, tree.right)
+    left, right = split(tree.right, index - n_left)
+    return join(tree.left, left), right
+
+
+def replace(tree: Rope, index: int, item: Any) -> Rope:
+    """Returns a tree where the item at the given index, which must be in range, is replaced."""
+    if not isinstance(tree, RopeNode):
+        return tree[:index] + (item,) + tree[index + 1 :]
+    n_left = len(tree.left)
+    if index < n_left:
+        return RopeNode(replace(tree.left, index, item), tree.right)
+    return RopeNode(tree.left, replace(tree.right, index - n_left, item))
+
+
+def insert(tree: Rope, index: int, item: Any) -> Rope:
+    """Returns a tree where the item is inserted before the given index."""
+    if not isinstance(tree, RopeNode):
+        leaf = tree[:index] + (item,) + tree[index:]
+        if len(leaf) > MAX_LEAF_SIZE:
+            middle = len(leaf) // 2
+            return RopeNode(leaf[:middle], leaf[middle:])
+        return leaf
+    n_left = len(tree.left)
+    if index <= n_left:
+        return _balance(insert(tree.left, index, item), tree.right)
+    return _balance(tree.left, insert(tree.right, index - n_left, item))
+
+
+def delete(tree: Rope, index: int) -> Rope:
+    """Returns a tree where the item at the given index, which must be in range, is removed."""
+    if not isinstance(tree, RopeNode):
+        return tree[:index] + tree[index + 1 :]
+    n_left = len(tree.left)
+    if index < n_left:
+        return _balance(delete(tree.left, index), tree.right)
+    return _balance(tree.left, delete(tree.right, index - n_left))
+
+
+def repeat(tree: Rope, times: int) -> Rope:
+    """
+    Returns a tree with the items repeated the given number of times.
+    The copies are the same subtrees, so this takes O(log(times)) joins.
+    """
+    result = ()
+    while times > 0:
+        if times & 1:
+            result = join(result, tree)
+        tree = join(tree, tree)
+        times >>= 1
+    return result
+
+
+def map_leaves(tree: Rope, func: Callable[[tuple], tuple]) -> Rope:
+    """
+    Returns a tree with the same shape where each leaf is replaced by ``func(leaf)``,
+    which must have the same length.
+    Subtrees which occur more than once in the tree (e.g. after ``repeat``) are only mapped once.
+    """
+    results: Dict[int, Tuple[Rope, Rope]] = {}
+
+    def map_tree(tree: Rope) -> Rope:
+        try:
+            return results[id(tree)][1]
+        except KeyError:
+            pass
+        if isinstance(tree, RopeNode):
+            result = RopeNode(map_tree(tree.left), map_tree(tree.right))
+        else:
+            result = func(tree)
+        # The tree is kept along with the result so its id can't be reused
+        results[id(tree)] = (tree, result)
+        return result
+
+    return map_tree(tree)
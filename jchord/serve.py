@@ -0,0 +1,476 @@
+"""
+A server which runs the converter script for clients, so the imports and caches
+stay warm between conversions.
+
+Start it with ``jchord serve``, and use it with ``jchord --server ADDRESS ...``,
+which takes the same arguments as ``jchord`` and forwards them to the server.
+
+Since the server reads and writes files for its clients, each request must carry a token
+which the server writes to a file that only its user can read (see token_path()).
+"""
+from argparse import ArgumentParser
+import base64
+import errno
+import hmac
+from concurrent.futures import ProcessPoolExecutor
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import json
+import os
+import secrets
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import traceback
+from typing import List, Optional, Tuple, Union
+
+from jchord.convert import STDIO, make_parser
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+# Where the tokens for servers on localhost are kept, by host and port
+TOKEN_DIRECTORY = os.path.join("~", ".jchord")
+
+# Optional dependencies which are imported when the workers start
+WARM_IMPORTS = ("mido", "openpyxl", "reportlab.pdfgen.canvas")
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """
+    Returns ``(host, port)`` for an address like ``localhost:8765``,
+    and the path for the address of a Unix socket.
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host.strip("[]"), int(port)
+    return address
+
+
+def token_path(address: Union[str, Tuple[str, int]]) -> str:
+    """
+    Returns the file with the token for the server at the given address:
+    next to the socket for a Unix socket, and in ~/.jchord for localhost.
+    """
+    if isinstance(address, str):
+        address = parse_address(address)
+    if isinstance(address, tuple):
+        # A server on "localhost" listens on 127.0.0.1
+        host = "127.0.0.1" if address[0] == "localhost" else address[0]
+        name = f"serve-{host.replace(':', '_')}-{address[1]}.token"
+        return os.path.expanduser(os.path.join(TOKEN_DIRECTORY, name))
+    return address + ".token"
+
+
+def _write_token(filename: str) -> str:
+    """Writes a new token to a file which only the current user can read, and returns it."""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    token = secrets.token_urlsafe(32)
+    # Remove a file left behind by an earlier server, and never write through a symlink
+    # which someone else may have put there
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0)
+    fd = os.open(filename, flags, 0o600)
+    with os.fdopen(fd, "w") as file:
+        file.write(token)
+    return token
+
+
+def _warm_up():
+    """Imports the optional dependencies, so the first request which needs them isn't slow."""
+    import importlib
+
+    for module in WARM_IMPORTS:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def _run(args: List[str], cwd: str, stdin: bytes) -> Tuple[int, bytes, bytes]:
+    """
+    Runs the converter script with the given arguments in the given directory,
+    and returns the exit code and what was written to standard output and standard error.
+    """
+    from jchord.convert import main
+
+    stdin = io.TextIOWrapper(io.BytesIO(stdin))
+    stdout = io.TextIOWrapper(io.BytesIO(), write_through=True)
+    stderr = io.TextIOWrapper(io.BytesIO(), write_through=True)
+    saved = sys.argv, sys.stdin, sys.stdout, sys.stderr, os.getcwd()
+    # argparse names the program after sys.argv[0]
+    sys.argv = ["jchord"] + args
+    sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+    try:
+        os.chdir(cwd)
+        code = main(args)
+    except SystemExit as exit:
+        # From argparse, e.g. for --help or invalid arguments
+        code = exit.code if isinstance(exit.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.argv, sys.stdin, sys.stdout, sys.stderr, cwd = saved
+        os.chdir(cwd)
+    stdout.flush()
+    stderr.flush()
+    return code or 0, stdout.buffer.getvalue(), stderr.buffer.getvalue()
+
+
+class ConvertRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles ``POST /run`` with a JSON object with the arguments for the converter script
+    (``args``), the directory to run it in (``cwd``) and the base64-encoded standard input
+    (``stdin``). The response has the exit code (``code``) and the base64-encoded standard
+    output and standard error (``stdout`` and ``stderr``).
+
+    The request must have the Content-Type ``application/json`` and the header
+    ``Authorization: Bearer TOKEN`` with the server's token, and no Origin header,
+    so web pages can't make requests to the server.
+
+    ``GET /status`` returns ``{"status": "ok"}``.
+    """
+
+    server_version = "jchord"
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_error(404)
+            return
+        self._send_json({"status": "ok"})
+
+    def do_POST(self):
+        if self.path != "/run":
+            self.send_error(404)
+            return
+        if self.headers.get("Origin") is not None:
+            self._reject(403, "Requests from web pages are not allowed")
+            return
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            self._reject(415, "Expected Content-Type: application/json")
+            return
+        if not hmac.compare_digest(
+            self.headers.get("Authorization", "").encode("utf-8"),
+            f"Bearer {self.server.token}".encode("utf-8"),
+        ):
+            self._reject(403, "Missing or wrong token")
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            args = [str(arg) for arg in request["args"]]
+            cwd = str(request["cwd"])
+            stdin = base64.b64decode(request.get("stdin") or "")
+        except (KeyError, TypeError, ValueError):
+            self.send_error(400, "Expected a JSON object with args and cwd")
+            return
+        if self.server.cache and not any(
+            arg == "--cache" or arg.startswith("--cache=") for arg in args
+        ):
+            args += ["--cache", self.server.cache]
+        # Wait for a free worker, so requests don't pile up in the pool
+        with self.server.slots:
+            try:
+                code, stdout, stderr = self.server.executor.submit(
+                    _run, args, cwd, stdin
+                ).result()
+            except Exception as error:
+                self.send_error(500, f"The conversion failed: {error}")
+                return
+        self._send_json(
+            {
+                "code": code,
+                "stdout": base64.b64encode(stdout).decode("ascii"),
+                "stderr": base64.b64encode(stderr).decode("ascii"),
+            }
+        )
+
+    def _reject(self, code: int, message: str):
+        """Skips the body of the request and sends an error."""
+        try:
+            remaining = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            remaining = 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1 << 16))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        self.send_error(code, message)
+
+    def _send_json(self, value: dict):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _ServerMixin(object):
+    daemon_threads = True
+
+    def start_workers(self, workers: int, verbose: bool, cache: Optional[str]):
+        self.verbose = verbose
+        self.cache = cache and os.path.abspath(cache)
+        self.slots = threading.BoundedSemaphore(workers)
+        self.executor = ProcessPoolExecutor(workers, initializer=_warm_up)
+        # Start all the workers now rather than on the first requests
+        for future in [self.executor.submit(_warm_up) for _ in range(workers)]:
+            future.result()
+        self.token_file = token_path(self.server_address)
+        self.token = _write_token(self.token_file)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+        if os.path.exists(self.token_file):
+            os.remove(self.token_file)
+
+
+class ConvertServer(_ServerMixin, socketserver.ThreadingMixIn, HTTPServer):
+    """The server for localhost, which handles each request in a thread."""
+
+    def __init__(self, address: Tuple[str, int]):
+        if address[0] == "::1":
+            self.address_family = socket.AF_INET6
+        super().__init__(address, ConvertRequestHandler)
+
+
+class UnixConvertServer(
+    _ServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    """The server for a Unix socket, which handles each request in a thread."""
+
+    def __init__(self, path: str):
+        super().__init__(path, ConvertRequestHandler)
+
+    def server_bind(self):
+        # Only the current user can connect to the socket
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_server(
+    address: str = DEFAULT_ADDRESS,
+    workers: int = 2,
+    verbose: bool = False,
+    cache: Optional[str] = None,
+) -> Union[ConvertServer, UnixConvertServer]:
+    """
+    Returns a server at the given address (see parse_address()), with a pool of worker processes
+    which run at most ``workers`` conversions at a time. Call ``serve_forever()`` to start it.
+
+    The workers keep the caches they use (see ``jchord.convert.get_caches``) between requests.
+    If a cache directory is given, it is used for the requests which don't give one.
+
+    The server can only listen on localhost, since it reads and writes files for its clients.
+    The token for the requests is written to token_path(), and deleted by ``server_close()``.
+    """
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        if parsed[0] not in LOCAL_HOSTS:
+            raise ValueError(
+                f"The server can only listen on localhost, not {parsed[0]}"
+            )
+        server = ConvertServer(parsed)
+    else:
+        _remove_stale_socket(parsed)
+        server = UnixConvertServer(parsed)
+    try:
+        server.start_workers(workers, verbose, cache)
+    except BaseException:
+        server.socket.close()
+        raise
+    return server
+
+
+def _remove_stale_socket(path: str):
+    """
+    Removes the socket at the given path if no server is listening on it.
+    Raises OSError if there is something else at the path, or a server which is still running.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        # Left behind by a server which didn't shut down cleanly
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, f"There is already a server at {path}")
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float]):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def _connect(address: str, timeout: Optional[float] = None) -> HTTPConnection:
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        return HTTPConnection(*parsed, timeout=timeout)
+    return _UnixHTTPConnection(parsed, timeout)
+
+
+class _InvalidArguments(Exception):
+    pass
+
+
+def _reads_stdin(args: List[str]) -> bool:
+    """
+    Returns whether the converter script reads standard input with the given arguments,
+    i.e. whether the input file is "-". Invalid arguments are left for the server to report.
+    """
+    parser = make_parser(add_help=False)
+
+    def error(message):
+        raise _InvalidArguments(message)
+
+    parser.error = error
+    try:
+        return parser.parse_args(args).file_in == STDIO
+    except _InvalidArguments:
+        return False
+
+
+def run_client(address: str, args: List[str]) -> int:
+    """
+    Runs the converter script with the given arguments in the server at the given address,
+    in the current directory, and writes its output to standard output and standard error.
+    Standard input is sent to the server if the input file is "-".
+    The token is read from token_path().
+    Returns the exit code.
+    """
+    try:
+        with open(token_path(address)) as file:
+            token = file.read().strip()
+    except OSError as error:
+        print(
+            f"Couldn't read the token for the server at {address}: {error}",
+            file=sys.stderr,
+        )
+        return -3
+    stdin = sys.stdin.buffer.read() if _reads_stdin(args) else b""
+    request = json.dumps(
+        {
+            "args": args,
+            "cwd": os.getcwd(),
+            "stdin": base64.b64encode(stdin).decode("ascii"),
+        }
+    )
+    connection = _connect(address)
+    try:
+        connection.request(
+            "POST",
+            "/run",
+            request,
+            {"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+        )
+        response = connection.getresponse()
+        body = response.read()
+    except OSError as error:
+        print(f"Couldn't connect to the server at {address}: {error}", file=sys.stderr)
+        return -3
+    finally:
+        connection.close()
+    if response.status != 200:
+        print(f"The server at {address} says: {response.reason}", file=sys.stderr)
+        return -3
+
+    result = json.loads(body)
+    sys.stdout.flush()
+    sys.stdout.buffer.write(base64.b64decode(result["stdout"]))
+    sys.stdout.buffer.flush()
+    sys.stderr.flush()
+    sys.stderr.buffer.write(base64.b64decode(result["stderr"]))
+    sys.stderr.buffer.flush()
+    return result["code"]
+
+
+def _exit(signum, frame):
+    sys.exit(0)
+
+
+def serve_main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(
+        prog="jchord serve",
+        description="Runs a server which does conversions for 'jchord --server ADDRESS ...'",
+    )
+    parser.add_argument(
+        "address",
+        nargs="?",
+        default=DEFAULT_ADDRESS,
+        help=f"host:port on localhost or the path of a Unix socket (default: {DEFAULT_ADDRESS})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="number of processes to do conversions in (default: 2)",
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory to cache the notes in MIDI files and the .xlsx, MIDI and PDF files in, "
+        "for requests which don't give one",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="print a line for each request"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        server = make_server(args.address, args.workers, args.verbose, args.cache)
+    except (OSError, ValueError) as error:
+        print(f"Couldn't start the server at {args.address}: {error}", file=sys.stderr)
+        return -3
+    print(f"Serving at {args.address} with {args.workers} workers", file=sys.stderr)
+    # Stop the workers and remove the socket when killed as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, _exit)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
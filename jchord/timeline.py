@@ -0,0 +1,98 @@
+"""
+Finds which of a list of time intervals contain a given time, or overlap a given range.
+"""
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Sequence
+
+
+class IntervalIndex(object):
+    """
+    An index of the intervals ``[starts[i], ends[i])``, where ``starts`` is sorted.
+
+    The latest end time is kept for every power-of-two block of intervals (a segment tree),
+    so both kinds of query take O(log n) time, plus the number of intervals found.
+    The intervals may overlap and leave gaps.
+
+    Parameters:
+    * starts: the start of each interval, in ascending order
+    * ends: the end of each interval
+    """
+
+    def __init__(self, starts: Sequence[float], ends: Sequence[float]):
+        if len(starts) != len(ends):
+            raise ValueError(
+                f"Got {len(starts)} start times, but {len(ends)} end times"
+            )
+        if any(second < first for first, second in zip(starts, starts[1:])):
+            raise ValueError("The start times must be in ascending order")
+        self.starts = list(starts)
+        self.ends = list(ends)
+        self._size = 1
+        while self._size < len(self.ends):
+            self._size *= 2
+        self._max_ends = [float("-inf")] * (2 * self._size)
+        self._max_ends[self._size : self._size + len(self.ends)] = self.ends
+        for node in reversed(range(1, self._size)):
+            self._max_ends[node] = max(
+                self._max_ends[2 * node], self._max_ends[2 * node + 1]
+            )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def at(self, time: float) -> Optional[int]:
+        """
+        Returns the index of the interval which contains the given time,
+        or None if there is no such interval.
+        If several intervals contain the time, the one which starts last is returned.
+        """
+        limit = bisect_right(self.starts, time)
+        # Check the last interval first, since that is usually the one
+        if limit and self.ends[limit - 1] > time:
+            return limit - 1
+
+        # Find the last block before the limit which has an interval that ends after the time
+        low = self._size
+        high = self._size + limit
+        left_blocks = []
+        while low < high:
+            if high & 1:
+                high -= 1
+                if self._max_ends[high] > time:
+                    return self._last_after(high, time)
+            if low & 1:
+                left_blocks.append(low)
+                low += 1
+            low //= 2
+            high //= 2
+        for node in reversed(left_blocks):
+            if self._max_ends[node] > time:
+                return self._last_after(node, time)
+        return None
+
+    def overlapping(self, start: float, stop: float) -> List[int]:
+        """
+        Returns the indices of the intervals which overlap ``[start, stop)``, in order.
+        """
+        limit = bisect_left(self.starts, stop)
+        found = []
+        # Depth-first search for the intervals which end after start, skipping blocks
+        # where all intervals end before that
+        stack = [(1, 0, self._size)]
+        while stack:
+            node, first, last = stack.pop()
+            if first >= limit or self._max_ends[node] <= start:
+                continue
+            if node >= self._size:
+                found.append(first)
+                continue
+            middle = (first + last) // 2
+            stack.append((2 * node + 1, middle, last))
+            stack.append((2 * node, first, middle))
+        return found
+
+    def _last_after(self, node: int, time: float) -> int:
+        """Returns the index of the last interval in the block which ends after the time."""
+        while node < self._size:
+            node = 2 * node + 1 if self._max_ends[2 * node + 1] > time else 2 * node
+        return node - self._size
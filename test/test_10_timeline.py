@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from jchord.timeline import IntervalIndex
+
+
+def brute_force_at(starts, ends, time):
+    found = [i for i in range(len(starts)) if starts[i] <= time < ends[i]]
+    return found[-1] if found else None
+
+
+def brute_force_overlapping(starts, ends, start, stop):
+    return [i for i in range(len(starts)) if starts[i] < stop and ends[i] > start]
+
+
+def test_empty():
+    index = IntervalIndex([], [])
+    assert len(index) == 0
+    assert index.at(0) is None
+    assert index.overlapping(0, 10) == []
+
+
+def test_contiguous():
+    index = IntervalIndex([0, 480, 960], [480, 960, 1920])
+    assert [index.at(time) for time in [-1, 0, 479, 480, 1919, 1920]] == [
+        None,
+        0,
+        0,
+        1,
+        2,
+        None,
+    ]
+    assert index.overlapping(400, 961) == [0, 1, 2]
+    assert index.overlapping(480, 960) == [1]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_intervals(seed):
+    rng = random.Random(seed)
+    n_intervals = rng.randint(1, 100)
+    starts = sorted(rng.randint(0, 200) for _ in range(n_intervals))
+    ends = [start + rng.choice([0, 1, 5, 20, 100]) for start in starts]
+    index = IntervalIndex(starts, ends)
+    for time in range(-5, 320):
+        assert index.at(time) == brute_force_at(starts, ends, time)
+    for _ in range(200):
+        start = rng.randint(-5, 320)
+        stop = start + rng.randint(0, 50)
+        assert index.overlapping(start, stop) == brute_force_overlapping(
+            starts, ends, start, stop
+        )
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        IntervalIndex([0, 1], [1])
+    with pytest.raises(ValueError):
+        IntervalIndex([1, 0], [2, 2])
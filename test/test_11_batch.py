@@ -0,0 +1,145 @@
+import io
+import json
+import os
+import shutil
+
+import pytest
+
+from jchord.batch import (
+    extract_corpus,
+    format_corpus_stats,
+    iter_midi_files,
+    render_many,
+)
+from jchord.midi_effects import Spreader
+from jchord.progressions import ChordProgression, MidiConversionSettings
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+def make_settings(index, progression):
+    if index == 2:
+        raise ValueError("no settings for this one")
+    return MidiConversionSettings(
+        filename=os.path.join(DATA_DIR, f"batch_{index}.midi"),
+        beats_per_chord=[1, 2] if index == 4 else 2,
+        # Without a seed, Spreader uses the global random number generator
+        effect=Spreader(amount=10, jitter=5),
+    )
+
+
+def render_and_read(workers, chunk_size):
+    progressions = [
+        ChordProgression.from_string(string)
+        for string in ["C F G7", "Am -- Dm7 E7", "C", "F Bb", "C F G"] * 3
+    ]
+    results = render_many(
+        progressions, make_settings, workers=workers, chunk_size=chunk_size
+    )
+    contents = []
+    try:
+        for result in results:
+            if result.error is None:
+                with open(result.filename, "rb") as file:
+                    contents.append(file.read())
+            else:
+                contents.append(None)
+    finally:
+        for result in results:
+            if result.filename and os.path.exists(result.filename):
+                os.remove(result.filename)
+    return results, contents
+
+
+@pytest.mark.parametrize("workers, chunk_size", [(None, 16), (2, 1), (3, 4)])
+def test_render_many(workers, chunk_size):
+    serial_results, serial_contents = render_and_read(None, 1)
+    results, contents = render_and_read(workers, chunk_size)
+    assert results == serial_results
+    assert contents == serial_contents
+    assert [result.index for result in results] == list(range(15))
+    assert results[2].filename is None
+    assert results[2].error == "ValueError: no settings for this one"
+    assert results[4].filename.endswith("batch_4.midi")
+    assert results[4].error.startswith("AssertionError: len(settings.beats_per_chord)")
+    assert sum(result.error is None for result in results) == 13
+    assert contents[0] != contents[5]
+
+
+def make_corpus(directory):
+    os.makedirs(os.path.join(directory, "b"))
+    shutil.copy(os.path.join(DATA_DIR, "issue_8.mid"), os.path.join(directory, "a.mid"))
+    shutil.copy(
+        os.path.join(DATA_DIR, "issue_56.mid"), os.path.join(directory, "b", "c.MIDI")
+    )
+    with open(os.path.join(directory, "b", "broken.mid"), "wb") as file:
+        file.write(b"not a MIDI file")
+    with open(os.path.join(directory, "b", "notes.txt"), "w") as file:
+        file.write("C F G")
+
+
+def test_iter_midi_files(tmp_path):
+    make_corpus(str(tmp_path))
+    expected = [
+        os.path.join(str(tmp_path), "a.mid"),
+        os.path.join(str(tmp_path), "b", "broken.mid"),
+        os.path.join(str(tmp_path), "b", "c.MIDI"),
+    ]
+    assert list(iter_midi_files(str(tmp_path))) == expected
+    assert list(iter_midi_files(os.path.join(str(tmp_path), "**", "*.mid"))) == [
+        expected[0],
+        expected[1],
+    ]
+    assert list(iter_midi_files([expected[2], expected[0]])) == [
+        expected[2],
+        expected[0],
+    ]
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_extract_corpus_jsonl(tmp_path, workers):
+    make_corpus(str(tmp_path))
+    output = io.StringIO()
+    progress = []
+    stats = extract_corpus(
+        str(tmp_path), output, workers=workers, progress=progress.append
+    )
+
+    lines = sorted(
+        (json.loads(line) for line in output.getvalue().splitlines()),
+        key=lambda line: line["file"],
+    )
+    assert [os.path.basename(line["file"]) for line in lines] == [
+        "a.mid",
+        "broken.mid",
+        "c.MIDI",
+    ]
+    expected = ChordProgression.from_midi_file(os.path.join(DATA_DIR, "issue_8.mid"))
+    assert lines[0]["chords"] == [chord.name for chord in expected.progression]
+    assert lines[1]["error"].startswith("OSError")
+    assert "chords" not in lines[1]
+
+    assert stats.n_files == 3
+    assert stats.n_chords == len(lines[0]["chords"]) + len(lines[2]["chords"])
+    assert stats.failures == [(lines[1]["file"], lines[1]["error"])]
+    assert [item.n_files for item in progress] == [1, 2, 3]
+    assert format_corpus_stats(stats).startswith(
+        f"3 files (1 failed), {stats.n_chords} chords in "
+    )
+
+
+def test_extract_corpus_text(tmp_path):
+    make_corpus(str(tmp_path))
+    output = io.StringIO()
+    stats = extract_corpus(
+        os.path.join(str(tmp_path), "*.mid"), output, output_format="text"
+    )
+    expected = ChordProgression.from_midi_file(os.path.join(DATA_DIR, "issue_8.mid"))
+    filename, chords = output.getvalue().rstrip("\n").split("\t")
+    assert filename == os.path.join(str(tmp_path), "a.mid")
+    assert chords.split() == [chord.name for chord in expected.progression]
+    assert stats.n_files == 1
+    assert stats.failures == []
+
+    with pytest.raises(ValueError):
+        extract_corpus(str(tmp_path), output, output_format="csv")
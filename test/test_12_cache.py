@@ -0,0 +1,189 @@
+from hashlib import sha256
+import os
+
+import pytest
+
+from jchord.cache import FileCache, RenderCache, UncacheableError, stable_repr
+from jchord.midi import MidiNoteCache
+from jchord.midi_effects import Arpeggiator, Chain, Spreader, Transposer
+from jchord.progressions import (
+    ChordProgression,
+    MidiConversionSettings,
+    Song,
+    SongSection,
+)
+
+
+def test_stable_repr():
+    assert stable_repr({"b": [1, 2.5], "a": (None, "x")}) == stable_repr(
+        {"a": (None, "x"), "b": [1, 2.5]}
+    )
+    assert stable_repr([1, 2]) != stable_repr((1, 2))
+    assert stable_repr(Transposer(2)) == stable_repr(Transposer(2))
+    assert stable_repr(Transposer(2)) != stable_repr(Transposer(3))
+    assert stable_repr(Spreader(10, 5, seed=1)) != stable_repr(Spreader(10, 5, seed=2))
+    stable_repr(Spreader(10, 0))
+
+    arpeggiator = Arpeggiator(rate=1 / 8, pattern=[1, 2, 3])
+    before = stable_repr(arpeggiator)
+    arpeggiator.set_state(3)
+    assert stable_repr(arpeggiator) != before
+
+    with pytest.raises(UncacheableError):
+        stable_repr(Spreader(10, 5))
+    with pytest.raises(UncacheableError):
+        stable_repr(Chain(Transposer(2), Spreader(10, 5)))
+    with pytest.raises(UncacheableError):
+        stable_repr([lambda: None])
+
+
+def test_file_cache(tmp_path):
+    a, b, c = (sha256(name).hexdigest() for name in [b"a", b"b", b"c"])
+    cache = FileCache(str(tmp_path / "cache"), max_size=25)
+    assert cache.read(a) is None
+    cache.write(a, b"0123456789")
+    cache.write(b, b"0123456789")
+    os.utime(cache._path(a), (1, 1))
+    os.utime(cache._path(b), (2, 2))
+    assert cache.read(a) == b"0123456789"
+
+    source = str(tmp_path / "source")
+    with open(source, "wb") as file:
+        file.write(b"abcdefghij")
+    # b is the least recently used
+    cache.copy_from(c, source)
+    assert cache.read(b) is None
+    target = str(tmp_path / "target")
+    assert not cache.copy_to(b, target)
+    assert cache.copy_to(c, target)
+    with open(target, "rb") as file:
+        assert file.read() == b"abcdefghij"
+
+    cache.clear()
+    assert os.listdir(cache.directory) == []
+    with pytest.raises(ValueError):
+        cache.write("a", b"")
+
+
+def test_file_cache_leaves_other_files(tmp_path):
+    directory = str(tmp_path / "cache")
+    os.makedirs(directory)
+    other_files = ["keep.txt", "a" * 64 + ".txt", "A" * 64]
+    for name in other_files:
+        with open(os.path.join(directory, name), "wb") as file:
+            file.write(b"0123456789" * 10)
+
+    # The other files don't count towards the size, and are never evicted
+    cache = RenderCache(directory, max_size=25)
+    for name in [b"a", b"b", b"c"]:
+        cache.write(sha256(name).hexdigest() + ".mid", b"0123456789")
+    assert len(os.listdir(directory)) == len(other_files) + 2
+    cache.clear()
+    assert sorted(os.listdir(directory)) == sorted(other_files)
+
+    MidiNoteCache(directory).clear()
+    assert sorted(os.listdir(directory)) == sorted(other_files)
+
+
+def test_render_cache_midi(tmp_path, monkeypatch):
+    cache = RenderCache(str(tmp_path / "cache"))
+    progression = ChordProgression.from_string("C F G7 C " * 4)
+    filename = str(tmp_path / "out.mid")
+    renders = []
+    original = ChordProgression.to_midi
+
+    def counting_to_midi(self, settings, **kwargs):
+        if settings.cache is None:
+            renders.append(settings.filename)
+        return original(self, settings, **kwargs)
+
+    monkeypatch.setattr(ChordProgression, "to_midi", counting_to_midi)
+
+    def render(**kwargs):
+        settings = MidiConversionSettings(filename=filename, cache=cache, **kwargs)
+        timed = progression.to_midi(settings)
+        with open(filename, "rb") as file:
+            return timed, file.read()
+
+    first = render(effect=Transposer(2))
+    assert render(effect=Transposer(2)) == first
+    assert len(renders) == 1
+    assert render(effect=Transposer(3)) != first
+    assert render(effect=Transposer(2), tempo=100) != first
+    assert len(renders) == 3
+
+    # The file name isn't part of the key
+    other = str(tmp_path / "other.mid")
+    progression.to_midi(
+        MidiConversionSettings(filename=other, cache=cache, effect=Transposer(2))
+    )
+    with open(other, "rb") as file:
+        assert file.read() == first[1]
+    assert len(renders) == 3
+
+    # The same as without the cache
+    progression.to_midi(MidiConversionSettings(filename=other, effect=Transposer(2)))
+    with open(other, "rb") as file:
+        assert file.read() == first[1]
+
+    # Not cached with a random effect
+    render(effect=Spreader(10, 5))
+    render(effect=Spreader(10, 5))
+    assert len(renders) == 6
+    assert len(os.listdir(cache.directory)) == 3
+
+
+def test_render_cache_midi_reused_settings(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    progression = ChordProgression.from_string("C F G7 C")
+    filename = str(tmp_path / "out.mid")
+    progression.to_midi(MidiConversionSettings(filename=filename, cache=cache))
+
+    # Rendering without the cache stores the track and progression on the settings,
+    # which must not change the key
+    settings = MidiConversionSettings(filename=filename)
+    progression.to_midi(settings)
+    settings.set(cache=cache)
+    progression.to_midi(settings)
+    assert len(os.listdir(cache.directory)) == 1
+
+
+def test_render_cache_song_midi(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    verse = ChordProgression.from_string("C F G7 C")
+    filename = str(tmp_path / "out.mid")
+    expected_filename = str(tmp_path / "expected.mid")
+    for tempo in [None, 90, None]:
+        song = Song([SongSection("A", verse, tempo), SongSection("B", verse)])
+        song.to_midi(MidiConversionSettings(filename=filename, cache=cache))
+        song.to_midi(MidiConversionSettings(filename=expected_filename))
+        with open(filename, "rb") as file, open(expected_filename, "rb") as expected:
+            assert file.read() == expected.read()
+    assert len(os.listdir(cache.directory)) == 2
+
+
+def test_render_cache_xlsx_and_pdf(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    progression = ChordProgression.from_string("C F G7 C Am Dm G7 C")
+    xlsx_filename = str(tmp_path / "out.xlsx")
+    pdf_filename = str(tmp_path / "out.pdf")
+
+    progression.to_xlsx(xlsx_filename, cache=cache)
+    with open(xlsx_filename, "rb") as file:
+        xlsx = file.read()
+    os.remove(xlsx_filename)
+    progression.to_xlsx(xlsx_filename, cache=cache)
+    with open(xlsx_filename, "rb") as file:
+        assert file.read() == xlsx
+    assert ChordProgression.from_xlsx(xlsx_filename) == progression
+    progression.to_xlsx(xlsx_filename, chords_per_row=2, cache=cache)
+    assert len(os.listdir(cache.directory)) == 2
+
+    progression.to_pdf(pdf_filename, cache=cache)
+    with open(pdf_filename, "rb") as file:
+        pdf = file.read()
+    progression.to_pdf(pdf_filename, cache=cache)
+    with open(pdf_filename, "rb") as file:
+        assert file.read() == pdf
+    progression.to_pdf(pdf_filename, cache=cache, fontsize=12)
+    assert len(os.listdir(cache.directory)) == 4
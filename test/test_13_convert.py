@@ -0,0 +1,208 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+from jchord.batch import extract_corpus
+from jchord.convert import ConversionError, format_output, iter_batch_inputs, main
+from jchord.progressions import ChordProgression, Song
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "test_data")
+
+
+def write_inputs(directory):
+    os.makedirs(os.path.join(directory, "sub"))
+    inputs = {
+        "a.txt": "C F G7 C",
+        os.path.join("sub", "b.txt"): "Am Dm E7 Am",
+        os.path.join("sub", "c.pdf"): "",
+    }
+    for name, contents in inputs.items():
+        with open(os.path.join(directory, name), "w") as file:
+            file.write(contents)
+    with open(os.path.join(directory, "notes.md"), "w") as file:
+        file.write("not an input")
+
+
+def test_convert_single(tmp_path, capsys):
+    filename = str(tmp_path / "out.txt")
+    assert main(["C F G7", filename]) == 0
+    assert ChordProgression.from_txt(filename) == ChordProgression.from_string("C F G7")
+    assert main(["in.pdf", filename]) == -1
+    assert main(["C F G7", str(tmp_path / "out.doc")]) == -2
+    assert main(["C F G7", str(tmp_path / "out.mid"), "--midi", "tempo"]) == -2
+    assert capsys.readouterr().out.splitlines() == [
+        "Sorry, converting from PDF is not supported",
+        f"Unknown format: {tmp_path / 'out.doc'}",
+        "Couldn't parse arglist, expected key1=value,key2=value..., got tempo",
+    ]
+
+
+def test_iter_batch_inputs(tmp_path):
+    write_inputs(str(tmp_path))
+    a = os.path.join(str(tmp_path), "a.txt")
+    b = os.path.join(str(tmp_path), "sub", "b.txt")
+    assert list(iter_batch_inputs(str(tmp_path))) == [a, b]
+    # Extensions are matched in any case
+    e = os.path.join(str(tmp_path), "sub", "e.TXT")
+    with open(e, "w") as file:
+        file.write("C G")
+    assert list(iter_batch_inputs(str(tmp_path))) == [a, b, e]
+    assert main([e, str(tmp_path / "e.MID")]) == 0
+    assert list(iter_batch_inputs(os.path.join(str(tmp_path), "**", "*.txt"))) == [
+        a,
+        b,
+    ]
+    manifest = str(tmp_path / "manifest")
+    with open(manifest, "w") as file:
+        file.write(f"# Inputs\n{b}\n\n{a}\n")
+    assert list(iter_batch_inputs("@" + manifest)) == [b, a]
+
+    assert format_output("out/{stem}.mid", b, 3) == os.path.join("out", "b.mid")
+    for template in ["out/{foo}.mid", "out/{stem.mid", "out/{}.mid", "{stem.x}"]:
+        with pytest.raises(ConversionError):
+            format_output(template, b, 3)
+    assert format_output("{parent}/{index}-{name}.mid", b, 3) == os.path.join(
+        str(tmp_path), "sub", "3-b.txt.mid"
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_convert_batch(tmp_path, capsys, workers):
+    inputs = tmp_path / "in"
+    write_inputs(str(inputs))
+    source = os.path.join(str(inputs), "**", "*.*")
+    template = os.path.join(str(tmp_path), "out", "{stem}.mid")
+    args = [source, template, "--batch", "--workers", str(workers)]
+
+    assert main(args + ["--midi", "tempo=100"]) == -1
+    output = capsys.readouterr().out.splitlines()
+    assert sorted(output[:2]) == [
+        f"Failed to convert {inputs / 'notes.md'}: Unknown format: {inputs / 'notes.md'}",
+        f"Failed to convert {inputs / 'sub' / 'c.pdf'}: "
+        "Sorry, converting from PDF is not supported",
+    ]
+    assert output[2].startswith("2 converted, 0 up to date, 2 failed in ")
+    assert sorted(os.listdir(str(tmp_path / "out"))) == ["a.mid", "b.mid"]
+
+    # Outputs which are newer than the inputs are skipped
+    assert main(args) == -1
+    summary = capsys.readouterr().out.splitlines()[-1]
+    assert summary.startswith("0 converted, 2 up to date, 2 failed in ")
+    os.utime(str(inputs / "a.txt"), (2e9, 2e9))
+    main(args)
+    summary = capsys.readouterr().out.splitlines()[-1]
+    assert summary.startswith("1 converted, 1 up to date, 2 failed in ")
+    main(args + ["--force"])
+    summary = capsys.readouterr().out.splitlines()[-1]
+    assert summary.startswith("2 converted, 0 up to date, 2 failed in ")
+
+
+def test_convert_batch_in_place(tmp_path, capsys):
+    write_inputs(str(tmp_path))
+    args = [str(tmp_path), "{parent}/{stem}.mid", "--batch"]
+    assert main(args) == 0
+    summary = capsys.readouterr().out.splitlines()[-1]
+    assert summary.startswith("2 converted, 0 up to date, 0 failed in ")
+    assert os.path.exists(str(tmp_path / "sub" / "b.mid"))
+
+    # The outputs are in the directory now, but they are not inputs
+    assert main(args) == 0
+    summary = capsys.readouterr().out.splitlines()[-1]
+    assert summary.startswith("0 converted, 2 up to date, 0 failed in ")
+
+
+def test_convert_batch_errors(tmp_path, capsys):
+    write_inputs(str(tmp_path))
+    assert main([str(tmp_path), "out.mid", "--batch"]) == -2
+    assert capsys.readouterr().out.startswith("Both ")
+    assert main([str(tmp_path), "{foo}.mid", "--batch"]) == -2
+    assert capsys.readouterr().out.startswith("Invalid output template {foo}.mid: ")
+    assert main([str(tmp_path), "{stem}.mid", "--batch", "--pdf", "x"]) == -2
+    assert not os.path.exists("a.mid")
+
+
+class FakeStdin(io.TextIOWrapper):
+    def __init__(self, data: bytes):
+        super().__init__(io.BytesIO(data))
+
+
+def test_convert_stdio_text(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "stdin", FakeStdin(b"C F\nG7  C\n"))
+    assert main(["-", "-"]) == 0
+    assert (
+        capsys.readouterr().out == ChordProgression.from_string("C F G7 C").to_string()
+    )
+
+    monkeypatch.setattr(sys, "stdin", FakeStdin(b"C F\nG7  C\n"))
+    assert main(["-", "--to", "jsonl", "-"]) == 0
+    assert capsys.readouterr().out == '{"chords": ["C", "F", "G7", "C"]}\n'
+
+    assert main(["Am -- E7", "-", "--to", "jsonl"]) == 0
+    assert capsys.readouterr().out == '{"chords": ["Am", "Am", "E7"]}\n'
+
+
+def test_convert_stdio_jsonl(tmp_path, monkeypatch, capsys):
+    corpus = str(tmp_path / "corpus.jsonl")
+    with open(corpus, "w") as file:
+        extract_corpus(
+            [os.path.join(DATA_DIR, "issue_8.mid"), str(tmp_path / "missing.mid")], file
+        )
+        file.write("\n" + json.dumps({"chords": "Am -- E7"}) + "\n")
+    with open(corpus, "rb") as file:
+        monkeypatch.setattr(sys, "stdin", FakeStdin(file.read()))
+
+    assert main(["-", "--from", "jsonl", "-"]) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    expected = ChordProgression.from_midi_file(os.path.join(DATA_DIR, "issue_8.mid"))
+    assert lines == [
+        {
+            "file": os.path.join(DATA_DIR, "issue_8.mid"),
+            "chords": [chord.name for chord in expected.progression],
+        },
+        {"chords": ["Am", "Am", "E7"]},
+    ]
+
+    assert main([corpus, str(tmp_path / "out.txt")]) == -2
+    assert capsys.readouterr().out.startswith("There is more than one progression in")
+    with open(corpus, "w") as file:
+        file.write("[1, 2]\n")
+    assert main([corpus, "-"]) == -2
+    assert capsys.readouterr().err == "Line 1 is not a JSON object\n"
+
+
+def test_convert_stdio_binary(tmp_path, monkeypatch, capsysbinary):
+    filename = str(tmp_path / "out.mid")
+    assert main(["C F G7 C", filename, "--midi", "tempo=100"]) == 0
+    with open(filename, "rb") as file:
+        midi = file.read()
+
+    assert main(["C F G7 C", "-", "--to", "midi", "--midi", "tempo=100"]) == 0
+    assert capsysbinary.readouterr().out == midi
+
+    monkeypatch.setattr(sys, "stdin", FakeStdin(midi))
+    assert main(["-", "--from", "midi", str(tmp_path / "out.txt")]) == 0
+    assert ChordProgression.from_txt(
+        str(tmp_path / "out.txt")
+    ) == ChordProgression.from_midi(filename)
+
+
+def test_convert_stdio_pdf(tmp_path, monkeypatch, capsysbinary):
+    titles = []
+    original = Song.to_pdf
+
+    def recording_to_pdf(self, filename, **kwargs):
+        titles.append([section.name for section in self.sections])
+        return original(self, filename, **kwargs)
+
+    monkeypatch.setattr(Song, "to_pdf", recording_to_pdf)
+    cache = str(tmp_path / "cache")
+    args = ["C F G7 C", "-", "--to", "pdf", "--cache", cache]
+    assert main(args) == 0
+    pdf = capsysbinary.readouterr().out
+    assert main(args) == 0
+    assert capsysbinary.readouterr().out == pdf
+    assert titles[0] == [""]
+    assert len(os.listdir(os.path.join(cache, "render"))) == 1
@@ -0,0 +1,181 @@
+import io
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+
+import pytest
+
+from jchord.convert import main
+from jchord.progressions import ChordProgression
+from jchord.serve import _connect, make_server, parse_address, run_client, token_path
+
+
+class FakeStdin(io.TextIOWrapper):
+    def __init__(self, data: bytes):
+        super().__init__(io.BytesIO(data))
+
+
+@pytest.fixture(params=["unix", "tcp"])
+def server(request, tmp_path, monkeypatch):
+    # The tokens for localhost are kept in ~/.jchord
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    if request.param == "unix":
+        server = make_server(str(tmp_path / "jchord.sock"), workers=1)
+        address = server.server_address
+    else:
+        server = make_server("127.0.0.1:0", workers=1)
+        address = "127.0.0.1:{}".format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield address
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    assert not os.path.exists(token_path(address))
+
+
+def test_parse_address():
+    assert parse_address("localhost:8765") == ("localhost", 8765)
+    assert parse_address("[::1]:80") == ("::1", 80)
+    assert parse_address("/tmp/jchord.sock") == "/tmp/jchord.sock"
+    with pytest.raises(ValueError):
+        make_server("0.0.0.0:8765")
+
+
+def test_token_path():
+    assert token_path("localhost:8765") == token_path("127.0.0.1:8765")
+    assert token_path("[::1]:8765") != token_path("127.0.0.1:8765")
+    assert token_path("127.0.0.1:8766") != token_path("127.0.0.1:8765")
+    assert token_path("/tmp/jchord.sock") == "/tmp/jchord.sock.token"
+
+
+def test_serve(server, tmp_path, monkeypatch, capsysbinary):
+    monkeypatch.chdir(str(tmp_path))
+    assert run_client(server, ["C F G7 C", "out.txt"]) == 0
+    assert ChordProgression.from_txt(
+        str(tmp_path / "out.txt")
+    ) == ChordProgression.from_string("C F G7 C")
+
+    assert main(["C F G7 C", "expected.mid", "--midi", "tempo=100"]) == 0
+    monkeypatch.setattr(sys, "stdin", FakeStdin(b"C F\nG7 C\n"))
+    args = ["-", "--to", "midi", "-", "--midi", "tempo=100"]
+    assert main(["--server", server] + args) == 0
+    with open(str(tmp_path / "expected.mid"), "rb") as file:
+        assert capsysbinary.readouterr().out == file.read()
+
+    assert run_client(server, ["in.pdf", "out.txt"]) == -1
+    assert capsysbinary.readouterr().out == (
+        b"Sorry, converting from PDF is not supported\n"
+    )
+    assert run_client(server, ["C", "out.txt", "--not-an-option"]) == 2
+    assert capsysbinary.readouterr().err.startswith(b"usage: jchord ")
+
+
+def test_serve_socket_path(tmp_path):
+    # Never replaces a file which isn't a socket
+    path = str(tmp_path / "notes.txt")
+    with open(path, "w") as file:
+        file.write("C F G")
+    with pytest.raises(OSError, match="not a socket"):
+        make_server(path, workers=1)
+    with open(path) as file:
+        assert file.read() == "C F G"
+
+    # A socket without a server is replaced
+    path = str(tmp_path / "jchord.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+
+    # The token is never written through a symlink
+    target = str(tmp_path / "target")
+    with open(target, "w") as file:
+        file.write("keep")
+    os.symlink(target, token_path(path))
+    server = make_server(path, workers=1)
+    try:
+        with open(target) as file:
+            assert file.read() == "keep"
+        assert not os.path.islink(token_path(path))
+        assert stat.S_IMODE(os.stat(token_path(path)).st_mode) == 0o600
+        # The socket of a running server is not replaced
+        with pytest.raises(OSError, match="already a server"):
+            make_server(path, workers=1)
+    finally:
+        server.server_close()
+    assert not os.path.exists(path)
+
+
+def test_serve_stdout_only(server, tmp_path, monkeypatch, capsys):
+    # Standard input is never closed, so reading it would block
+    read_fd, write_fd = os.pipe()
+    stdin = io.TextIOWrapper(io.open(read_fd, "rb"))
+    monkeypatch.setattr(sys, "stdin", stdin)
+    codes = []
+    thread = threading.Thread(
+        target=lambda: codes.append(run_client(server, ["C F G7", "-"])), daemon=True
+    )
+    thread.start()
+    thread.join(timeout=30)
+    try:
+        assert not thread.is_alive()
+        assert codes == [0]
+        assert (
+            capsys.readouterr().out
+            == ChordProgression.from_string("C F G7").to_string()
+        )
+    finally:
+        os.close(write_fd)
+        thread.join()
+        stdin.close()
+
+
+def test_serve_rejects_requests(server, tmp_path):
+    filename = str(tmp_path / "out.txt")
+    body = json.dumps({"args": ["C F G", filename], "cwd": str(tmp_path)})
+    with open(token_path(server)) as file:
+        token = file.read()
+    assert stat.S_IMODE(os.stat(token_path(server)).st_mode) == 0o600
+    authorization = {"Authorization": f"Bearer {token}"}
+    json_type = {"Content-Type": "application/json"}
+
+    def post(headers):
+        connection = _connect(server)
+        try:
+            connection.request("POST", "/run", body, headers)
+            return connection.getresponse().status
+        finally:
+            connection.close()
+
+    assert post(json_type) == 403
+    assert post({"Authorization": "Bearer wrong", **json_type}) == 403
+    assert post({"Content-Type": "text/plain", **authorization}) == 415
+    assert post({"Origin": "http://example.com", **json_type, **authorization}) == 403
+    assert not os.path.exists(filename)
+    assert post({**json_type, **authorization}) == 200
+    assert os.path.exists(filename)
+
+
+def test_serve_cache(tmp_path, monkeypatch, capsysbinary):
+    monkeypatch.chdir(str(tmp_path))
+    server = make_server(
+        str(tmp_path / "jchord.sock"), workers=1, cache=str(tmp_path / "cache")
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        socket_mode = os.stat(server.server_address).st_mode
+        assert stat.S_IMODE(socket_mode) == 0o600
+        for _ in range(2):
+            assert run_client(server.server_address, ["C F G7 C", "out.mid"]) == 0
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    assert os.listdir(str(tmp_path / "cache" / "render")) != []
+    assert not os.path.exists(str(tmp_path / "jchord.sock"))
+    assert run_client(str(tmp_path / "jchord.sock"), ["C", "out.txt"]) == -3
+    assert capsysbinary.readouterr().err.startswith(b"Couldn't read the token")
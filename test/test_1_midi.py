@@ -1,5 +1,21 @@
+import io
+import os
+import shutil
+
 from jchord.core import Note
-from jchord.midi import note_to_midi, midi_to_pitch, midi_to_note, InvalidNote
+from jchord.midi import (
+    encode_notes,
+    iter_notes_to_messages,
+    join_encoded_notes,
+    midi_to_note,
+    midi_to_pitch,
+    note_to_midi,
+    notes_to_messages,
+    read_midi_file,
+    InvalidNote,
+    MidiNote,
+    MidiNoteCache,
+)
 
 import pytest
 
@@ -32,3 +48,156 @@ def test_note_to_midi_invalid_note():
 )
 def test_midi_to_pitch(midi, pitch):
     assert midi_to_pitch(midi) == pytest.approx(pitch)
+
+
+def test_iter_notes_to_messages():
+    notes = [
+        MidiNote(time=0, note=60, duration=480, velocity=100),
+        MidiNote(time=0, note=64, duration=960, velocity=100),
+        MidiNote(time=480, note=60, duration=480, velocity=100),
+        MidiNote(time=480, note=67, duration=0, velocity=100),
+        MidiNote(time=600, note=64, duration=100, velocity=100),
+    ]
+    assert list(iter_notes_to_messages(iter(notes), velocity=90)) == notes_to_messages(
+        notes, velocity=90
+    )
+
+
+def test_iter_notes_to_messages_meta():
+    import mido
+
+    notes = [
+        MidiNote(time=0, note=60, duration=480, velocity=100),
+        MidiNote(time=480, note=64, duration=480, velocity=100),
+    ]
+    tempo = mido.MetaMessage("set_tempo", tempo=400000)
+    signature = mido.MetaMessage("time_signature", numerator=3, denominator=4)
+    end = mido.MetaMessage("marker", text="end")
+    messages = list(
+        iter_notes_to_messages(
+            notes, meta_messages=[(480, tempo), (480, signature), (2000, end)]
+        )
+    )
+    assert [(message.type, message.time) for message in messages] == [
+        ("note_on", 0),
+        ("set_tempo", 480),
+        ("time_signature", 0),
+        ("note_off", 0),
+        ("note_on", 0),
+        ("note_off", 480),
+        ("marker", 1040),
+    ]
+    assert tempo.time == 0
+
+
+def test_iter_notes_to_messages_meta_keeps_note_times():
+    import mido
+
+    # Notes between ticks, e.g. from Spreader
+    notes = [
+        MidiNote(time=10.5, note=60, duration=480, velocity=100),
+        MidiNote(time=50.9, note=64, duration=480, velocity=100),
+    ]
+    tempo = mido.MetaMessage("set_tempo", tempo=400000)
+
+    def note_times(meta_messages):
+        time = 0
+        times = []
+        for message in iter_notes_to_messages(notes, meta_messages=meta_messages):
+            time += message.time
+            if not message.is_meta:
+                times.append((message.type, message.note, time))
+        return times
+
+    assert note_times([(50, tempo)]) == note_times([])
+
+
+def test_encode_notes():
+    import mido
+
+    notes = [
+        MidiNote(time=0, note=60, duration=480, velocity=100),
+        MidiNote(time=0, note=64, duration=480, velocity=100),
+        MidiNote(time=480, note=60, duration=300, velocity=100),
+        MidiNote(time=960, note=67, duration=200, velocity=100),
+        MidiNote(time=2000, note=64, duration=100, velocity=100),
+    ]
+    track = mido.MidiTrack(iter_notes_to_messages(notes, velocity=90))
+    file = io.BytesIO()
+    mido.midifiles.midifiles.write_track(file, track)
+    expected = file.getvalue()[8:-4]
+
+    assert join_encoded_notes([encode_notes(notes, velocity=90)]) == expected
+    parts = [encode_notes(notes[:2]), None, encode_notes(notes[2:3]), encode_notes([])]
+    assert encode_notes([]) is None
+    assert (
+        join_encoded_notes(
+            [
+                encode_notes(notes[:2], 90),
+                encode_notes(notes[2:4], 90),
+                encode_notes(notes[4:], 90),
+            ]
+        )
+        == expected
+    )
+    assert join_encoded_notes(parts) == join_encoded_notes([encode_notes(notes[:3])])
+
+
+def test_midi_note_cache(tmp_path):
+    data_dir = os.path.join(os.path.dirname(__file__), "test_data")
+    filename = str(tmp_path / "song.mid")
+    shutil.copy(os.path.join(data_dir, "issue_8.mid"), filename)
+    cache_dir = str(tmp_path / "cache")
+    expected = read_midi_file(filename)
+
+    cache = MidiNoteCache(cache_dir)
+    assert cache.get(filename) is None
+    assert read_midi_file(filename, cache) == expected
+    assert cache.get(filename) == expected
+    assert len(os.listdir(cache_dir)) == 1
+    # The cached notes are used, even if they are wrong
+    cache.put(filename, expected[:3])
+    assert read_midi_file(filename, cache_dir) == expected[:3]
+
+    # A changed file is read again
+    with open(filename, "ab") as file:
+        file.write(b"\0")
+    assert cache.get(filename) is None
+    assert read_midi_file(filename, cache_dir) == expected
+    assert len(os.listdir(cache_dir)) == 2
+
+    # With content hashes, copies are found
+    content_cache = MidiNoteCache(cache_dir, hash_contents=True)
+    read_midi_file(filename, content_cache)
+    copy = str(tmp_path / "copy.mid")
+    shutil.copy(filename, copy)
+    assert content_cache.get(copy) == expected
+
+    cache.clear()
+    assert os.listdir(cache_dir) == []
+
+
+def test_midi_note_cache_eviction(tmp_path):
+    notes = [
+        MidiNote(time=i / 4, note=60 + i, duration=0.5, velocity=90) for i in range(10)
+    ]
+    entry_size = len(MidiNoteCache.MAGIC) + 10 * MidiNoteCache.NOTE_FORMAT.size
+    cache = MidiNoteCache(str(tmp_path / "cache"), max_size=3 * entry_size)
+    filenames = []
+    for i in range(5):
+        filename = str(tmp_path / f"{i}.mid")
+        with open(filename, "wb") as file:
+            file.write(bytes([i]))
+        filenames.append(filename)
+        cache.put(filename, notes)
+        os.utime(cache._path(cache.key(filename) + cache.SUFFIX), (i, i))
+        if i == 2:
+            # Use the first one, so the second one is the least recently used
+            assert cache.get(filenames[0]) == notes
+    assert [cache.get(filename) is not None for filename in filenames] == [
+        True,
+        False,
+        False,
+        True,
+        True,
+    ]
@@ -1,15 +1,24 @@
+import io
 import os
+from collections import OrderedDict
 
 import pytest
 
 from jchord.midi import note_to_midi
 from jchord.chords import Chord
+from jchord import progressions
 from jchord.progressions import (
     ChordProgression,
+    ChordSequence,
+    ChordSequenceView,
     InvalidProgression,
+    PersistentChordSequence,
     Song,
     SongSection,
     MidiConversionSettings,
+    MidiTrackSettings,
+    TimedChord,
+    TimedChordProgression,
 )
 
 # These imports are not used directly, but is needed by eval(repr(x)) statements
@@ -99,6 +108,252 @@ def test_multiline():
     ]
 
 
+def test_chord_sequence_interning():
+    prog = ChordProgression.from_string("C F G7 C " * 1000 + "Cmaj")
+    sequence = prog.progression
+    assert isinstance(sequence, ChordSequence)
+    assert len(sequence) == 4001
+    assert sequence._codes.itemsize == 2
+    # "Cmaj" is equal to "C", but has a different name, so it gets its own entry
+    assert [chord.name for chord in sequence.unique()] == ["C", "F", "G7", "Cmaj"]
+    assert prog.chords() == {
+        Chord.from_name("C"),
+        Chord.from_name("F"),
+        Chord.from_name("G7"),
+    }
+    assert sequence[0] is sequence[3]
+    assert sequence[-1].name == "Cmaj"
+    assert sequence[1:3] == [Chord.from_name("F"), Chord.from_name("G7")]
+
+
+def test_chord_sequence_list_api():
+    sequence = ChordSequence([Chord.from_name("C"), Chord.from_name("F")])
+    sequence.append(Chord.from_name("G"))
+    sequence.insert(0, Chord.from_name("Am"))
+    sequence[1] = Chord.from_name("Dm")
+    del sequence[2]
+    assert sequence == [Chord.from_name(name) for name in ["Am", "Dm", "G"]]
+    assert {chord.name for chord in sequence.unique()} == {"Am", "Dm", "G"}
+    assert repr(sequence) == repr(list(sequence))
+
+
+def test_chord_sequence_runs():
+    prog = ChordProgression.from_string("C -- -- F F G7 C Cmaj --")
+    sequence = prog.progression
+    assert [(chord.name, count) for chord, count in sequence.runs()] == [
+        ("C", 3),
+        ("F", 2),
+        ("G7", 1),
+        ("C", 1),
+        ("Cmaj", 2),
+    ]
+    sequence[4] = Chord.from_name("G7")
+    assert [(chord.name, count) for chord, count in sequence.runs()] == [
+        ("C", 3),
+        ("F", 1),
+        ("G7", 2),
+        ("C", 1),
+        ("Cmaj", 2),
+    ]
+    assert list(sequence.map_runs(lambda chord: chord.name)) == [
+        (chord.name, count) for chord, count in sequence.runs()
+    ]
+
+
+def test_chord_sequence_from_runs():
+    c, f = Chord.from_name("C"), Chord.from_name("F")
+    sequence = ChordSequence.from_runs([(c, 2), (c, 1), (f, 0), (f, 2)])
+    assert sequence == [c, c, c, f, f]
+    assert list(sequence.runs()) == [(c, 3), (f, 2)]
+
+
+def test_to_string_runs_across_rows():
+    prog = ChordProgression.from_string("C " * 7 + "F F")
+    assert prog.to_string(chords_per_row=3, column_spacing=2) == (
+        "C  -- -- \n" "-- -- -- \n" "-- F  -- \n" "\n"
+    )
+
+
+def test_slice_shares_storage():
+    prog = ChordProgression.from_string("C F G7 C Am Dm G7 C")
+    window = prog[2:6]
+    assert window == ChordProgression.from_string("G7 C Am Dm")
+    assert window[0] is prog[2]
+    assert window.progression._parts[0][0] is prog.progression
+    assert prog[-1] == Chord.from_name("C")
+    with pytest.raises(IndexError):
+        window[4]
+
+
+@pytest.mark.parametrize(
+    "index",
+    [
+        slice(None),
+        slice(3, 17),
+        slice(-5, None),
+        slice(None, None, 3),
+        slice(None, None, -1),
+        slice(15, 2, -4),
+        slice(8, 8),
+        slice(100, None),
+    ],
+)
+def test_view_slicing(index):
+    first = ChordProgression.from_string("C F G7 Am")
+    second = ChordProgression.from_string("Dm -- G7 -- C")
+    view = ChordSequenceView.concat(first.progression, second.progression).repeat(2)
+    expected = (list(first.progression) + list(second.progression)) * 2
+    assert list(view[index]) == expected[index]
+    assert list(view[index][1:-1:2]) == expected[index][1:-1:2]
+
+
+def test_concat_repeat():
+    verse = ChordProgression.from_string("C -- F G7")
+    chorus = ChordProgression.from_string("Am F C G")
+    song = ChordProgression.concat(verse, chorus, verse.repeat(2))
+    assert song == ChordProgression.from_string(
+        "C -- F G7 Am F C G C -- F G7 C -- F G7"
+    )
+    assert [(chord.name, count) for chord, count in song.progression.runs()] == [
+        ("C", 2),
+        ("F", 1),
+        ("G7", 1),
+        ("Am", 1),
+        ("F", 1),
+        ("C", 1),
+        ("G", 1),
+        ("C", 2),
+        ("F", 1),
+        ("G7", 1),
+        ("C", 2),
+        ("F", 1),
+        ("G7", 1),
+    ]
+    assert song.to_string() == (
+        "C   --  F   G7  \n"
+        "Am  F   C   G   \n"
+        "C   --  F   G7  \n"
+        "C   --  F   G7  \n"
+        "\n"
+    )
+    assert song.transpose(2) == ChordProgression.from_string(
+        "D -- G A7 Bm G D A D -- G A7 D -- G A7"
+    )
+    assert song.chords() == verse.chords() | chorus.chords()
+
+
+def test_windows():
+    prog = ChordProgression.from_string("C F G7 C Am")
+    assert [window.to_string().split() for window in prog.windows(3)] == [
+        ["C", "F", "G7"],
+        ["F", "G7", "C"],
+        ["G7", "C", "Am"],
+    ]
+    assert len(list(prog.windows(2, step=2))) == 2
+    assert list(prog.windows(6)) == []
+
+
+def test_song_sections_share_storage():
+    prog = ChordProgression.from_string("C -- F -- G7 -- C --")
+    song = Song([SongSection("A", prog[:4]), SongSection("B", prog[4:])])
+    assert (
+        song.to_string()
+        == Song(
+            [
+                SongSection("A", ChordProgression.from_string("C -- F --")),
+                SongSection("B", ChordProgression.from_string("G7 -- C --")),
+            ]
+        ).to_string()
+    )
+
+
+def test_transpose_unique_chords():
+    prog = ChordProgression.from_string("C -- F C G C F C")
+    transposed = prog.transpose(2)
+    assert transposed == ChordProgression.from_string("D -- G D A D G D")
+    assert len(transposed.progression.unique()) == 3
+
+
+def test_all_keys():
+    prog = ChordProgression.from_string("C -- Fm7 Bb7 Ebmaj7 -- G7#5 Cmaj C")
+    keys = prog.all_keys()
+    assert list(keys) == list(range(12))
+    for shift, transposed in keys.items():
+        assert [chord.name for chord in transposed.progression] == [
+            chord.transpose(shift).name for chord in prog.progression
+        ]
+    assert keys[0] == prog
+
+
+def test_transpose_cache(monkeypatch):
+    calls = []
+    original_transpose = Chord.transpose
+
+    def transpose(chord, shift):
+        calls.append((chord.name, shift))
+        return original_transpose(chord, shift)
+
+    monkeypatch.setattr(Chord, "transpose", transpose)
+    monkeypatch.setattr(progressions, "_transpose_cache", OrderedDict())
+    prog = ChordProgression.from_string("Dbm9 Gb13 Dbm9 Gb13 " * 10)
+    prog.all_keys(range(-3, 3))
+    prog.all_keys(range(-3, 3))
+    ChordProgression.from_string("Gb13 Dbm9").transpose(1)
+    assert sorted(calls) == sorted(
+        (name, shift) for name in ["Dbm9", "Gb13"] for shift in range(-3, 3)
+    )
+
+
+def test_persistent_edits():
+    history = [ChordProgression.from_string("C F G7 C " * 50).persistent()]
+    assert isinstance(history[0].progression, PersistentChordSequence)
+    assert history[0].persistent() is history[0]
+    expected = [list(history[0].progression)]
+    edits = [
+        ("insert", 0, "Am"),
+        ("replace", 100, "Dm7"),
+        ("delete", -1, None),
+        ("insert", 200, "E7"),
+        ("delete", 50, None),
+        ("replace", -2, "Bb"),
+    ]
+    for op, index, name in edits:
+        chords = list(expected[-1])
+        if op == "insert":
+            chords.insert(index, Chord.from_name(name))
+            history.append(history[-1].insert(index, Chord.from_name(name)))
+        elif op == "replace":
+            chords[index] = Chord.from_name(name)
+            history.append(history[-1].replace(index, Chord.from_name(name)))
+        else:
+            del chords[index]
+            history.append(history[-1].delete(index))
+        expected.append(chords)
+    for version, chords in zip(history, expected):
+        assert list(version.progression) == chords
+        assert version == ChordProgression(chords)
+    with pytest.raises(IndexError):
+        history[-1].replace(len(history[-1]), Chord.from_name("C"))
+
+
+def test_persistent_progression_outputs():
+    prog = ChordProgression.from_string("C -- Fm7 Bb7 Ebmaj7 -- G7#5 Cmaj C")
+    persistent = prog.persistent()
+    assert persistent.to_string() == prog.to_string()
+    assert persistent.midi() == prog.midi()
+    assert persistent.chords() == prog.chords()
+    assert persistent.transpose(3) == prog.transpose(3)
+    assert isinstance(persistent.transpose(3).progression, PersistentChordSequence)
+    assert persistent[2:5] == prog[2:5]
+    assert persistent[::-2] == prog[::-2]
+    assert persistent.repeat(3) == prog.repeat(3)
+    assert isinstance(persistent.repeat(3).progression, PersistentChordSequence)
+    assert (
+        PersistentChordSequence.concat(persistent.progression, prog.progression)
+        == list(prog.progression) * 2
+    )
+
+
 def test_from_txt():
     txt_filename_in = os.path.join(
         os.path.dirname(__file__), "test_data", "test_progression.txt"
@@ -108,6 +363,31 @@ def test_from_txt():
     )
 
 
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 1 << 16])
+def test_iter_txt(chunk_size):
+    txt_filename_in = os.path.join(
+        os.path.dirname(__file__), "test_data", "test_progression.txt"
+    )
+    assert list(
+        ChordProgression.iter_txt(txt_filename_in, chunk_size=chunk_size)
+    ) == ChordProgression.from_string(
+        """C Fm C G7 C E7 Am G G G G G"""
+    ).progression
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 7])
+def test_iter_file_split_tokens(chunk_size):
+    file = io.StringIO("  Cmaj7 --\n  --\tFm7b5  -- G7sus4 ")
+    assert list(
+        ChordProgression.iter_file(file, chunk_size=chunk_size)
+    ) == ChordProgression.from_string("Cmaj7 -- -- Fm7b5 -- G7sus4").progression
+
+
+def test_iter_file_repeat_nothing():
+    with pytest.raises(InvalidProgression):
+        list(ChordProgression.iter_file(io.StringIO("-- C"), chunk_size=1))
+
+
 def test_to_txt():
     txt_filename_in = os.path.join(
         os.path.dirname(__file__), "test_data", "test_progression.txt"
@@ -160,6 +440,22 @@ def test_progression_midi():
     ]
 
 
+def test_ticks_per_chord_no_drift():
+    settings = MidiConversionSettings(
+        filename=None, ticks_per_beat=100, beats_per_chord=1 / 3
+    )
+    ticks_per_chord = progressions._get_ticks_per_chord(settings, 300)
+    assert ticks_per_chord[:6] == [33, 34, 33, 33, 34, 33]
+    assert sum(ticks_per_chord) == 10000
+    assert settings.beats_per_chord == 1 / 3
+
+    settings = MidiConversionSettings(
+        filename=None, ticks_per_beat=480, beats_per_chord=[0.1, 0.2, 0.7, 1, 2.5]
+    )
+    assert progressions._get_ticks_per_chord(settings, 5) == [48, 96, 336, 480, 1200]
+    assert settings.beats_per_chord == [0.1, 0.2, 0.7, 1, 2.5]
+
+
 def test_progression_to_midi():
     midi_filename = os.path.join(
         os.path.dirname(__file__), "test_data", "test_progression.midi"
@@ -186,6 +482,264 @@ def test_progression_from_midi():
         os.remove(midi_filename)
 
 
+def test_timed_progression_from_midi():
+    midi_filename = os.path.join(
+        os.path.dirname(__file__), "test_data", "test_progression.midi"
+    )
+
+    original = ChordProgression.from_string("""C Fm C G7 C E7 Am G""")
+    settings = MidiConversionSettings(
+        filename=midi_filename, tempo=120, beats_per_chord=[2, 1, 1, 4, 2, 2, 1, 3]
+    )
+    try:
+        timed = original.to_midi(settings)
+        assert timed.progression == original
+        assert timed.onsets == [0, 960, 1440, 1920, 3840, 4800, 5760, 6240]
+        assert timed.durations == [960, 480, 480, 1920, 960, 960, 480, 1440]
+        assert timed.chord_at(1500) == Chord.from_name("C")
+        assert timed.index_at(7679) == 7
+        assert timed.index_at(7680) is None
+
+        read = TimedChordProgression.from_midi_file(midi_filename)
+        assert read.progression == original
+        assert read.onsets == pytest.approx([onset / 960 for onset in timed.onsets])
+        assert read.durations == pytest.approx(
+            [duration / 960 for duration in timed.durations]
+        )
+    finally:
+        os.remove(midi_filename)
+
+
+def test_timed_progression():
+    prog = ChordProgression.from_string("C F G7 C")
+    timed = TimedChordProgression(prog, [0, 2, 3, 10], [4, 1, 2, 5])
+    assert timed == eval(repr(timed))
+    assert len(timed) == 4
+    assert timed[1] == TimedChord(Chord.from_name("F"), 2, 1)
+    assert [timed.index_at(time) for time in [-1, 0, 2, 3, 4.5, 5, 9, 10, 15]] == [
+        None,
+        0,
+        1,
+        2,
+        2,
+        None,
+        None,
+        3,
+        None,
+    ]
+    assert timed.chord_at(2.5) == Chord.from_name("F")
+    assert [timed_chord.onset for timed_chord in timed.between(3.5, 10)] == [0, 3]
+    assert timed.between(5, 10) == []
+    assert TimedChordProgression.from_durations(
+        prog, [2, 1, 7, 5], start=1
+    ) == TimedChordProgression(prog, [1, 3, 4, 11], [2, 1, 7, 5])
+    with pytest.raises(ValueError):
+        TimedChordProgression(prog, [0, 1, 2], [1, 1, 1])
+    with pytest.raises(ValueError):
+        TimedChordProgression(prog, [0, 2, 1, 3], [1, 1, 1, 1])
+
+
+def read_meta_messages(filename):
+    import mido
+
+    messages = []
+    time = 0
+    for message in mido.MidiFile(filename).tracks[0]:
+        time += message.time
+        if message.type == "set_tempo":
+            messages.append((time, "tempo", round(mido.tempo2bpm(message.tempo))))
+        elif message.type == "time_signature":
+            messages.append(
+                (time, "time_signature", (message.numerator, message.denominator))
+            )
+    return messages
+
+
+def test_progression_to_midi_tempo_changes():
+    import mido
+
+    midi_filename = os.path.join(
+        os.path.dirname(__file__), "test_data", "test_progression.midi"
+    )
+    settings = MidiConversionSettings(
+        filename=midi_filename,
+        tempo=100,
+        beats_per_chord=[4, 4, 3, 3, 4],
+        tempo_changes={2: 60, 4: 120},
+        time_signatures=[(0, (4, 4)), (2, (3, 4)), (4, (4, 4))],
+    )
+    try:
+        ChordProgression.from_string("C F G7 Am C").to_midi(settings)
+        assert read_meta_messages(midi_filename) == [
+            (0, "tempo", 100),
+            (0, "time_signature", (4, 4)),
+            (3840, "tempo", 60),
+            (3840, "time_signature", (3, 4)),
+            (6720, "tempo", 120),
+            (6720, "time_signature", (4, 4)),
+        ]
+        assert mido.MidiFile(midi_filename).length == pytest.approx(12.8)
+    finally:
+        os.remove(midi_filename)
+
+    with pytest.raises(ValueError):
+        ChordProgression.from_string("C F").to_midi(
+            MidiConversionSettings(filename=midi_filename, tempo_changes={2: 60})
+        )
+
+
+def test_song_to_midi_tempo_changes():
+    midi_filename = os.path.join(os.path.dirname(__file__), "test_data", "song.midi")
+    intro = SongSection("Intro", ChordProgression.from_string("C F"), tempo=60)
+    verse = SongSection(
+        "Verse", ChordProgression.from_string("G7 C"), 90, time_signature=(3, 4)
+    )
+    outro = SongSection("Outro", ChordProgression.from_string("C"), tempo=90)
+    song = Song([intro, verse, verse, outro])
+    assert song == eval(repr(song))
+    try:
+        song.to_midi(
+            MidiConversionSettings(
+                filename=midi_filename, beats_per_chord=3, tempo_changes={6: 40}
+            )
+        )
+        assert read_meta_messages(midi_filename) == [
+            (0, "tempo", 60),
+            (2880, "tempo", 90),
+            (2880, "time_signature", (3, 4)),
+            (8640, "tempo", 40),
+        ]
+    finally:
+        os.remove(midi_filename)
+
+
+def note_events(track):
+    events = []
+    time = 0
+    for message in track:
+        time += message.time
+        if message.type in ("note_on", "note_off"):
+            events.append((time, message.type, message.note, message.velocity))
+    return events
+
+
+def test_progression_to_midi_tracks():
+    import mido
+    from jchord.midi_effects import Arpeggiator, Chain, Spreader, Transposer
+
+    def make_tracks():
+        return [
+            MidiTrackSettings(name="Comping", instrument=5),
+            MidiTrackSettings(
+                Chain(Transposer(-12), Spreader(amount=20, jitter=5, seed=3)),
+                instrument=34,
+                channel=1,
+                velocity=80,
+            ),
+            MidiTrackSettings(
+                Arpeggiator(rate=1 / 8, pattern=[0, 1, 2]), instrument=12, channel=2
+            ),
+        ]
+
+    prog = ChordProgression.from_string("C -- Fm7 Bb7 Ebmaj7 -- G7 C")
+    data_dir = os.path.join(os.path.dirname(__file__), "test_data")
+    filenames = [os.path.join(data_dir, f"tracks_{i}.midi") for i in range(3)]
+    try:
+        prog.to_midi(
+            MidiConversionSettings(
+                filename=filenames[0], tracks=make_tracks(), tempo_changes={4: 90}
+            )
+        )
+        prog.to_midi(
+            MidiConversionSettings(
+                filename=filenames[1],
+                tracks=make_tracks(),
+                tempo_changes={4: 90},
+                workers=2,
+            )
+        )
+        with open(filenames[0], "rb") as first, open(filenames[1], "rb") as second:
+            assert first.read() == second.read()
+
+        tracks = mido.MidiFile(filenames[0]).tracks
+        assert len(tracks) == 3
+        assert tracks[0][0] == mido.MetaMessage("track_name", name="Comping", time=0)
+        assert [message.type for message in tracks[1][:2]] == [
+            "program_change",
+            "note_on",
+        ]
+        assert sum(message.type == "set_tempo" for message in tracks[0]) == 2
+        assert not any(message.type == "set_tempo" for message in tracks[1])
+        for index, (track, track_settings) in enumerate(zip(tracks, make_tracks())):
+            prog.to_midi(
+                MidiConversionSettings(
+                    filename=filenames[2],
+                    tempo_changes={4: 90},
+                    instrument=track_settings.instrument,
+                    effect=track_settings.effect,
+                    velocity=track_settings.velocity or 100,
+                )
+            )
+            single = mido.MidiFile(filenames[2]).tracks[0]
+            assert {msg.channel for msg in track if not msg.is_meta} == {index}
+            assert note_events(track) == note_events(single)
+    finally:
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+def test_progression_to_midi_tracks_effect_state(tmp_path):
+    from jchord.midi_effects import AlternatingInverter, Arpeggiator
+
+    prog = ChordProgression.from_string("C -- Fm7 Bb7 Ebmaj7 -- G7 C")
+    states = []
+    for workers in (1, 2):
+        effects = [Arpeggiator(rate=1 / 8, pattern=[0, 1, 2], sticky=True)]
+        effects.append(AlternatingInverter())
+        prog.to_midi(
+            MidiConversionSettings(
+                filename=str(tmp_path / f"tracks_{workers}.midi"),
+                tracks=[
+                    MidiTrackSettings(effect, channel=i)
+                    for i, effect in enumerate(effects)
+                ],
+                workers=workers,
+            )
+        )
+        states.append([effect.get_state() for effect in effects])
+    assert states[0] == states[1]
+    assert states[0] != [0, 1]
+
+    with pytest.raises(ValueError):
+        prog.to_midi(
+            MidiConversionSettings(
+                filename=str(tmp_path / "tracks.midi"),
+                effect=AlternatingInverter(),
+                tracks=[MidiTrackSettings(name="Comping")],
+            )
+        )
+
+
+def test_progression_to_midi_one_track():
+    prog = ChordProgression.from_string("C -- Fm7 Bb7 Ebmaj7 -- G7 C")
+    data_dir = os.path.join(os.path.dirname(__file__), "test_data")
+    filenames = [os.path.join(data_dir, f"tracks_{i}.midi") for i in range(2)]
+    try:
+        prog.to_midi(MidiConversionSettings(filename=filenames[0], instrument=3))
+        prog.to_midi(
+            MidiConversionSettings(
+                filename=filenames[1], tracks=[MidiTrackSettings(instrument=3)]
+            )
+        )
+        with open(filenames[0], "rb") as first, open(filenames[1], "rb") as second:
+            assert first.read() == second.read()
+    finally:
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
 def test_song_to_string():
     intro = SongSection("Intro", ChordProgression.from_string("""C Fm G7"""))
     main = SongSection(
@@ -206,6 +760,69 @@ C   E7  Am  G
     )
 
 
+@pytest.mark.parametrize("repeat", ["replay", "hold"])
+@pytest.mark.parametrize("with_effect", [False, True])
+def test_song_to_midi(monkeypatch, repeat, with_effect):
+    from jchord.midi_effects import Chain, AlternatingInverter, Spreader
+
+    def make_settings(filename):
+        return MidiConversionSettings(
+            filename=filename,
+            repeat=repeat,
+            beats_per_chord=[2, 1, 1] * 2 + [1, 1] * 3,
+            effect=Chain(AlternatingInverter(), Spreader(amount=10, jitter=3, seed=1))
+            if with_effect
+            else None,
+        )
+
+    intro = SongSection("Intro", ChordProgression.from_string("C F F"))
+    main = SongSection("Main", ChordProgression.from_string("F G7"))
+    song = Song([intro, intro, main, main, main])
+
+    rendered = []
+    original_iter_played_chords = progressions._iter_played_chords
+
+    def iter_played_chords(midi_runs, ticks_per_chord, settings):
+        rendered.append(list(ticks_per_chord))
+        return original_iter_played_chords(midi_runs, ticks_per_chord, settings)
+
+    song_filename = os.path.join(os.path.dirname(__file__), "test_data", "song.midi")
+    flat_filename = os.path.join(os.path.dirname(__file__), "test_data", "flat.midi")
+    try:
+        ChordProgression.concat(
+            *(section.progression for section in song.sections)
+        ).to_midi(make_settings(flat_filename))
+        monkeypatch.setattr(progressions, "_iter_played_chords", iter_played_chords)
+        song.to_midi(make_settings(song_filename))
+        with open(song_filename, "rb") as song_file, open(
+            flat_filename, "rb"
+        ) as flat_file:
+            assert song_file.read() == flat_file.read()
+    finally:
+        os.remove(song_filename)
+        os.remove(flat_filename)
+    assert rendered == [[960, 480, 480], [480, 480]]
+
+
+def test_song_from_progression():
+    a = "Dm7 G7 Cmaj7 A7 Dm7 G7 Cmaj7 --"
+    b = "Em7b5 A7 Dm7 -- G7 -- Cmaj7 --"
+    prog = ChordProgression.from_string(" ".join([a, a, b, a] * 2 + ["Fmaj7 Fm6"]))
+    song = Song.from_progression(prog)
+    assert [section.name for section in song.sections] == ["A", "A", "B", "A"] * 2 + [
+        "C"
+    ]
+    assert song.sections[0] is song.sections[1]
+    assert song.sections[0].progression == ChordProgression.from_string(a)
+    assert song.sections[2].progression == ChordProgression.from_string(b)
+    assert song.sections[0].progression[0] is prog[0]
+    assert (
+        ChordProgression.concat(*(section.progression for section in song.sections))
+        == prog
+    )
+    assert song.to_string().startswith("A (x2)\n")
+
+
 def test_song_repr():
     intro = SongSection("Intro", ChordProgression.from_string("""C Fm G7"""))
     main = SongSection("Main", ChordProgression.from_string("""C Fm C G7 C E7 Am G"""))
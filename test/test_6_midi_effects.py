@@ -3,13 +3,18 @@ import random
 import pytest
 
 from jchord.midi import MidiNote
+from jchord.progressions import MidiConversionSettings
 from jchord.midi_effects import (
     AlternatingInverter,
+    Arpeggiator,
     Chain,
     Doubler,
+    Harmonizer,
     Inverter,
+    Legato,
     Spreader,
     Transposer,
+    VelocityControl,
 )
 
 
@@ -66,6 +71,29 @@ def test_spreader():
     ]
 
 
+def test_spreader_seeded():
+    chord = notes([1, 2, 3, 4])
+    first = Spreader(amount=10, jitter=10, seed=1234).apply(chord)
+    # The input is not modified
+    assert chord == notes([1, 2, 3, 4])
+    # The global random state doesn't matter
+    random.seed(0)
+    assert Spreader(amount=10, jitter=10, seed=1234).apply(chord) == first
+    assert Spreader(amount=10, jitter=10, seed=4321).apply(chord) != first
+    for i, note in enumerate(first):
+        assert 10 * i - 10 <= note.time <= 10 * i + 10
+
+
+def test_spreader_seeded_order_independent():
+    early = notes([60, 64])
+    late = held([60, 64], time=1920)
+    effect = Spreader(amount=0, jitter=50, seed="abc")
+    in_order = [effect.apply(early), effect.apply(late)]
+    effect = Spreader(amount=0, jitter=50, seed="abc")
+    out_of_order = [effect.apply(late), effect.apply(early)]
+    assert in_order == out_of_order[::-1]
+
+
 def test_chain():
     assert Chain(Doubler(12), Spreader(amount=10, jitter=0), Inverter()).apply(
         notes([1, 2, 3, 4, 12])
@@ -81,3 +109,193 @@ def test_chain():
         MidiNote(time=10.0, note=2, duration=0, velocity=0),
         MidiNote(time=0.0, note=1, duration=0, velocity=0),
     ]
+
+
+def timed_notes(times):
+    return [MidiNote(note=60, time=t, duration=0, velocity=0) for t in times]
+
+
+def test_velocity_control_linear():
+    effect = VelocityControl([(0, 0), (1, 100), (2, 50)])
+    assert [
+        note.velocity
+        for note in effect.apply(timed_notes([0, 960, 1920, 2880, 3840 + 960]))
+    ] == [0, 50, 100, 75, 50]
+
+
+def test_velocity_control_single_keyframe():
+    effect = VelocityControl([(3, 80)])
+    assert [note.velocity for note in effect.apply(timed_notes([0, 1920, 5760]))] == [
+        80,
+        80,
+        80,
+    ]
+
+
+@pytest.mark.parametrize("shape", ["linear", "exponential", "s-curve"])
+def test_velocity_control_shapes_hit_keyframes(shape):
+    effect = VelocityControl([(0, 20), (1, 120), (2, 20)], shape=shape)
+    velocities = [
+        note.velocity for note in effect.apply(timed_notes([0, 480, 960, 1920]))
+    ]
+    assert velocities[0] == 20
+    assert velocities[-1] == 120
+    assert 20 < velocities[1] < velocities[2] < 120
+
+
+def test_velocity_control_invalid():
+    with pytest.raises(ValueError):
+        VelocityControl([])
+    with pytest.raises(ValueError):
+        VelocityControl([(0, 0), (1, 100)], shape="wobbly")
+
+
+MAJOR = [0, 2, 4, 5, 7, 9, 11]
+
+
+def test_harmonizer():
+    effect = Harmonizer(scale=MAJOR, degrees=[3, 5], root="C")
+    assert effect.apply(notes([60, 62, 71])) == notes(
+        [60, 64, 67, 62, 65, 69, 71, 74, 77]
+    )
+
+
+def test_harmonizer_other_root():
+    effect = Harmonizer(scale=MAJOR, degrees=[1, 3], root="D")
+    assert effect.apply(notes([62, 66])) == notes([62, 62, 66, 66, 66, 69])
+
+
+def test_harmonizer_out_of_scale():
+    with pytest.raises(ValueError):
+        Harmonizer(scale=MAJOR, degrees=[3], root="C").apply(notes([61]))
+
+
+def test_harmonizer_snap():
+    effect = Harmonizer(scale=MAJOR, degrees=[1, 3], root="C", out_of_scale="snap")
+    # C# snaps down to C, so the harmony is C and E
+    assert effect.apply(notes([61])) == notes([61, 60, 64])
+    # F# is between F and G, ties go down to F, so the harmony is F and A
+    assert effect.apply(notes([66])) == notes([66, 65, 69])
+
+
+def held(ints, time=0, duration=1920):
+    return [MidiNote(note=x, time=time, duration=duration, velocity=0) for x in ints]
+
+
+def test_arpeggiator():
+    effect = Arpeggiator(rate=1 / 8, pattern=[0, (1, 2), -1])
+    effect.set_settings(MidiConversionSettings(filename=None, velocity=90))
+    assert effect.apply(held([60, 64, 67], duration=720)) == [
+        MidiNote(time=0, note=60, duration=240, velocity=90),
+        MidiNote(time=240, note=64, duration=240, velocity=90),
+        MidiNote(time=240, note=67, duration=240, velocity=90),
+        MidiNote(time=480, note=67, duration=240, velocity=90),
+    ]
+
+
+def test_arpeggiator_sticky():
+    effect = Arpeggiator(rate=1 / 4, pattern=[0, 1, 2], sticky=True)
+    effect.set_settings(MidiConversionSettings(filename=None))
+    first = effect.apply(held([60, 64, 67], duration=960))
+    second = effect.apply(held([62, 65, 69], time=960, duration=960))
+    assert [note.note for note in first + second] == [60, 64, 69, 62]
+    assert [note.time for note in first + second] == [0, 480, 960, 1440]
+
+
+def test_effect_state():
+    effect = Chain(AlternatingInverter(), Arpeggiator(rate=1 / 4, pattern=[0, 1]))
+    effect.set_settings(MidiConversionSettings(filename=None))
+    state = effect.get_state()
+    first = effect.apply(held([60, 64, 67], duration=960))
+    assert effect.get_state() != state
+    effect.set_state(state)
+    assert effect.apply(held([60, 64, 67], duration=960)) == first
+
+
+def test_arpeggiator_integer_ticks():
+    effect = Arpeggiator(rate=1 / 12, pattern=[0])
+    effect.set_settings(MidiConversionSettings(filename=None, ticks_per_beat=100))
+    out = effect.apply(held([60], duration=400))
+    assert [note.time for note in out] == [round(i * 400 / 12) for i in range(12)]
+    assert all(isinstance(note.duration, int) for note in out)
+    assert out[-1].time + out[-1].duration == 400
+
+
+def test_stream_chords_matches_apply():
+    chords = [held([60, 64, 67], time=0, duration=960), held([62, 65], time=960)]
+    expected = Chain(Spreader(amount=100, jitter=0), AlternatingInverter()).apply(
+        list(chords[0])
+    ) + Chain(Spreader(amount=100, jitter=0), AlternatingInverter(init_state=0)).apply(
+        list(chords[1])
+    )
+    effect = Chain(Spreader(amount=100, jitter=0), AlternatingInverter())
+    streamed = list(effect.stream_chords(iter(chords)))
+    assert streamed == sorted(expected, key=lambda note: note.time)
+
+
+@pytest.mark.parametrize(
+    "make_effect",
+    [
+        lambda: Chain(Spreader(300, 0), Arpeggiator(1 / 8, [2, 1, 0])),
+        lambda: Chain(Inverter(), Spreader(200, 0), Arpeggiator(1 / 16, [0, 1, 2, 3])),
+        lambda: Chain(Spreader(-100, 0), Arpeggiator(1 / 8, [0, 1, 2, 3])),
+        lambda: Spreader(-700, 0),
+    ],
+)
+def test_stream_chords_staggered_arpeggio(make_effect):
+    # Am7 D7 Gmaj7 Cmaj7
+    chords = [
+        held([57, 60, 64, 67], time=0),
+        held([62, 66, 69, 72], time=1920),
+        held([55, 59, 62, 66], time=3840),
+        held([60, 64, 67, 71], time=5760),
+    ]
+    expected = []
+    for chord in chords:
+        effect = make_effect()
+        effect.set_settings(MidiConversionSettings(filename=None))
+        expected += effect.apply(list(chord))
+    effect = make_effect()
+    effect.set_settings(MidiConversionSettings(filename=None))
+    streamed = list(effect.stream_chords(iter(chords)))
+    assert streamed == sorted(expected, key=lambda note: note.time)
+
+
+def test_stream_chords_is_lazy():
+    effect = Arpeggiator(rate=1 / 16, pattern=[0, 1])
+    effect.set_settings(MidiConversionSettings(filename=None))
+
+    def chords():
+        for i in range(10**9):
+            yield held([60, 64], time=i * 1920)
+
+    stream = effect.stream_chords(chords())
+    assert [next(stream).time for _ in range(20)] == [i * 120 for i in range(20)]
+
+
+def test_legato():
+    stream = [
+        MidiNote(time=0, note=60, duration=10, velocity=0),
+        MidiNote(time=0, note=64, duration=10, velocity=0),
+        MidiNote(time=100, note=62, duration=10, velocity=0),
+        MidiNote(time=250, note=65, duration=10, velocity=0),
+    ]
+    assert list(Legato(overlap=5).stream(iter(stream))) == [
+        MidiNote(time=0, note=60, duration=105, velocity=0),
+        MidiNote(time=0, note=64, duration=105, velocity=0),
+        MidiNote(time=100, note=62, duration=155, velocity=0),
+        MidiNote(time=250, note=65, duration=10, velocity=0),
+    ]
+
+
+def test_chain_with_streaming_effect():
+    chords = [held([60, 64], time=0, duration=100), held([62], time=480)]
+    effect = Chain(Transposer(12), Legato(), Doubler(-12))
+    assert list(effect.stream_chords(chords)) == [
+        MidiNote(time=0, note=60, duration=480, velocity=0),
+        MidiNote(time=0, note=64, duration=480, velocity=0),
+        MidiNote(time=0, note=72, duration=480, velocity=0),
+        MidiNote(time=0, note=76, duration=480, velocity=0),
+        MidiNote(time=480, note=62, duration=1920, velocity=0),
+        MidiNote(time=480, note=74, duration=1920, velocity=0),
+    ]
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from jchord.find_sections import find_sections
+
+
+def reassemble(codes, sections):
+    out = []
+    for start, length, _ in sections:
+        out.extend(codes[start : start + length])
+    return out
+
+
+def test_find_sections_empty():
+    assert find_sections([]) == []
+
+
+def test_find_sections_no_repeats():
+    assert find_sections([1, 2, 3, 4, 5, 6]) == [(0, 6, 0)]
+
+
+def test_find_sections_aaba():
+    a = [1, 2, 3, 4, 1, 2, 3, 3]
+    b = [5, 4, 1, 1, 2, 2, 3, 3]
+    codes = (a + a + b + a) * 3 + [6, 7]
+    assert [(length, section) for _, length, section in find_sections(codes)] == [
+        (8, 0),
+        (8, 0),
+        (8, 1),
+        (8, 0),
+    ] * 3 + [(2, 2)]
+
+
+def test_find_sections_min_length():
+    codes = [1, 2, 1, 2, 1, 2]
+    assert find_sections(codes, min_length=2) == [(0, 2, 0), (2, 2, 0), (4, 2, 0)]
+    assert find_sections(codes, min_length=3) == [(0, 6, 0)]
+    with pytest.raises(ValueError):
+        find_sections(codes, min_length=0)
+
+
+def test_find_sections_max_length():
+    codes = [1, 2, 3, 4, 5, 6] * 2
+    assert find_sections(codes, max_length=4) == [
+        (0, 4, 0),
+        (4, 2, 1),
+        (6, 4, 0),
+        (10, 2, 2),
+    ]
+    assert find_sections(codes, max_length=6) == [(0, 6, 0), (6, 6, 0)]
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("alphabet", [2, 5, 20])
+def test_find_sections_covers_sequence(seed, alphabet):
+    rng = random.Random(seed)
+    codes = [rng.randrange(alphabet) for _ in range(500)]
+    sections = find_sections(codes, min_length=3)
+    assert reassemble(codes, sections) == codes
+    first = {}
+    for start, length, section in sections:
+        first.setdefault(section, codes[start : start + length])
+        assert codes[start : start + length] == first[section]
+    assert sorted(first) == list(range(len(first)))
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from jchord.chords import Chord
+from jchord.midi_effects import (
+    AlternatingInverter,
+    Arpeggiator,
+    Chain,
+    Legato,
+    Spreader,
+)
+from jchord import render_session
+from jchord.progressions import ChordProgression, MidiConversionSettings
+from jchord.render_session import MidiRenderSession
+
+EFFECTS = {
+    "none": lambda: None,
+    "stateful": lambda: Chain(
+        Spreader(amount=20, jitter=5, seed=1),
+        AlternatingInverter(),
+        Arpeggiator(rate=1 / 16, pattern=[0, 1, 2], sticky=True),
+    ),
+    "streaming": lambda: Chain(AlternatingInverter(), Legato(overlap=10)),
+}
+
+
+def to_midi_bytes(chords, beats_per_chord, effect, repeat):
+    filename = os.path.join(os.path.dirname(__file__), "test_data", "session.midi")
+    try:
+        ChordProgression(list(chords)).to_midi(
+            MidiConversionSettings(
+                filename=filename,
+                effect=EFFECTS[effect](),
+                repeat=repeat,
+                beats_per_chord=beats_per_chord,
+            )
+        )
+        with open(filename, "rb") as file:
+            return file.read()
+    finally:
+        os.remove(filename)
+
+
+@pytest.mark.parametrize("repeat", ["replay", "hold"])
+@pytest.mark.parametrize("effect", EFFECTS)
+def test_render_session_matches_to_midi(effect, repeat):
+    session = MidiRenderSession(
+        ChordProgression.from_string("C C F G7 C Am Dm G7 C --"),
+        MidiConversionSettings(
+            filename="session.midi", effect=EFFECTS[effect](), repeat=repeat
+        ),
+    )
+
+    def check():
+        assert session.to_bytes() == to_midi_bytes(
+            session.chords, session.beats_per_chord, effect, repeat
+        )
+
+    check()
+    session[3] = Chord.from_name("C")
+    check()
+    session[-1] = Chord.from_name("Am")
+    check()
+    session.insert(0, Chord.from_name("E7"), beats=2)
+    check()
+    session.append(Chord.from_name("F"))
+    check()
+    del session[5]
+    check()
+    session.set_beats(2, 1.5)
+    check()
+    while len(session):
+        del session[0]
+    check()
+
+
+def test_render_session_renders_edited_chord(monkeypatch):
+    applied = []
+
+    class CountingInverter(AlternatingInverter):
+        def apply(self, chord):
+            applied.append(chord[0].time)
+            return super().apply(chord)
+
+    encoded = []
+
+    def encode_notes(notes, velocity):
+        notes = list(notes)
+        encoded.append(notes[0].time)
+        return original_encode_notes(notes, velocity)
+
+    original_encode_notes = render_session.encode_notes
+    monkeypatch.setattr(render_session, "encode_notes", encode_notes)
+
+    session = MidiRenderSession(
+        ChordProgression.from_string("C F G7 C " * 25),
+        MidiConversionSettings(
+            filename="session.midi", effect=CountingInverter(), beats_per_chord=1
+        ),
+    )
+    session.to_bytes()
+    assert len(applied) == 100
+    assert len(encoded) == 100
+
+    applied.clear()
+    encoded.clear()
+    session[50] = Chord.from_name("Am")
+    session.to_bytes()
+    assert applied == [50 * 480]
+    assert encoded == [50 * 480]
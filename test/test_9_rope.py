@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from jchord import rope
+
+
+def check_balanced(tree):
+    if isinstance(tree, rope.RopeNode):
+        assert tree.left and tree.right
+        assert abs(rope.height(tree.left) - rope.height(tree.right)) <= 1
+        assert tree.length == len(tree.left) + len(tree.right)
+        check_balanced(tree.left)
+        check_balanced(tree.right)
+    else:
+        assert len(tree) <= rope.MAX_LEAF_SIZE
+
+
+def items(tree):
+    return [item for leaf in rope.iter_leaves(tree) for item in leaf]
+
+
+@pytest.mark.parametrize("n_items", [0, 1, 31, 32, 33, 1000])
+def test_build(n_items):
+    tree = rope.build(range(n_items))
+    check_balanced(tree)
+    assert items(tree) == list(range(n_items))
+    assert [rope.get(tree, i) for i in range(n_items)] == list(range(n_items))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_edits(seed):
+    rng = random.Random(seed)
+    expected = list(range(200))
+    tree = rope.build(expected)
+    for step in range(2000):
+        op = rng.choice(["insert", "delete", "replace"] if expected else ["insert"])
+        if op == "insert":
+            index = rng.randint(0, len(expected))
+            expected.insert(index, step)
+            tree = rope.insert(tree, index, step)
+        elif op == "delete":
+            index = rng.randrange(len(expected))
+            del expected[index]
+            tree = rope.delete(tree, index)
+        else:
+            index = rng.randrange(len(expected))
+            expected[index] = step
+            tree = rope.replace(tree, index, step)
+        check_balanced(tree)
+    assert items(tree) == expected
+
+
+def test_edits_share_structure():
+    before = rope.build(range(10000))
+    after = rope.replace(before, 5000, "x")
+    assert items(before) == list(range(10000))
+    assert rope.get(after, 5000) == "x"
+    assert after.left is before.left
+
+
+@pytest.mark.parametrize("index", [0, 1, 32, 500, 999, 1000])
+def test_split_join(index):
+    tree = rope.build(range(1000))
+    left, right = rope.split(tree, index)
+    check_balanced(left)
+    check_balanced(right)
+    assert items(left) == list(range(index))
+    assert items(right) == list(range(index, 1000))
+    joined = rope.join(right, left)
+    check_balanced(joined)
+    assert items(joined) == list(range(index, 1000)) + list(range(index))
+
+
+def test_join_different_heights():
+    tree = rope.join(rope.build(range(5000)), rope.build(range(3)))
+    check_balanced(tree)
+    assert items(tree) == list(range(5000)) + [0, 1, 2]
+
+
+@pytest.mark.parametrize("times", [0, 1, 2, 7, 64])
+def test_repeat(times):
+    tree = rope.repeat(rope.build(range(40)), times)
+    check_balanced(tree)
+    assert items(tree) == list(range(40)) * times
+
+
+def test_map_leaves():
+    calls = []
+
+    def double(leaf):
+        calls.append(leaf)
+        return tuple(item * 2 for item in leaf)
+
+    tree = rope.repeat(rope.build(range(64)), 1000)
+    mapped = rope.map_leaves(tree, double)
+    assert items(mapped) == [item * 2 for item in range(64)] * 1000
+    assert len(calls) == 2